@@ -0,0 +1,579 @@
+# async_server.py
+# asyncio engine for the file sharing server: one event loop serves every
+# connection, so thousands of idle logged-in sessions cost almost nothing.
+# Speaks exactly the same framed protocol as handle_client in auth_server.py.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from caesar_cipher import caesar_encrypt, caesar_decrypt
+from protocol import AsyncFramedStream, MSG_CONTROL, MSG_DATA, MSG_END, ProtocolError, parse_options
+import segments
+from auth_server import (
+    register_user,
+    valid_username,
+    invalid_file_command,
+    DATA_COMMANDS,
+    authenticate_user,
+    list_user_files,
+    list_page_reply,
+    PendingUpload,
+    UploadError,
+    RangeUpload,
+    DeltaUpload,
+    delta_signatures,
+    upload_offset,
+    upload_by_hash,
+    upload_ranges,
+    commit_upload,
+    open_user_file,
+    download_start,
+    wire_chunks,
+    sends_stored_file,
+    hello_reply,
+    stats_reply,
+    is_admin,
+    CommandMeter,
+    note_reply,
+    delete_user_file,
+    create_session,
+    resume_session,
+    end_session,
+    connection_log,
+    session_log,
+    transfer_log,
+    files_log,
+    server_log,
+    wire_log,
+)
+
+# ============================================================================
+# NETWORK FUNCTIONS
+# ============================================================================
+
+async def send_encrypted(stream, message):
+    # Encrypts and sends a message as one CONTROL frame.
+    encrypted = caesar_encrypt(message)
+    await stream.send_frame(MSG_CONTROL, encrypted.encode('utf-8'))
+
+    # Shows encrypted and plain text (--log-payloads)
+    wire_log.info('ENCRYPTED REPLY', "%s", encrypted)
+    wire_log.info('SENT', "%s", message)
+    note_reply(message)
+
+async def receive_encrypted(stream):
+    # Receives one CONTROL frame and decrypts it.
+    # Returns None if the client closed the connection.
+    frame_type, payload = await stream.recv_frame()
+    if frame_type is None:
+        return None
+    if frame_type != MSG_CONTROL:
+        raise ProtocolError(f"Expected a command, got frame type {frame_type}")
+    encrypted = payload.decode('utf-8')
+
+    decrypted = caesar_decrypt(encrypted)
+    wire_log.info('ENCRYPTED MESSAGE', "%s", encrypted)
+    wire_log.info('DECRYPTED MESSAGE', "%s", decrypted)
+
+    return decrypted
+
+# ============================================================================
+# CLIENT HANDLER
+# ============================================================================
+
+class AsyncClientHandler:
+    # Serves one connection. Mirrors handle_client() command for command;
+    # anything that touches the disk or users.txt runs in the executor so
+    # the event loop never blocks.
+
+    def __init__(self, stream, client_address, executor):
+        self.stream = stream
+        self.client_address = client_address
+        self.executor = executor
+        self.authenticated = False
+        self.current_user = None
+        self.session_token = None
+
+    async def run_blocking(self, func, *args):
+        # Runs a blocking function in the executor and waits for it.
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def serve(self):
+        connection_log.info('NEW CONNECTION', "%s connected.",
+                            self.client_address, client=self.client_address)
+
+        commands = {
+            "HELLO": self.do_hello,
+            "STATS": self.do_stats,
+            "REGISTER": self.do_register,
+            "LOGIN": self.do_login,
+            "RESUME": self.do_resume,
+            "LOGOUT": self.do_logout,
+            "UPLOAD": self.do_upload,
+            "UPLOAD_HASH": self.do_upload_hash,
+            "UPLOAD_OFFSET": self.do_upload_offset,
+            "UPLOAD_RANGE": self.do_upload_range,
+            "UPLOAD_RANGES": self.do_upload_ranges,
+            "UPLOAD_COMMIT": self.do_upload_commit,
+            "DELTA_SIGNATURES": self.do_delta_signatures,
+            "UPLOAD_DELTA": self.do_upload_delta,
+            "DOWNLOAD": self.do_download,
+            "LIST": self.do_list,
+            "DELETE": self.do_delete,
+        }
+
+        meter = CommandMeter(self.stream)
+        try:
+            while True:
+                meter.finish(self.current_user)
+                # Receive encrypted command from client
+                message = await receive_encrypted(self.stream)
+                if not message:
+                    break
+
+                parts = message.split('|')
+                command = parts[0]
+                meter.start(command, message)
+
+                if command == "EXIT":
+                    # Client wants to disconnect
+                    await send_encrypted(self.stream, "GOODBYE")
+                    break
+
+                if invalid_file_command(parts):
+                    if command in DATA_COMMANDS:
+                        await self.stream.skip_data()
+                    await send_encrypted(self.stream, "ERROR|Invalid filename.")
+                    continue
+
+                handler = commands.get(command)
+                if handler is not None:
+                    await handler(parts)
+
+        except Exception as e:
+            connection_log.error('ERROR', "Exception with %s: %s",
+                                 self.client_address, e,
+                                 client=self.client_address, error=str(e))
+        finally:
+            meter.close(self.current_user)
+            await self.stream.close()
+            connection_log.info('DISCONNECTED', "%s disconnected.",
+                                self.client_address, client=self.client_address)
+
+    # ------------------------------------------------------------------
+    # Commands
+    # ------------------------------------------------------------------
+
+    async def do_hello(self, parts):
+        # Format: HELLO|compress=zlib,lzma,bz2
+        await send_encrypted(self.stream, hello_reply(parts))
+
+    async def do_stats(self, parts):
+        # Server statistics (admins only)
+        if not self.authenticated or not is_admin(self.current_user):
+            await send_encrypted(self.stream, "ERROR|Permission denied.")
+            return
+        await send_encrypted(self.stream, stats_reply())
+
+    async def do_register(self, parts):
+        username = parts[1]
+        password = parts[2]
+
+        session_log.debug('REGISTER', "Attempting to register user: %s",
+                          username, user=username)
+
+        if not valid_username(username):
+            session_log.warning('ERROR', "Invalid username %r.", username, user=username)
+            await send_encrypted(self.stream, "ERROR|Invalid username.")
+        elif await self.run_blocking(register_user, username, password):
+            session_log.info('SUCCESS', "User '%s' registered.", username, user=username)
+            await send_encrypted(self.stream, "SUCCESS|Registration successful.")
+        else:
+            session_log.warning('ERROR', "Username '%s' already taken.",
+                                username, user=username)
+            await send_encrypted(self.stream, "ERROR|Username already exists.")
+
+    async def do_login(self, parts):
+        username = parts[1]
+        password = parts[2]
+
+        session_log.debug('LOGIN', "Attempting to login for user: %s",
+                          username, user=username)
+
+        if await self.run_blocking(authenticate_user, username, password):
+            self.authenticated = True
+            self.current_user = username
+            end_session(self.session_token)
+            self.session_token = create_session(username)
+            session_log.info('SUCCESS', "User '%s' logged in.", username, user=username)
+            await send_encrypted(self.stream, f"SUCCESS|Login successful.|{self.session_token}")
+        else:
+            session_log.warning('ERROR', "Invalid credentials for '%s'.",
+                                username, user=username)
+            await send_encrypted(self.stream, "ERROR|Invalid username or password.")
+
+    async def do_resume(self, parts):
+        # Format: RESUME|token (an in-memory lookup, no executor needed)
+        token = parts[1] if len(parts) > 1 else ""
+        username = resume_session(token)
+
+        if username:
+            self.authenticated = True
+            self.current_user = username
+            self.session_token = token
+            session_log.info('SUCCESS', "User '%s' resumed a session.",
+                             username, user=username)
+            await send_encrypted(self.stream, f"SUCCESS|Session resumed.|{username}")
+        else:
+            session_log.warning('ERROR', "Unknown or expired session token.")
+            await send_encrypted(self.stream, "ERROR|Session expired, please login.")
+
+    async def do_logout(self, parts):
+        if self.authenticated:
+            session_log.info('LOGOUT', "User '%s' logged out.",
+                             self.current_user, user=self.current_user)
+            self.authenticated = False
+            self.current_user = None
+            end_session(self.session_token)
+            self.session_token = None
+            await send_encrypted(self.stream, "SUCCESS|Logged out")
+        else:
+            await send_encrypted(self.stream, "ERROR|Not logged in")
+
+    async def do_upload(self, parts):
+        # Format: UPLOAD|filename|filesize[|offset=N|compress=C], followed by DATA frames and END
+        if not self.authenticated:
+            await self.stream.skip_data()
+            await send_encrypted(self.stream, "ERROR|Please login first.")
+            return
+
+        filename = parts[1]
+        filesize = int(parts[2])
+        options = parse_options(parts[3:])
+        offset = int(options.get('offset', 0))
+
+        transfer_log.debug('UPLOAD', "%s uploading %s (%s bytes, from byte %s).",
+                           self.current_user, filename, filesize, offset,
+                           user=self.current_user, file=filename, size=filesize, offset=offset)
+
+        try:
+            upload = await self.run_blocking(PendingUpload, self.current_user,
+                                             filename, filesize, offset, options.get('compress'))
+        except UploadError as e:
+            await self.stream.skip_data()
+            error = str(e)
+        else:
+            try:
+                async for chunk in self.stream.iter_data():
+                    await self.run_blocking(upload.write_encrypted, chunk)
+            except BaseException:
+                # Keep what arrived so the client can resume
+                await self.run_blocking(upload.suspend)
+                raise
+            error = await self.run_blocking(upload.finish)
+
+        if error is None:
+            transfer_log.info('SUCCESS', "%s uploaded by %s.",
+                              filename, self.current_user,
+                              file=filename, user=self.current_user)
+            await send_encrypted(self.stream, "SUCCESS|File uploaded successfully!")
+        else:
+            transfer_log.warning('ERROR', "Upload of %s by %s failed: %s",
+                                 filename, self.current_user, error,
+                                 file=filename, user=self.current_user, error=error)
+            await send_encrypted(self.stream, f"ERROR|{error}")
+
+    async def do_upload_hash(self, parts):
+        # Format: UPLOAD_HASH|filename|filesize|sha256
+        if not self.authenticated:
+            await send_encrypted(self.stream, "ERROR|Please login first.")
+            return
+
+        filename = parts[1]
+        if await self.run_blocking(upload_by_hash, self.current_user, filename,
+                                   int(parts[2]), parts[3]):
+            transfer_log.info('SUCCESS', "%s uploaded by %s (content already stored).",
+                              filename, self.current_user,
+                              file=filename, user=self.current_user)
+            await send_encrypted(self.stream, "SUCCESS|File uploaded successfully! (already on server)")
+        else:
+            await send_encrypted(self.stream, "MISSING|Content not on server, send the data.")
+
+    async def do_upload_offset(self, parts):
+        # Format: UPLOAD_OFFSET|filename|filesize
+        if not self.authenticated:
+            await send_encrypted(self.stream, "ERROR|Please login first.")
+            return
+
+        offset = await self.run_blocking(upload_offset, self.current_user, parts[1], int(parts[2]))
+        await send_encrypted(self.stream, f"OFFSET|{offset}")
+
+    async def do_upload_range(self, parts):
+        # Format: UPLOAD_RANGE|filename|filesize|offset|length[|compress=C], then DATA frames and END
+        if not self.authenticated:
+            await self.stream.skip_data()
+            await send_encrypted(self.stream, "ERROR|Please login first.")
+            return
+
+        filename = parts[1]
+        filesize, offset, length = int(parts[2]), int(parts[3]), int(parts[4])
+        codec = parse_options(parts[5:]).get('compress')
+
+        try:
+            upload = await self.run_blocking(RangeUpload, self.current_user,
+                                             filename, filesize, offset, length, codec)
+        except UploadError as e:
+            await self.stream.skip_data()
+            error = str(e)
+        else:
+            try:
+                async for chunk in self.stream.iter_data():
+                    await self.run_blocking(upload.write_encrypted, chunk)
+            except BaseException:
+                await self.run_blocking(upload.suspend)
+                raise
+            error = await self.run_blocking(upload.finish)
+
+        if error is None:
+            await send_encrypted(self.stream, "SUCCESS|Range stored.")
+        else:
+            transfer_log.warning('ERROR', "Range %s+%s of %s failed: %s",
+                                 offset, length, filename, error,
+                                 offset=offset, length=length, file=filename, error=error)
+            await send_encrypted(self.stream, f"ERROR|{error}")
+
+    async def do_upload_ranges(self, parts):
+        # Format: UPLOAD_RANGES|filename|filesize
+        if not self.authenticated:
+            await send_encrypted(self.stream, "ERROR|Please login first.")
+            return
+
+        ranges = await self.run_blocking(upload_ranges, self.current_user, parts[1], int(parts[2]))
+        await send_encrypted(self.stream, "RANGES|" + ",".join(f"{s}-{e}" for s, e in ranges))
+
+    async def do_upload_commit(self, parts):
+        # Format: UPLOAD_COMMIT|filename|filesize
+        if not self.authenticated:
+            await send_encrypted(self.stream, "ERROR|Please login first.")
+            return
+
+        filename = parts[1]
+        error = await self.run_blocking(commit_upload, self.current_user, filename, int(parts[2]))
+        if error is None:
+            transfer_log.info('SUCCESS', "%s uploaded by %s.",
+                              filename, self.current_user,
+                              file=filename, user=self.current_user)
+            await send_encrypted(self.stream, "SUCCESS|File uploaded successfully!")
+        else:
+            transfer_log.warning('ERROR', "Upload of %s by %s failed: %s",
+                                 filename, self.current_user, error,
+                                 file=filename, user=self.current_user, error=error)
+            await send_encrypted(self.stream, f"ERROR|{error}")
+
+    async def do_delta_signatures(self, parts):
+        # Format: DELTA_SIGNATURES|filename
+        if not self.authenticated:
+            await send_encrypted(self.stream, "ERROR|Please login first.")
+            return
+
+        f, filesize = await self.run_blocking(open_user_file, self.current_user, parts[1])
+        if f is None:
+            await send_encrypted(self.stream, "ERROR|File not found")
+            return
+
+        try:
+            reply, frames = await self.run_blocking(
+                delta_signatures, self.current_user, parts[1], f, filesize)
+            await send_encrypted(self.stream, reply)
+            await self.send_chunks(frames)
+        finally:
+            await self.run_blocking(f.close)
+
+    async def do_upload_delta(self, parts):
+        # Format: UPLOAD_DELTA|filename|filesize|base=H|block=B|sha256=H, then DATA frames and END
+        if not self.authenticated:
+            await self.stream.skip_data()
+            await send_encrypted(self.stream, "ERROR|Please login first.")
+            return
+
+        filename = parts[1]
+        filesize = int(parts[2])
+        transfer_log.debug('UPLOAD', "%s uploading %s (%s bytes) as a delta.",
+                           self.current_user, filename, filesize,
+                           user=self.current_user, file=filename, size=filesize)
+
+        try:
+            upload = await self.run_blocking(DeltaUpload.from_options, self.current_user,
+                                             filename, filesize, parse_options(parts[3:]))
+        except UploadError as e:
+            await self.stream.skip_data()
+            error = str(e)
+        else:
+            try:
+                async for chunk in self.stream.iter_data():
+                    await self.run_blocking(upload.write_encrypted, chunk)
+            except BaseException:
+                await self.run_blocking(upload.suspend)
+                raise
+            error = await self.run_blocking(upload.finish)
+
+        if error is None:
+            transfer_log.info('SUCCESS', "%s uploaded by %s.",
+                              filename, self.current_user,
+                              file=filename, user=self.current_user)
+            await send_encrypted(self.stream, "SUCCESS|File uploaded successfully!")
+        else:
+            transfer_log.warning('ERROR', "Delta upload of %s by %s failed: %s",
+                                 filename, self.current_user, error,
+                                 file=filename, user=self.current_user, error=error)
+            await send_encrypted(self.stream, f"ERROR|{error}")
+
+    async def do_download(self, parts):
+        # Format: DOWNLOAD|filename[|offset=N|length=L|sha256=H|compress=C]
+        if not self.authenticated:
+            await send_encrypted(self.stream, "ERROR|Please login first.")
+            return
+
+        filename = parts[1]
+        transfer_log.debug('DOWNLOAD', "%s downloading %s.",
+                           self.current_user, filename,
+                           user=self.current_user, file=filename)
+
+        f, filesize = await self.run_blocking(open_user_file, self.current_user, filename)
+
+        if f is None:
+            transfer_log.warning('ERROR', "File %s not found for %s.",
+                                 filename, self.current_user,
+                                 file=filename, user=self.current_user)
+            await send_encrypted(self.stream, "ERROR|File not found")
+            return
+
+        try:
+            offset, length, codec, reply = await self.run_blocking(
+                download_start, self.current_user, filename, f, filesize, parse_options(parts[2:]))
+            await send_encrypted(self.stream, reply)
+            if reply.startswith("ERROR"):
+                return
+            if length is None:
+                length = filesize - offset
+
+            if sends_stored_file(codec, (self.current_user, filename), filesize):
+                # Stored in wire form: sendfile() straight from the page cache
+                source, start = segments.sendfile_source(f, offset)
+                await self.stream.send_file(source, length, start)
+            else:
+                await self.send_chunks(wire_chunks(f, offset, length, codec,
+                                                  key=(self.current_user, filename)))
+            transfer_log.info('SUCCESS', "%s sent to %s",
+                              filename, self.current_user,
+                              file=filename, user=self.current_user)
+        finally:
+            await self.run_blocking(f.close)
+
+        await send_encrypted(self.stream, "SUCCESS|File downloaded successfully!")
+
+    async def send_chunks(self, chunks):
+        # Sends the blocks of a generator as DATA frames and END. Each
+        # block is produced (read, compressed, encrypted) in the executor.
+        while True:
+            chunk = await self.run_blocking(next, chunks, None)
+            if chunk is None:
+                break
+            await self.stream.send_frame(MSG_DATA, chunk)
+        await self.stream.send_frame(MSG_END)
+
+    async def do_list(self, parts):
+        if not self.authenticated:
+            await send_encrypted(self.stream, "ERROR| Please login first.")
+            return
+
+        files_log.debug('LIST', "%s requesting file list.",
+                        self.current_user, user=self.current_user)
+
+        options = parse_options(parts[1:])
+        if options:
+            reply = await self.run_blocking(list_page_reply, self.current_user, options)
+            await send_encrypted(self.stream, reply)
+            return
+
+        files = await self.run_blocking(list_user_files, self.current_user)
+
+        if files:
+            file_list = "|".join(files)
+            await send_encrypted(self.stream, f"LIST|{file_list}")
+            files_log.info('SUCCESS', "Sent file list to %s: %s files.",
+                           self.current_user, len(files),
+                           user=self.current_user, count=len(files))
+        else:
+            files_log.info('INFO', "%s has no files.",
+                           self.current_user, user=self.current_user)
+            await send_encrypted(self.stream, "LIST|No files available.")
+
+    async def do_delete(self, parts):
+        # Format: DELETE|filename
+        if not self.authenticated:
+            await send_encrypted(self.stream, "ERROR| Please login first.")
+            return
+
+        filename = parts[1]
+
+        if await self.run_blocking(delete_user_file, self.current_user, filename):
+            await send_encrypted(self.stream, "SUCCESS|File deleted successfully!")
+            files_log.info('SUCCESS', "%s deleted by %s.",
+                           filename, self.current_user,
+                           file=filename, user=self.current_user)
+        else:
+            await send_encrypted(self.stream, "ERROR|File not found")
+            files_log.warning('ERROR', "File %s not found for %s.",
+                              filename, self.current_user,
+                              file=filename, user=self.current_user)
+
+# ============================================================================
+# MAIN SERVER
+# ============================================================================
+
+async def serve_forever(host, port, executor, max_connections, reuse_port=False):
+    # Starts asyncio.start_server and serves until cancelled.
+    connection_slots = asyncio.Semaphore(max(1, max_connections))
+
+    async def on_connect(reader, writer):
+        client_address = writer.get_extra_info('peername')
+        stream = AsyncFramedStream(reader, writer)
+
+        if connection_slots.locked():
+            connection_log.warning('BUSY', "Rejecting %s: too many connections.",
+                                   client_address, client=client_address)
+            await send_encrypted(stream, "ERROR|Server busy, try again later.")
+            await stream.close()
+            return
+
+        async with connection_slots:
+            await AsyncClientHandler(stream, client_address, executor).serve()
+
+    server = await asyncio.start_server(on_connect, host, port, reuse_address=True,
+                                        reuse_port=reuse_port or None,
+                                        backlog=min(max_connections, 4096))
+    async with server:
+        await server.serve_forever()
+
+def start_async_server(host='127.0.0.1', port=5555, workers=16, max_connections=10000,
+                       reuse_port=False):
+    # Runs the asyncio engine. 'workers' sizes the thread pool used for
+    # disk and user-store calls; 'max_connections' caps open sessions.
+    # reuse_port lets several worker processes listen on the same port.
+    server_log.info('STARTING', "Authentication server starting %s:%s", host, port,
+                    engine='asyncio')
+    server_log.info('WORKERS', "%s I/O threads, up to %s connections", workers, max_connections)
+    server_log.info('LISTENING', "Waiting for connections...")
+
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='io')
+    try:
+        asyncio.run(serve_forever(host, port, executor, max_connections, reuse_port))
+    except KeyboardInterrupt:
+        server_log.info('SHUTDOWN', "Server shutting down...")
+    finally:
+        executor.shutdown(wait=False)
+        server_log.info('CLOSED', "Server closed and offline.")
@@ -2,49 +2,235 @@
 # Connects to authentication server for registration and login
 # GitHub account project location: https://github.com/CLochstampfor60/file_system_project
 
+import hashlib
+import json
+import mmap
 import socket
 import os
+import time
+
+import compression
+import delta
+from caesar_cipher import caesar_encrypt, caesar_decrypt
+from protocol import FramedSocket, MSG_CONTROL, ProtocolError
 
 # ============================================================================
-# ENCRYPTION FUNCTIONS
+# NETWORK FUNCTIONS
 # ============================================================================
 
-def caesar_encrypt(text, shift=3):
-    # Encrypts text using Caesar cipher.
-    result = ""
-    for char in text: 
-        if char.isalpha():
-            shift_base = ord('A') if char.isupper() else ord('a')
-            result += chr((ord(char) - shift_base + shift) % 26 + shift_base)
-        else:
-            result += char
-    return result
+def send_encrypted(conn, message):
+    # Encrypts and sends a message as one CONTROL frame.
+    encrypted = caesar_encrypt(message)
+    conn.send_frame(MSG_CONTROL, encrypted.encode('utf-8'))
+
+def receive_encrypted(conn):
+    # Receives one CONTROL frame and decrypts it.
+    frame_type, payload = conn.recv_frame()
+    if frame_type is None:
+        raise ConnectionError("Server closed the connection")
+    if frame_type != MSG_CONTROL:
+        raise ProtocolError(f"Expected a reply, got frame type {frame_type}")
+    decrypted = caesar_decrypt(bytes(payload)).decode('utf-8')
+    return decrypted
 
-def caesar_decrypt(text, shift=3):
-    # Decrypts Caesar cipher text.
-    return caesar_encrypt(text, -shift)
+# Files are read, encrypted and sent in chunks of this size.
+CHUNK_SIZE = 64 * 1024
+
+def read_chunks(f):
+    # Generator that reads a file block by block.
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+def read_encrypted_chunks(f, codec=None):
+    # Generator that reads a file block by block and encrypts each block,
+    # compressing the stream with 'codec' first if given.
+    chunks = read_chunks(f)
+    if codec is not None:
+        chunks = compression.compress_chunks(chunks, codec, 'upload', stats=None)
+    for chunk in chunks:
+        yield caesar_encrypt(chunk)
+
+def save_data(conn, save_as, offset=0, codec=None):
+    # Receives DATA frames up to END, decrypting (and decompressing) each
+    # one and writing it to 'save_as' from byte 'offset' on (anything
+    # after it is dropped). The whole stream is always read, even if the
+    # local file can't be written, so the connection stays in sync.
+    # Returns (bytes_received, error or None); bytes are counted
+    # uncompressed.
+    received = 0
+    error = None
+
+    try:
+        f = open(save_as, 'r+b' if offset else 'wb')
+        f.truncate(offset)
+        f.seek(offset)
+    except OSError as e:
+        f, error = None, e
+
+    decompressor = compression.Decompressor(codec, 'download', stats=None) if codec else None
+
+    def store(data):
+        nonlocal f, error, received
+        received += len(data)
+        if f is None:
+            return
+        try:
+            f.write(data)
+        except OSError as e:
+            error = e
+            f.close()
+            f = None
+
+    try:
+        for chunk in conn.iter_data():
+            if decompressor is None:
+                store(caesar_decrypt(chunk))
+                continue
+            if isinstance(error, ValueError):
+                continue
+            try:
+                for data in decompressor.feed(caesar_decrypt(chunk)):
+                    store(data)
+            except ValueError as e:
+                # Bad compressed data; the frames are still read to END
+                error = e
+        if decompressor is not None and not isinstance(error, ValueError):
+            try:
+                store(decompressor.finish())
+            except ValueError as e:
+                error = e
+    finally:
+        if f is not None:
+            f.close()
+
+    return received, error
+
+class ServerConnection(FramedSocket):
+    # A framed connection that remembers which server it is talking to, so
+    # session tokens can be cached per server and a dropped connection can
+    # be re-opened (see reconnect()).
+
+    def __init__(self, sock, host, port):
+        super().__init__(sock)
+        self.host = host
+        self.port = port
+        self.session_token = None
+        # Compression codecs both sides support, and whether the server
+        # takes uploads by content hash (see negotiate())
+        self.codecs = []
+        self.dedup = False
+
+    def reconnect(self):
+        # Replaces a broken socket with a new connection to the same server
+        # and restores the logged-in session on it.
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        super().__init__(socket.create_connection((self.host, self.port)))
+        negotiate(self)
+
+        if not self.session_token or not resume_session(self, self.session_token):
+            raise ProtocolError("Session could not be restored, please login again.")
+
+def negotiate(conn):
+    # HELLO: tells the server which compression codecs we support and
+    # keeps the ones it supports too in conn.codecs.
+    send_encrypted(conn, "HELLO|compress=" + ",".join(compression.available()))
+    parts = receive_encrypted(conn).split('|')
+    options = dict(p.split('=', 1) for p in parts[1:] if '=' in p)
+    conn.codecs = [name for name in options.get('compress', '').split(',') if name]
+    conn.dedup = options.get('dedup') == '1'
+
+def connect_to_server(host='127.0.0.1', port=5555):
+    # Opens a TCP connection and wraps it for framed messages.
+    conn = ServerConnection(socket.create_connection((host, port)), host, port)
+    try:
+        negotiate(conn)
+    except BaseException:
+        conn.close()
+        raise
+    return conn
 
 # ============================================================================
-# NETWORK FUNCTIONS
+# SESSION CACHE
 # ============================================================================
 
-def send_encrypted(sock, message):
-    # Encrypts and sends a message over socket.
-    encrypted = caesar_encrypt(message)
-    sock.send(encrypted.encode('utf-8'))
+# After LOGIN the server hands out a session token. We keep it on disk so
+# the next run (or a reconnect) can send RESUME|token instead of logging in.
+SESSION_FILE = os.environ.get('FSP_SESSION_FILE',
+                              os.path.join(os.path.expanduser('~'), '.fsp_sessions.json'))
 
-def receive_encrypted(sock):
-    # Receives and decrypts a message from socket.
-    encrypted_bytes = sock.recv(2048)
-    encrypted = encrypted_bytes.decode('utf-8')
-    decrypted = caesar_decrypt(encrypted)
-    return decrypted
+def _session_key(conn):
+    return f"{conn.host}:{conn.port}"
+
+def _read_session_file():
+    try:
+        with open(SESSION_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_session_file(sessions):
+    try:
+        fd = os.open(SESSION_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(sessions, f)
+    except OSError as e:
+        print(f"[WARNING] Could not save session: {e}")
+
+def load_session(conn):
+    # Returns (username, token) cached for this server, or (None, None).
+    entry = _read_session_file().get(_session_key(conn))
+    if not entry:
+        return None, None
+    return entry.get('username'), entry.get('token')
+
+def save_session(conn, username, token):
+    # Remembers the session token for this server.
+    sessions = _read_session_file()
+    sessions[_session_key(conn)] = {'username': username, 'token': token}
+    _write_session_file(sessions)
+
+def clear_session(conn):
+    # Forgets the cached session for this server.
+    sessions = _read_session_file()
+    if sessions.pop(_session_key(conn), None) is not None:
+        _write_session_file(sessions)
 
 # ============================================================================
 # AUTHENTICATION FUNCTIONS
 # ============================================================================
 
-def register(client_socket):
+def resume_session(conn, token):
+    # Restores a session with RESUME|token. Returns the username, or None
+    # if the server no longer knows the token.
+    send_encrypted(conn, f"RESUME|{token}")
+    parts = receive_encrypted(conn).split('|')
+    if parts[0] == "SUCCESS" and len(parts) > 2:
+        conn.session_token = token
+        return parts[2]
+    return None
+
+def try_cached_session(conn):
+    # Resumes the cached session for this server, if there is one.
+    # Returns the username on success, otherwise None.
+    username, token = load_session(conn)
+    if not token:
+        return None
+
+    resumed = resume_session(conn, token)
+    if resumed:
+        print(f"[SUCCESS] Resumed session for {resumed}.")
+        return resumed
+
+    clear_session(conn)
+    return None
+
+def register(conn):
     # Handles user registration with server.
     print("\n" + "=" * 60)
     print("USER REGISTRATION")
@@ -62,10 +248,10 @@ def register(client_socket):
     
     # Send registration request to server
     message = f"REGISTER|{username}|{password}"
-    send_encrypted(client_socket, message)
+    send_encrypted(conn, message)
 
     # Receive response
-    response = receive_encrypted(client_socket)
+    response = receive_encrypted(conn)
     parts = response.split('|', 1)
 
     if parts[0] == "SUCCESS":
@@ -75,7 +261,7 @@ def register(client_socket):
         print(f"[ERROR] {parts[1]}")
         return False
 
-def login(client_socket):
+def login(conn):
     # Handles user login with server.
     print("\n" + "=" * 60)
     print("LOGIN")
@@ -93,33 +279,265 @@ def login(client_socket):
     
     # Send login request to server
     message = f"LOGIN|{username}|{password}"
-    send_encrypted(client_socket, message)
+    send_encrypted(conn, message)
 
-    # Receive response
-    response = receive_encrypted(client_socket)
-    parts = response.split('|', 1)
+    # Receive response: SUCCESS|message|token or ERROR|message
+    response = receive_encrypted(conn)
+    parts = response.split('|')
 
     if parts[0] == "SUCCESS":
         print(f"[SUCCESS] {parts[1]}")
+        if len(parts) > 2:
+            conn.session_token = parts[2]
+            save_session(conn, username, parts[2])
         return username
     else:
         print(f"[ERROR] {parts[1]}")
         return None
 
+# ============================================================================
+# RESUMABLE TRANSFERS
+# ============================================================================
+
+# A transfer whose connection drops is retried this many times, after
+# reconnecting and restoring the session. Each retry continues from the
+# last byte that made it across instead of starting over.
+MAX_RETRIES = 5
+RETRY_DELAY = 1.0
+
+def with_retries(conn, transfer, retries=MAX_RETRIES):
+    # Calls transfer(resume) until it returns, where 'resume' is False on
+    # the first attempt. On a lost connection: wait, reconnect, retry.
+    # A failed reconnect uses up a retry too, and the transfer only runs
+    # again once a reconnect worked. Raises ConnectionError when the
+    # retries run out.
+    resume = False
+    attempt = 0
+    while True:
+        try:
+            return transfer(resume)
+        except (ConnectionError, TimeoutError) as e:
+            if attempt == retries:
+                raise
+            error = e
+        resume = True
+
+        while True:
+            delay = RETRY_DELAY * (2 ** attempt)
+            attempt += 1
+            print(f"[RETRY] Connection lost ({error}); resuming in {delay:.0f}s...")
+            time.sleep(delay)
+            try:
+                conn.reconnect()
+                break
+            except OSError as e:
+                print(f"[RETRY] Reconnect failed: {e}")
+                if attempt == retries:
+                    raise ConnectionError(f"Could not reconnect: {e}") from e
+                error = e
+
+def upload_codec(conn, f):
+    # The codec to compress an upload of open file 'f' with, or None if
+    # the server takes none or the file looks compressed already.
+    if not conn.codecs:
+        return None
+    sample = f.read(compression.SAMPLE_SIZE)
+    f.seek(0)
+    return None if compression.looks_compressed(sample) else conn.codecs[0]
+
+def hash_local_file(f):
+    # SHA-256 hex digest of an open file's content.
+    hasher = hashlib.sha256()
+    for chunk in read_chunks(f):
+        hasher.update(chunk)
+    f.seek(0)
+    return hasher.hexdigest()
+
+def upload_by_hash(conn, f, filename, filesize):
+    # Offers the file's hash first (UPLOAD_HASH) if the server deduplicates.
+    # Returns the SUCCESS reply if the server had the content already,
+    # else None and the data has to be sent.
+    if not conn.dedup or filesize == 0:
+        return None
+    send_encrypted(conn, f"UPLOAD_HASH|{filename}|{filesize}|{hash_local_file(f)}")
+    parts = receive_encrypted(conn).split('|', 1)
+    return parts if parts[0] == "SUCCESS" else None
+
+def upload(conn, filepath, filename=None, retries=MAX_RETRIES, compress=True):
+    # Uploads a local file, resuming after dropped connections. With
+    # compress=True the data is compressed if the server supports it.
+    # A server with the same content already just links it, no data sent.
+    # Returns (True, message) or (False, error message).
+    filename = filename or os.path.basename(filepath)
+
+    with open(filepath, 'rb') as f:
+        # Sizes and offsets always count uncompressed bytes
+        filesize = os.fstat(f.fileno()).st_size
+        codec = upload_codec(conn, f) if compress else None
+
+        def attempt(resume):
+            if not resume:
+                stored = upload_by_hash(conn, f, filename, filesize)
+                if stored is not None:
+                    return stored
+
+            offset = 0
+            if resume:
+                # Ask how much of the file the server already has
+                send_encrypted(conn, f"UPLOAD_OFFSET|{filename}|{filesize}")
+                parts = receive_encrypted(conn).split('|')
+                offset = int(parts[1]) if parts[0] == "OFFSET" else 0
+                print(f"[RESUMING] Server has {offset} of {filesize} bytes.")
+
+            # Send upload command: UPLOAD|filename|filesize[|offset=N][|compress=C]
+            message = f"UPLOAD|{filename}|{filesize}"
+            if offset:
+                message += f"|offset={offset}"
+            if codec:
+                message += f"|compress={codec}"
+            send_encrypted(conn, message)
+
+            # File data follows the command straight away, no READY round-trip
+            f.seek(offset)
+            conn.send_data(read_encrypted_chunks(f, codec))
+
+            # Receive confirmation
+            return receive_encrypted(conn).split('|', 1)
+
+        parts = with_retries(conn, attempt, retries)
+
+    return parts[0] == "SUCCESS", parts[1]
+
+def download(conn, filename, save_as, retries=MAX_RETRIES, compress=True):
+    # Downloads a file to 'save_as', resuming after dropped connections.
+    # Data goes to 'save_as.part' first and is renamed when complete.
+    # With compress=True the server is asked to compress the data.
+    # Returns (True, message) or (False, error message).
+    part_path = save_as + '.part'
+    state = {'sha256': ''}
+
+    def attempt(resume):
+        offset = 0
+        if resume and os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+
+        # DOWNLOAD|filename|offset=N|sha256=H: the server starts over if the
+        # file changed since the first attempt
+        message = f"DOWNLOAD|{filename}|offset={offset}|sha256={state['sha256']}"
+        if compress and conn.codecs:
+            message += f"|compress={conn.codecs[0]}"
+        send_encrypted(conn, message)
+
+        # Receive response (either FILESIZE or ERROR)
+        parts = receive_encrypted(conn).split('|')
+        if parts[0] != "FILESIZE":
+            return False, parts[1]
+
+        filesize = int(parts[1])
+        options = dict(p.split('=', 1) for p in parts[2:] if '=' in p)
+        offset = int(options.get('offset', 0))
+        state['sha256'] = options.get('sha256', '')
+
+        if offset:
+            print(f"[RESUMING] Continuing {filename} from byte {offset} of {filesize}.")
+        else:
+            print(f"[RECEIVING] Downloading {filename} ({filesize} bytes...)")
+
+        # Receive, decrypt and save the file one chunk at a time
+        received, error = save_data(conn, part_path, offset, options.get('compress') or None)
+
+        # Get final confirmation
+        parts = receive_encrypted(conn).split('|', 1)
+
+        if error is not None:
+            return False, f"Could not save file: {error}"
+        if offset + received != filesize:
+            return False, f"Expected {filesize} bytes, received {offset + received}."
+        if parts[0] != "SUCCESS":
+            return False, parts[1]
+
+        os.replace(part_path, save_as)
+        return True, f"File saved as {save_as}"
+
+    return with_retries(conn, attempt, retries)
+
+# ============================================================================
+# DELTA UPLOADS
+# ============================================================================
+
+# Files smaller than this are just uploaded whole.
+DELTA_MIN_SIZE = 64 * 1024
+
+# Give up on a delta (and upload the whole file) once more than this
+# fraction of the file, or this many bytes, turn out to be different.
+# Looking for matches in changed data runs at only about 1-2 MB/s in
+# Python, slower than just sending it over most networks.
+DELTA_MAX_CHANGED = 0.5
+DELTA_MAX_CHANGED_BYTES = 8 * 1024 * 1024
+
+def delta_upload(conn, filepath, filename=None, retries=MAX_RETRIES):
+    # Uploads a new version of a file the server already has, sending only
+    # what changed (see delta.py): the server's block signatures come
+    # first, then only block references and the bytes that differ go up.
+    # Falls back to upload() for new or small files, or when too much of
+    # the file changed.
+    # Returns (True, message) or (False, error message).
+    filename = filename or os.path.basename(filepath)
+    filesize = os.path.getsize(filepath)
+    if filesize < DELTA_MIN_SIZE:
+        return upload(conn, filepath, filename, retries)
+
+    def attempt(resume):
+        send_encrypted(conn, f"DELTA_SIGNATURES|{filename}")
+        parts = receive_encrypted(conn).split('|')
+        if parts[0] != "SIGNATURES":
+            return None
+        payloads = [caesar_decrypt(payload) for payload in conn.iter_data()]
+        base_size, block_size, base_sha256 = int(parts[1]), int(parts[2]), parts[3]
+
+        try:
+            signature = delta.Signature(delta.parse_signatures(payloads), base_size, block_size)
+        except ValueError:
+            return None
+
+        with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                instructions = delta.compute_delta(
+                    data, signature,
+                    min(int(filesize * DELTA_MAX_CHANGED), DELTA_MAX_CHANGED_BYTES))
+            except delta.DeltaTooLarge:
+                return None
+            sha256 = hashlib.sha256(data).hexdigest()
+
+            send_encrypted(conn, f"UPLOAD_DELTA|{filename}|{filesize}|base={base_sha256}"
+                                 f"|block={block_size}|sha256={sha256}")
+            conn.send_data(caesar_encrypt(payload)
+                           for payload in delta.delta_payloads(data, instructions))
+
+        parts = receive_encrypted(conn).split('|', 1)
+        if parts[0] != "SUCCESS":
+            # e.g. the file changed on the server meanwhile
+            return None
+        sent = sum(end - start for op, start, end in instructions if op == 'literal')
+        return True, f"{parts[1]} (delta: sent {sent} of {filesize} bytes)"
+
+    result = with_retries(conn, attempt, retries)
+    if result is None:
+        return upload(conn, filepath, filename, retries)
+    return result
+
 # ============================================================================
 # FILE OPERATION FUNCTIONS (Add this entire section)
 # ============================================================================
 
-def upload_file(client_socket):
+def upload_file(conn):
     # Handles file upload to server.
     # Flow:
     # 1. User enters file path
-    # 2. Read file content
-    # 3. Encrypt content
-    # 4. Send UPLOAD command with filename and size
-    # 5. Wait for READY signal
-    # 6. Send encrypted file data
-    # 7. Receive confirmation
+    # 2. Send UPLOAD command with filename and size
+    # 3. Read, encrypt and send the file as DATA frames, then END
+    # 4. Receive confirmation (if the connection drops, reconnect and
+    #    continue from where the server stopped)
     
     print("\n" + "=" * 60)
     print("UPLOAD FILE")
@@ -136,61 +554,33 @@ def upload_file(client_socket):
         print(f"[ERROR] File not found {filepath}.")
         return
 
-    # Get just the filename (not full path)
-    filename = os.path.basename(filepath)
-
-    # Read file content
+    # Open the file now so read errors are reported before contacting the server
     try:
-        with open(filepath, 'r') as f:
-            file_content = f.read()
+        open(filepath, 'rb').close()
     except Exception as e:
         print(f"[ERROR] Could not read file: {e}")
         return
-    
-    # Encrypt file content
-    encrypted_content = caesar_encrypt(file_content)
-    filesize = len(encrypted_content)
-
-    # OPTIONAL FOR PRESENTATION PURPOSES ONLY!!!
-    # Show encryption happening (in real-time)
-    print(f"[INFO] File content encrypted ({len(file_content)} bytes -> {filesize} bytes.)")
 
-    # Send upload command: UPLOAD|filename|filesize
-    message = f"UPLOAD|{filename}|{filesize}"
-    send_encrypted(client_socket, message)
-
-    # Wait for READY signal from server
-    response = receive_encrypted(client_socket)
-
-    if response == "READY":
-        # Server is ready, sen encrypted file content
-        client_socket.send(encrypted_content.encode('utf-8'))
-        print(f"[SENDING] Uploading {filename}...")
-
-        # Receive confirmation
-        response = receive_encrypted(client_socket)
-        parts = response.split('|', 1)
-
-        if parts[0] == "SUCCESS": 
-            print(f"[SUCCESS] {parts[1]}")
-        else:
-            print(f"[ERROR] {parts[1]}")
+    print(f"[SENDING] Uploading {os.path.basename(filepath)} ({os.path.getsize(filepath)} bytes)...")
+    # Only the changes are sent if the server has an older version
+    ok, message = delta_upload(conn, filepath)
 
+    if ok:
+        print(f"[SUCCESS] {message}")
     else:
-        print(f"[ERROR] Server not ready to receive file.")
+        print(f"[ERROR] {message}")
 
 
-def download_file(client_socket):
+def download_file(conn):
     # Handles file download from server.
     
     # Flow:
     # 1. User enters filename to download
     # 2. Send DOWNLOAD command
     # 3. Receive FILESIZE from server
-    # 4. Send READY signal
-    # 5. Receive encrypted file data
-    # 6. Decrypt and save file
-    # 7. Send confirmation
+    # 4. Receive, decrypt and save DATA frames until END
+    # 5. Receive confirmation (if the connection drops, reconnect and
+    #    continue from the bytes already saved)
 
     print("\n" + "=" * 60)
     print("DOWNLOAD FILE")
@@ -205,93 +595,78 @@ def download_file(client_socket):
     save_as = input(f"Save as (press Enter for '{filename}'): ").strip()
     if not save_as:
         save_as = filename
-    
-    # Send download command: DOWNLOAD|filename
-    message = f"DOWNLOAD|{filename}"
-    send_encrypted(client_socket, message)
-
-    # Receive response (either FILESIZE or ERROR)
-    response = receive_encrypted(client_socket)
-    parts = response.split('|', 1)
-
-    if parts[0] == "ERROR":
-        print(f"[ERROR] {parts[1]}")
-        return
-    
-    if parts[0] == "FILESIZE":
-        filesize = int(parts[1])
-        print(f"[RECEIVING] Downloading {filename} ({filesize} bytes...)")
 
-        # Send READY signal to server
-        send_encrypted(client_socket, "READY")
+    ok, message = download(conn, filename, save_as)
 
-        # Receive encrypted file data in chunks
-        received_data = b""
-        remaining = filesize
+    if ok:
+        print(f"[SUCCESS] {message}")
+    else:
+        print(f"[ERROR] {message}")
 
-        while remaining > 0:
-            chunk_size = min(4096, remaining)
-            chunk = client_socket.recv(chunk_size)
-            if not chunk:
-                break
-            received_data += chunk
-            remaining -= len(chunk)
-        
-        # Decrypt file content
-        decrypted_content = caesar_decrypt(received_data.decode('utf-8'))
+# Files shown per page by list_files().
+LIST_PAGE_SIZE = 20
 
-        # Save to file
-        try:
-            with open(save_as, 'w') as f:
-                f.write(decrypted_content)
+def list_page(conn, limit=LIST_PAGE_SIZE, cursor='', sort='name', order='asc'):
+    # Requests one page of the file listing.
+    # Returns (entries, next_cursor, total); each entry is a dict with
+    # name, size, mtime and sha256. next_cursor is '' on the last page.
+    send_encrypted(conn, f"LIST|limit={limit}|cursor={cursor}|sort={sort}|order={order}|detail=1")
 
-            # Save confirmation to server
-            send_encrypted(client_socket, "RECEIVED")
-            
-            # Get final confirmation
-            response = receive_encrypted(client_socket)
-            parts = response.split('|', 1)
+    # Response: PAGE|next_cursor|total|name<TAB>size<TAB>mtime<TAB>sha256|...
+    response = receive_encrypted(conn)
+    parts = response.split('|')
+    if parts[0] != "PAGE":
+        raise ProtocolError(parts[1] if len(parts) > 1 else response)
 
-            if parts[0] == "SUCCESS":
-                print(f"[SUCCESS] File saved as {save_as}")
-            else:
-                print(f"[ERROR] {parts[1]}")
+    entries = []
+    for item in parts[3:]:
+        name, size, mtime, sha256 = item.split('\t')
+        entries.append({'name': name, 'size': int(size), 'mtime': int(mtime), 'sha256': sha256})
+    return entries, parts[1], int(parts[2])
 
-        except Exception as e:
-            print(f"[ERROR] Could not save file: {e}")
-
-def list_files(client_socket):
+def list_files(conn):
     # Requests and displays list of files from server.
     
     # Flow:
-    # 1. Send LIST command
-    # 2. Receive list of files (separated by |)
-    # 3. Display files
+    # 1. Ask how to sort
+    # 2. Request one page of the listing (LIST|limit=..|cursor=..|sort=..)
+    # 3. Display files, and fetch the next page while the user wants more
 
     print("\n" + "=" * 60)
     print("YOUR FILES")
     print("=" * 60)
-    
-    # Send list command
-    send_encrypted(client_socket, "LIST")
 
-    # Receive response: LIST|file1|file2|file3 or LIST|No files available 
-    response = receive_encrypted(client_socket)
-    parts = response.split('|')
+    sort = input("Sort by name, size or mtime (press Enter for name): ").strip() or 'name'
+    order = 'desc' if sort in ('size', 'mtime') else 'asc'
 
-    if parts[0] == "LIST":
-        if len(parts) > 1 and parts[1] != "No file available":
-            files = parts[1:] # Get all filenames after "LIST"
-            for i, filename in enumerate(files, 1):
-                print(f"{i}. {filename}")
-        else:
+    cursor = ''
+    shown = 0
+
+    while True:
+        try:
+            entries, cursor, total = list_page(conn, cursor=cursor, sort=sort, order=order)
+        except ProtocolError as e:
+            print(f"[ERROR] {e}")
+            break
+
+        if total == 0:
             print("No files available")
-    else:
-        print(f"[ERROR] Unexpected response from server")    
+            break
+
+        for entry in entries:
+            shown += 1
+            print(f"{shown}. {entry['name']} ({entry['size']} bytes)")
+
+        if not cursor:
+            break
+
+        more = input(f"Showing {shown} of {total}. Press Enter for more, or q to stop: ").strip()
+        if more.lower() == 'q':
+            break
 
     print("=" * 60)
 
-def delete_file(client_socket):
+def delete_file(conn):
     # Handles file deletion from server.
     
     # Flow:
@@ -319,10 +694,10 @@ def delete_file(client_socket):
 
     # Send delete command: DELETE|filename
     message = f"DELETE|{filename}"
-    send_encrypted(client_socket, message)
+    send_encrypted(conn, message)
 
     # Receive response
-    response = receive_encrypted(client_socket)
+    response = receive_encrypted(conn)
     parts = response.split('|', 1)
 
     if parts[0] == "SUCCESS":
@@ -335,7 +710,7 @@ def delete_file(client_socket):
 # MENU FUNCTIONS
 # ============================================================================
 
-def main_menu(client_socket):
+def main_menu(conn):
     # Main menu for login/register.
     while True:
         print("\n" + "=" * 60)
@@ -349,22 +724,22 @@ def main_menu(client_socket):
         choice = input("Enter choice: ").strip()
 
         if choice == "1":
-            username = login(client_socket)
+            username = login(conn)
             if username:
                 return username # Successfully logged in
 
         elif choice == "2":
-            register(client_socket)
+            register(conn)
         
         elif choice == "3":
             print("\n[GOODBYE] Exiting...")
-            send_encrypted(client_socket, "EXIT")
+            send_encrypted(conn, "EXIT")
             return None
         
         else:
             print("[ERROR] Invalid choice")
 
-def user_menu(client_socket, username):
+def user_menu(conn, username):
     # Menu after successful login.
 
     while True:
@@ -383,21 +758,22 @@ def user_menu(client_socket, username):
         choice = input("Enter choice: ").strip()
 
         if choice == '1':
-            upload_file(client_socket)
+            upload_file(conn)
 
         elif choice == '2':
-            download_file(client_socket)
+            download_file(conn)
 
         elif choice == '3':
-            list_files(client_socket)
+            list_files(conn)
 
         elif choice == '4':
-            delete_file(client_socket)
+            delete_file(conn)
 
         elif choice == '5':
             # Send logout request
-            send_encrypted(client_socket, "LOGOUT")
-            response = receive_encrypted(client_socket)
+            send_encrypted(conn, "LOGOUT")
+            response = receive_encrypted(conn)
+            clear_session(conn)
             print(f"\n[INFO] {response.split('|')[1] if '|' in response else response}")
             print("[GOODBYE] Logged out successfully!")
             break
@@ -413,7 +789,7 @@ def main():
     
     def start_auth_client(host='127.0.0.1', port=5555):
         # Starts in authentication client.
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        conn = None
 
         try:
             # Connect to server
@@ -421,15 +797,16 @@ def main():
             print("SECURE FILE SHARING SYSTEM - CLIENT")
             print("=" * 60)
             print(f"[CONNECTING] Connecting to {host}:{port}...")
-            client_socket.connect((host, port))
+            conn = connect_to_server(host, port)
             print(f"[CONNECTED] Connected to server!")
-            
-            # Show main menu (login/register)
-            username = main_menu(client_socket)
+
+            # Reuse a cached session if we have one, otherwise show the
+            # main menu (login/register)
+            username = try_cached_session(conn) or main_menu(conn)
 
             # If logged in, show user menu
             if username:
-                user_menu(client_socket, username)
+                user_menu(conn, username)
 
         except ConnectionRefusedError:
             print("[ERROR] Could not connect to server. Is it running?")
@@ -438,7 +815,8 @@ def main():
             print(f"[ERROR] {e}")
 
         finally:
-            client_socket.close()
+            if conn is not None:
+                conn.close()
             print("[DISCONNECTED] Connection closed")
     
     start_auth_client()
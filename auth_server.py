@@ -2,58 +2,72 @@
 # Handles user registration and login over encrypted network connection
 # GitHub account project location: https://github.com/CLochstampfor60/file_system_project
 
+import argparse
+import contextvars
+import hashlib
+import json
+import queue
 import socket
 import os
-
-# ============================================================================
-# ENCRYPTION FUNCTIONS
-# ============================================================================
-
-def caesar_encrypt(text, shift=3):
-    # Encrypts text using Caesar cipher
-    result = ""
-    for char in text:
-        if char.isalpha():
-            shift_base = ord('A') if char.isupper() else ord('a')
-            result += chr((ord(char) - shift_base + shift) % 26 + shift_base)
-        else:
-            result += char
-    return result
-
-def caesar_decrypt(text, shift=3):
-    # Decrypts Caesar cipher text.
-    return caesar_encrypt(text, -shift)
+import sys
+import threading
+import time
+
+from caesar_cipher import caesar_encrypt, caesar_decrypt
+from protocol import FramedSocket, MSG_CONTROL, ProtocolError, parse_options
+from locking import file_lock, try_lock_file
+import user_store
+from user_store import USERS_FILE, UserIndex, open_user_store
+from sessions import SessionCache
+from manifest import get_manifest
+import blobstore
+import compression
+import delta
+import mapped_io
+from metrics import METRICS, Timer, current_command, serve_prometheus
+import serverlog
+import traffic
+from download_cache import DownloadCache, file_version
+import segments
+import storage
+from storage import StorageError
+
+connection_log = serverlog.get_logger('connection')
+session_log = serverlog.get_logger('session')
+transfer_log = serverlog.get_logger('transfer')
+files_log = serverlog.get_logger('files')
+server_log = serverlog.get_logger('server')
+wire_log = serverlog.get_logger('wire')
 
 # ============================================================================
 # NETWORK FUNCTIONS
 # ============================================================================
 
-def send_encrypted(sock, message):
-    # Encrypts and sends a message over socket.
+def send_encrypted(conn, message):
+    # Encrypts and sends a message as one CONTROL frame.
     encrypted = caesar_encrypt(message)
-    
-    # Shows encrypted text
-    print(f"[ENCRYPTED REPLY] {encrypted}")
-    sock.send(encrypted.encode('utf-8'))
-    # Shows plain text
-    print(f"[SENT] {message}")
-    print("-" * 60)
-
-def receive_encrypted(sock):
-    # Receives and decrypts a message from socket.
-    encrypted_bytes = sock.recv(2048) # Increased buffer for longer messages.
-    if not encrypted_bytes:
+    conn.send_frame(MSG_CONTROL, encrypted.encode('utf-8'))
+
+    # Shows encrypted and plain text (--log-payloads)
+    wire_log.info('ENCRYPTED REPLY', "%s", encrypted)
+    wire_log.info('SENT', "%s", message)
+    note_reply(message)
+
+def receive_encrypted(conn):
+    # Receives one CONTROL frame and decrypts it.
+    # Returns None if the client closed the connection.
+    frame_type, payload = conn.recv_frame()
+    if frame_type is None:
         return None
-    encrypted = encrypted_bytes.decode('utf-8')
-
-    ###### FOR PRESENTATION PURPOSES ONLY!!!!! Remove this before PRODUCTION #####
-    # Show both encrypted and decrypted text
-    print(f"[ENCRYPTED MESSAGE] {encrypted}")
+    if frame_type != MSG_CONTROL:
+        raise ProtocolError(f"Expected a command, got frame type {frame_type}")
+    encrypted = bytes(payload).decode('utf-8')
 
     decrypted = caesar_decrypt(encrypted)
-    print(f"[DECRYPTED MESSAGE] {decrypted}")
-    # print(f"[RECEIVED] {decrypted}")
-    print("-" * 60)
+
+    # For presentations: show both encrypted and decrypted text (--log-payloads)
+    wire_log.info('ENCRYPTED MESSAGE', "%s", encrypted)
+    wire_log.info('DECRYPTED MESSAGE', "%s", decrypted)
 
     return decrypted
 
@@ -61,82 +75,1207 @@ def receive_encrypted(sock):
 # USER MANAGEMENT (From auth_system.py)
 # ============================================================================
 
+# Backend used by register_user/authenticate_user. By default users.txt is
+# parsed once into a process-wide index and only re-read when the file
+# changes on disk; --user-store sqlite switches to a SQLite database
+# (see user_store.py).
+_user_store = UserIndex(USERS_FILE)
+
+def configure_user_store(backend='text', path=None):
+    # Selects the user store backend for this process.
+    global _user_store
+    _user_store = open_user_store(backend, path)
+    return _user_store
+
 def load_users():
     # Loads users from users.txt file.
-    users = {}
-    if os.path.exists('users.txt'):
-        with open('users.txt', 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and '|' in line:
-                    username, password = line.split('|', 1)
-                    users[username] = password
-    return users
+    return user_store.load_users(USERS_FILE)
 
 def save_user(username, password):
     # Saves a new user to users.txt file.
-    with open('users.txt', 'a') as f:
-        f.write(f"{username}|{password}\n")
+    user_store.save_user(username, password, USERS_FILE)
+
+def valid_username(username):
+    # A username is the name of the user's directory under server_files/.
+    return storage.valid_name(username)
 
 def register_user(username, password):
     # Registers a new user if username doesn't exist.
-    users = load_users()
-
-    if username in users:
-        return False # Username taken
-    save_user(username, password)
-    return True
+    # Safe against concurrent registrations in other threads and processes.
+    if not valid_username(username):
+        return False
+    return _user_store.register(username, password)
 
 def authenticate_user(username, password):
     # Verifies if username and password match stored credentials.
-    users = load_users()
-    return username in users and users[username] == password
+    # Reserved names are refused even if an older server registered them.
+    if not valid_username(username):
+        return False
+    return _user_store.authenticate(username, password)
+
+# ============================================================================
+# SESSIONS
+# ============================================================================
+
+# Tokens handed out on LOGIN so reconnecting clients can skip it (RESUME).
+# Sessions live in memory, so each worker process has its own; a RESUME
+# that reaches a different process simply fails and the client logs in.
+_sessions = SessionCache()
+
+def create_session(username):
+    # Starts a session after a successful LOGIN. Returns its token.
+    return _sessions.create(username)
+
+def resume_session(token):
+    # Returns the username for a valid session token, or None.
+    return _sessions.resume(token)
+
+def end_session(token):
+    # Forgets a session token (LOGOUT).
+    if token:
+        _sessions.revoke(token)
+
+# ============================================================================
+# ADMINS AND METRICS
+# ============================================================================
+
+# Users allowed to read server statistics (STATS).
+_admins = frozenset()
+
+def configure_admins(names=()):
+    # Sets the admin usernames for this process.
+    global _admins
+    _admins = frozenset(name for name in names if name)
+
+def is_admin(username):
+    return username in _admins
+
+# Commands metrics are kept for; anything else is counted as UNKNOWN.
+COMMANDS = ('HELLO', 'STATS', 'REGISTER', 'LOGIN', 'RESUME', 'LOGOUT', 'UPLOAD',
+            'UPLOAD_HASH', 'UPLOAD_OFFSET', 'UPLOAD_RANGE', 'UPLOAD_RANGES',
+            'UPLOAD_COMMIT', 'DELTA_SIGNATURES', 'UPLOAD_DELTA', 'DOWNLOAD',
+            'LIST', 'DELETE', 'EXIT')
+
+# Appends every command to a JSONL trace when --trace is given (see traffic.py).
+_trace = None
+
+def configure_trace(path=None):
+    global _trace
+    _trace = traffic.TraceWriter(path) if path else None
+
+# The CommandMeter of the connection being served by this thread / task.
+_current_meter = contextvars.ContextVar('current_meter', default=None)
+
+def note_reply(message):
+    # Called for every reply sent: counts ERROR replies in METRICS and
+    # keeps the reply's first word for the trace.
+    METRICS.reply(message)
+    meter = _current_meter.get()
+    if meter is not None and meter.status is None:
+        meter.status = message.split('|', 1)[0]
+
+class CommandMeter:
+    # Records one connection in METRICS: each command's latency and the
+    # bytes it moved (frames included, the command itself too), and in the
+    # trace if there is one.
+    #
+    # The handler calls finish() before reading the next command and
+    # start() once it has it, so a command's time runs from being read
+    # until the handler is ready for the next one.
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.command = None
+        self.status = None
+        self.connection = _trace.new_connection() if _trace is not None else None
+        self._mark()
+        METRICS.connection_opened()
+        _current_meter.set(self)
+
+    def _mark(self):
+        self.received = self.conn.bytes_received
+        self.sent = self.conn.bytes_sent
+
+    def start(self, command, message):
+        self.command = command if command in COMMANDS else 'UNKNOWN'
+        self.message = message
+        self.status = None
+        current_command.set(self.command)
+        self.started = time.perf_counter()
+        if _trace is not None:
+            self.started_at = time.time()
+
+    def finish(self, user=None):
+        # 'user' is who is logged in once the command is done.
+        if self.command is not None:
+            seconds = time.perf_counter() - self.started
+            bytes_in = self.conn.bytes_received - self.received
+            bytes_out = self.conn.bytes_sent - self.sent
+            METRICS.observe_command(self.command, seconds, bytes_in, bytes_out)
+            if _trace is not None:
+                _trace.record(self.connection, self.started_at, self.command, self.message,
+                              user, self.status, seconds, bytes_in, bytes_out)
+            self.command = None
+            current_command.set(None)
+        self._mark()
+
+    def close(self, user=None):
+        # Connection ended (a command cut short by it still counts).
+        self.finish(user)
+        METRICS.connection_closed()
 
 # ============================================================================
 # FILE MANAGEMENT FUNCTIONS
 # ============================================================================
 
+# Uploads and downloads move through the server in chunks of this size, so
+# server memory per transfer stays bounded no matter how large the file is.
+CHUNK_SIZE = 64 * 1024
+
+# Files the server creates for its own bookkeeping (e.g. in-progress uploads)
+# start with this prefix and are hidden from file listings.
+INTERNAL_PREFIX = storage.INTERNAL_PREFIX
+
+# Commands whose first argument is a file name, and those of them that are
+# followed by DATA frames.
+FILE_COMMANDS = {"UPLOAD", "UPLOAD_HASH", "UPLOAD_OFFSET", "UPLOAD_RANGE", "UPLOAD_RANGES",
+                 "UPLOAD_COMMIT", "DELTA_SIGNATURES", "UPLOAD_DELTA", "DOWNLOAD", "DELETE"}
+DATA_COMMANDS = {"UPLOAD", "UPLOAD_RANGE", "UPLOAD_DELTA"}
+
+def valid_filename(filename):
+    # A file name from a client names one file in the user's directory, never
+    # one of the server's own files there (.fsp-manifest, .fsp-lock, ...).
+    return storage.valid_name(filename)
+
+def invalid_file_command(parts):
+    # Whether 'parts' is a file command naming a file clients can't use.
+    return parts[0] in FILE_COMMANDS and not valid_filename(parts[1] if len(parts) > 1 else '')
+
+# How files are kept on disk ('plain' or 'encrypted', see storage.py).
+# In 'encrypted' mode files hold exactly the bytes sent on the wire.
+_storage_mode = 'plain'
+
+def configure_storage(mode='plain'):
+    # Selects the storage mode for this process.
+    global _storage_mode
+    if mode not in storage.STORAGE_MODES:
+        raise ValueError(f"Unknown storage mode: {mode}")
+    _storage_mode = mode
+
+def storage_encrypted():
+    return _storage_mode == 'encrypted'
+
+# Whether identical uploads share one copy on disk (see blobstore.py).
+_dedup = False
+
+def configure_dedup(enabled=False):
+    # Turns the deduplicating blob store on or off for this process.
+    global _dedup
+    _dedup = enabled
+
+def dedup_enabled():
+    return _dedup
+
+# Uploads of at most this many bytes are packed into shared segment files
+# instead of getting a file of their own (see segments.py); 0 = never.
+# Files packed earlier stay readable whatever this is set to.
+_pack_threshold = 0
+_segments = segments.SegmentStore(storage.STORAGE_ROOT)
+
+def configure_packing(threshold=0):
+    # Sets the size up to which uploads are packed, for this process.
+    global _pack_threshold
+    if threshold < 0:
+        raise ValueError(f"Invalid pack threshold: {threshold}")
+    _pack_threshold = threshold
+
+def packs(filesize):
+    # Whether an upload of 'filesize' bytes goes into a segment.
+    return _pack_threshold > 0 and filesize <= _pack_threshold
+
+# Hot files kept in wire form for DOWNLOADs (see download_cache.py); a
+# budget of 0 bytes turns it off.
+_download_cache = DownloadCache(0)
+
+def configure_download_cache(budget=0):
+    # Sets the download cache's byte budget for this process.
+    global _download_cache
+    if budget < 0:
+        raise ValueError(f"Invalid cache size: {budget}")
+    _download_cache = DownloadCache(budget)
+
+def file_changed(username, filename):
+    # Called after a user's file was replaced or deleted.
+    for codec in (None, *compression.CODECS):
+        _download_cache.invalidate((username, filename, codec))
+
+def download_cached(key, filesize):
+    # Whether a DOWNLOAD of 'key' ((username, filename)), a stored file of
+    # 'filesize' bytes, goes through the download cache: files too big to
+    # cache skip it, and don't count as misses.
+    return key is not None and _download_cache.fits(filesize)
+
+def sends_stored_file(codec, key=None, filesize=0):
+    # Whether a DOWNLOAD sends the stored file with sendfile(): it is in
+    # wire form already (--storage encrypted), uncompressed, and not served
+    # from the download cache.
+    return storage_encrypted() and codec is None and not download_cached(key, filesize)
+
+# When transfers are compressed (see compression.py):
+#   auto   - when the client asks, unless the file looks compressed already
+#   always - whenever the client asks
+#   off    - never; HELLO offers no codecs
+COMPRESSION_POLICIES = ('auto', 'always', 'off')
+_compression_policy = 'auto'
+
+def configure_compression(policy='auto'):
+    # Selects the compression policy for this process.
+    global _compression_policy
+    if policy not in COMPRESSION_POLICIES:
+        raise ValueError(f"Unknown compression policy: {policy}")
+    _compression_policy = policy
+
+def hello_reply(parts):
+    # HELLO|compress=zlib,lzma -> HELLO|compress=<the ones we support too>
+    # (plus |dedup=1 if UPLOAD_HASH can succeed)
+    offered = parse_options(parts[1:]).get('compress', '')
+    codecs = []
+    if _compression_policy != 'off':
+        codecs = compression.negotiate(offered.split(','))
+    reply = "HELLO|compress=" + ",".join(codecs)
+    if dedup_enabled():
+        reply += "|dedup=1"
+    return reply
+
+def stats_reply():
+    # STATS -> STATS|<counter>=value|... with the server metrics, then
+    # compress.<direction>.<counter> and cache.<counter>
+    snapshot = METRICS.snapshot()
+    fields = [f"uptime_seconds={snapshot['uptime_seconds']:.0f}"]
+    for key, value in snapshot['connections'].items():
+        fields.append(f"connections.{key}={value}")
+    for key, value in snapshot['seconds'].items():
+        fields.append(f"time.{key}_seconds={value:.4f}")
+    for command, stats in snapshot['commands'].items():
+        for key, value in stats.items():
+            if isinstance(value, float):
+                value = f"{value:.3f}"
+            fields.append(f"command.{command}.{key}={value}")
+    for direction, totals in sorted(compression.STATS.snapshot().items()):
+        for key, value in totals.items():
+            if isinstance(value, float):
+                value = f"{value:.4f}"
+            fields.append(f"compress.{direction}.{key}={value}")
+    for key, value in _download_cache.snapshot().items():
+        fields.append(f"cache.{key}={value}")
+    return "|".join(["STATS"] + fields)
+
+def prometheus_text():
+    # The /metrics page: METRICS plus compression and download cache totals.
+    extra = []
+    for direction, totals in sorted(compression.STATS.snapshot().items()):
+        for key in ('transfers', 'raw_bytes', 'wire_bytes', 'seconds'):
+            extra.append((f"fsp_compression_{direction}_{key}_total", 'counter',
+                          f"Compressed {direction}s: {key.replace('_', ' ')}.", totals[key]))
+    cache = _download_cache.snapshot()
+    for key in ('hits', 'misses', 'evictions', 'invalidations'):
+        extra.append((f"fsp_download_cache_{key}_total", 'counter',
+                      f"Download cache {key}.", cache[key]))
+    for key in ('bytes', 'entries', 'budget'):
+        extra.append((f"fsp_download_cache_{key}", 'gauge', f"Download cache {key}.", cache[key]))
+    return METRICS.render_prometheus(extra)
+
+def to_storage(data):
+    # Plaintext -> the form it is stored in.
+    return caesar_encrypt(data) if storage_encrypted() else data
+
+def from_storage(data):
+    # Stored form -> plaintext.
+    return caesar_decrypt(data) if storage_encrypted() else data
+
+def directory_lock(user_dir):
+    # Cross-process lock for changes to one user's directory.
+    return file_lock(os.path.join(user_dir, INTERNAL_PREFIX + 'lock'))
+
 def get_user_directory(username):
     # Returns the directory path for a specific user.
     # Creates directory if it doesn't exist.
-    user_dir = os.path.join('server_files', username)
-    if not os.path.exists(user_dir):
-        os.makedirs(user_dir)
+    user_dir = os.path.join(storage.STORAGE_ROOT, username)
+    # exist_ok avoids a race when two connections of the same user arrive together
+    os.makedirs(user_dir, exist_ok=True)
     return user_dir
 
+def scan_user_files(user_dir):
+    # Lists the real files in a directory the slow way (listdir + stat).
+    # Only used to build a manifest for a directory that doesn't have one.
+    return [(f, os.path.join(user_dir, f)) for f in os.listdir(user_dir)
+            if not f.startswith(INTERNAL_PREFIX)
+            and os.path.isfile(os.path.join(user_dir, f))]
+
+def get_user_manifest(username):
+    # Returns the manifest (name, size, mtime, sha256 of every file) for a
+    # user, building it once from the directory contents if it's missing.
+    user_dir = get_user_directory(username)
+    manifest = get_manifest(user_dir)
+    if not manifest.exists():
+        with directory_lock(user_dir):
+            if not manifest.exists():
+                manifest.rebuild(scan_user_files(user_dir), decode=from_storage)
+                for name, entry in _segments.entries(username):
+                    manifest.record_put(name, entry['size'], entry['mtime'], entry['sha256'])
+    return manifest
+
 def list_user_files(username):
     # Returns a list of files in users' directory
-    user_dir = get_user_directory(username)
-    files = []
-    if os.path.exists(user_dir):
-        files = [f for f in os.listdir(user_dir)
-                    if os.path.isfile(os.path.join(user_dir, f))
-                 ]
-    return files
+    # Comes from the manifest, so no directory scan or stat per file.
+    return get_user_manifest(username).names()
 
 def save_uploaded_file(username, filename, file_content):
     # Saves uploaded file content to user's dictionary.
     user_dir = get_user_directory(username)
     filepath = os.path.join(user_dir, filename)
-
-    with open(filepath, 'w') as f:
-        f.write(file_content)
+    manifest = get_user_manifest(username)
+
+    data = file_content.encode('utf-8')
+    temp_path = os.path.join(user_dir, INTERNAL_PREFIX + 'save-' + filename)
+
+    with directory_lock(user_dir):
+        # Never written in place: the old file may share a blob
+        with open(temp_path, 'wb') as f:
+            f.write(to_storage(data))
+        old = manifest.get(filename)
+        os.replace(temp_path, filepath)
+        _segments.delete(username, filename)
+        mtime = os.stat(filepath).st_mtime
+        manifest.record_put(filename, len(data), mtime, hashlib.sha256(data).hexdigest())
+    file_changed(username, filename)
+    release_blob(old)
     
     return True
 
+def release_blob(entry):
+    # Called after a user file was replaced or deleted, with its manifest
+    # entry: drops the blob it shared once nothing refers to it.
+    if entry is not None:
+        blobstore.release(entry.get('sha256') or '')
+
+def upload_by_hash(username, filename, filesize, sha256):
+    # UPLOAD_HASH: stores 'filename' without receiving any data if content
+    # with this hash and size is in the blob store already and one of the
+    # user's own files has it. Returns True if it was.
+    # Knowing a hash doesn't prove having the content: hashes show up in
+    # listings, so other users' blobs can only be claimed by uploading the
+    # data (which still ends up sharing the blob, see PendingUpload).
+    sha256 = sha256.lower()
+    if not dedup_enabled() or not blobstore.valid_hash(sha256):
+        return False
+
+    manifest = get_user_manifest(username)
+    if not manifest.has_content(sha256):
+        return False
+
+    user_dir = get_user_directory(username)
+    temp_path = blobstore.link(sha256, filesize, user_dir)
+    if temp_path is None:
+        return False
+
+    with directory_lock(user_dir):
+        old = manifest.get(filename)
+        os.replace(temp_path, os.path.join(user_dir, filename))
+        _segments.delete(username, filename)
+        # The link shares the first upload's mtime; list it as new
+        manifest.record_put(filename, filesize, time.time(), sha256)
+    file_changed(username, filename)
+    release_blob(old)
+    return True
+
+class UploadError(Exception):
+    # An upload the server won't accept; the message goes to the client.
+    pass
+
+# While an upload is running its progress is saved every this many bytes,
+# so even a crash of the server process loses at most this much.
+PART_CHECKPOINT_SIZE = 16 * 1024 * 1024
+
+def part_paths(user_dir, filename):
+    # Where an unfinished upload of 'filename' is kept, and the JSON file
+    # recording its declared size and which byte ranges are safely stored.
+    base = os.path.join(user_dir, storage.PARTIAL_PREFIX + filename)
+    return base + storage.PART_SUFFIX, base + '.json'
+
+def add_range(ranges, start, end):
+    # Adds [start, end) to a sorted list of [start, end) ranges, merging
+    # ranges that touch or overlap. Returns the new list.
+    merged = []
+    for s, e in sorted(ranges + [[start, end]]):
+        if merged and s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return merged
+
+def read_part_meta(meta_path):
+    # Returns the sidecar of a .part file as a dict, or None.
+    try:
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_part_meta(meta_path, filesize, ranges):
+    # Caller holds the directory lock.
+    temp_path = meta_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'size': filesize, 'ranges': ranges}, f)
+    os.replace(temp_path, meta_path)
+
+def read_part_ranges(user_dir, filename, filesize):
+    # Returns the byte ranges of an unfinished upload of 'filesize' bytes
+    # the server already has ([] if there is none, or it was for a file
+    # of a different size).
+    part_path, meta_path = part_paths(user_dir, filename)
+    meta = read_part_meta(meta_path)
+    try:
+        on_disk = os.path.getsize(part_path)
+    except OSError:
+        return []
+    if meta is None or meta.get('size') != filesize:
+        return []
+    return [[s, min(e, on_disk)] for s, e in meta.get('ranges', []) if s < on_disk]
+
+def read_part_length(user_dir, filename, filesize):
+    # Returns how many bytes from the start of an unfinished upload the
+    # server already has.
+    ranges = read_part_ranges(user_dir, filename, filesize)
+    return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+def upload_offset(username, filename, filesize):
+    # Byte offset an interrupted upload can continue from (UPLOAD_OFFSET).
+    return read_part_length(get_user_directory(username), filename, filesize)
+
+def upload_ranges(username, filename, filesize):
+    # Byte ranges of a parallel upload already stored (UPLOAD_RANGES).
+    return read_part_ranges(get_user_directory(username), filename, filesize)
+
+def open_part_file(part_path, shared=False):
+    # Opens (without truncating) and locks a .part file. A sequential
+    # upload holds it exclusively; the connections of a parallel upload
+    # share it. Raises UploadError if a conflicting upload holds it.
+    while True:
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        f = os.fdopen(fd, 'r+b')
+        if not try_lock_file(f, shared=shared):
+            f.close()
+            raise UploadError("File is already being uploaded.")
+
+        # The previous holder may have renamed this inode into place
+        # while we waited for the lock; if so, open the new .part file
+        try:
+            same = os.stat(part_path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            same = False
+        if same:
+            return f
+        f.close()
+
+def upload_decompressor(codec):
+    # Returns the Decompressor for an upload sent with compress=codec, or
+    # None for an uncompressed one.
+    if not codec:
+        return None
+    if codec not in compression.CODECS or _compression_policy == 'off':
+        raise UploadError(f"Unsupported compression: {codec}")
+    return compression.Decompressor(codec, 'upload')
+
+def decompress_into(upload, decompressor, chunk, full):
+    # Feeds one compressed wire chunk through 'decompressor' into
+    # upload.write(). Stops early once full() says the upload has more
+    # than it should. Returns an error message for corrupt data (what
+    # was decompressed before it is good), else None.
+    try:
+        for data in decompressor.feed(decrypt_block(chunk)):
+            upload.write(data)
+            if full():
+                break
+    except ValueError as e:
+        return str(e)
+    return None
+
+class PendingUpload:
+    # An upload in progress. Content is appended to a .part file in the
+    # user's directory (and its plaintext hashed on the way); commit()
+    # renames it over the real file and records it in the manifest. The
+    # rename is atomic, so readers never see a half-written file.
+    #
+    # If the connection drops, suspend() keeps the .part file and records
+    # how much of it is valid, so the client can continue from that offset
+    # with UPLOAD|filename|filesize|offset=N instead of starting over.
+    #
+    # With a 'codec' the wire chunks are compressed (see compression.py)
+    # and are decompressed on the way in. With 'sha256' the file is only
+    # committed if its content has that hash.
+    #
+    # Large uploads preallocate the .part file to 'filesize' and are
+    # written through a mapping of it (see mapped_io.py).
+
+    def __init__(self, username, filename, filesize, offset=0, codec=None, sha256=None):
+        self._decompressor = upload_decompressor(codec)
+        self._error = None
+        self.sha256 = sha256
+        self.username = username
+        self.filename = filename
+        self.filesize = filesize
+        self.user_dir = get_user_directory(username)
+        self.filepath = os.path.join(self.user_dir, filename)
+        self.part_path, self.meta_path = part_paths(self.user_dir, filename)
+        self.manifest = get_user_manifest(username)
+        self._hasher = hashlib.sha256()
+        self._file = open_part_file(self.part_path)
+
+        try:
+            if offset:
+                have = read_part_length(self.user_dir, filename, filesize)
+                if offset != have:
+                    raise UploadError(f"Upload offset mismatch, server has {have} bytes.")
+                self._hash_existing(offset)
+            else:
+                self._remove_meta()
+            self._file.truncate(offset)
+            self._file.seek(offset)
+            self._writer = None
+            if filesize - offset >= mapped_io.MMAP_MIN_SIZE:
+                self._writer = mapped_io.MappedWriter(self._file, offset, filesize)
+        except BaseException:
+            self._file.close()
+            raise
+
+        self.size = offset
+        self._checkpoint = offset
+
+    def _hash_existing(self, length):
+        # Feeds the part of the file we already have into the hash.
+        self._file.seek(0)
+        remaining = length
+        while remaining:
+            chunk = self._file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            self._hasher.update(from_storage(chunk))
+            remaining -= len(chunk)
+
+    def _put(self, stored):
+        # Appends bytes already in storage form.
+        with Timer('disk'):
+            if self._writer is not None:
+                self._writer.write(stored)
+            else:
+                self._file.write(stored)
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._file.close()
+
+    def _save_progress(self):
+        # Makes everything written so far durable and records its length.
+        self._file.flush()
+        if self._writer is not None:
+            self._writer.flush()
+        os.fsync(self._file.fileno())
+        with directory_lock(self.user_dir):
+            write_part_meta(self.meta_path, self.filesize, [[0, self.size]])
+        self._checkpoint = self.size
+
+    def _wrote(self, length):
+        self.size += length
+        if self.size - self._checkpoint >= PART_CHECKPOINT_SIZE:
+            self._save_progress()
+
+    def write(self, data):
+        # Appends plaintext.
+        self._put(to_storage(data))
+        self._hasher.update(data)
+        self._wrote(len(data))
+
+    def write_encrypted(self, chunk):
+        # Appends a chunk as it arrived on the wire. In encrypted storage
+        # mode it is written unchanged; only the hash needs the plaintext.
+        if self._decompressor is not None:
+            if self._error is None:
+                self._error = decompress_into(self, self._decompressor, chunk,
+                                              lambda: self.size > self.filesize)
+            return
+        plain = decrypt_block(chunk)
+        self._put(chunk if storage_encrypted() else plain)
+        self._hasher.update(plain)
+        self._wrote(len(chunk))
+
+    def _remove_meta(self):
+        try:
+            os.remove(self.meta_path)
+        except FileNotFoundError:
+            pass
+
+    def commit(self):
+        # The .part file stays locked until it has been renamed, so no
+        # other upload can grab it half way.
+        # With dedup on, the finished file becomes the blob for its content,
+        # or, if that content is stored already, a link to the existing blob
+        # takes its place and the .part file is dropped.
+        self._file.flush()
+        if self._writer is not None:
+            self._writer.close()
+        sha256 = self._hasher.hexdigest()
+        if packs(self.size):
+            self._commit_packed(sha256)
+            return
+        source = self.part_path
+        if dedup_enabled() and not blobstore.add(self.part_path, sha256):
+            source = blobstore.link(sha256, self.size, self.user_dir) or self.part_path
+
+        with directory_lock(self.user_dir):
+            old = self.manifest.get(self.filename)
+            os.replace(source, self.filepath)
+            _segments.delete(self.username, self.filename)
+            mtime = os.stat(self.filepath).st_mtime if source == self.part_path else time.time()
+            self.manifest.record_put(self.filename, self.size, mtime, sha256)
+
+        if source != self.part_path:
+            os.remove(self.part_path)
+        self._remove_meta()
+        self._file.close()
+        file_changed(self.username, self.filename)
+        release_blob(old)
+
+    def _commit_packed(self, sha256):
+        # Small file: appended to a segment, and any loose file of the same
+        # name removed, instead of renaming the .part file into place.
+        self._file.seek(0)
+        data = self._file.read()
+        with directory_lock(self.user_dir):
+            old = self.manifest.get(self.filename)
+            mtime = time.time()
+            _segments.put(self.username, self.filename, data, mtime, sha256)
+            try:
+                os.remove(self.filepath)
+            except FileNotFoundError:
+                pass
+            self.manifest.record_put(self.filename, self.size, mtime, sha256)
+
+        self._file.close()
+        os.remove(self.part_path)
+        self._remove_meta()
+        file_changed(self.username, self.filename)
+        release_blob(old)
+
+    def suspend(self):
+        # Keeps what we have for a later resume.
+        try:
+            self._save_progress()
+        finally:
+            self._close()
+
+    def abort(self):
+        # Throws the upload away.
+        self._remove_meta()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+        self._close()
+
+    def finish(self):
+        # Called when the sender's END frame arrived. Commits the file if
+        # it is complete. Returns None on success, else an error message.
+        if self._decompressor is not None and self.size <= self.filesize:
+            if self._error is None:
+                try:
+                    self.write(self._decompressor.finish())
+                except ValueError as e:
+                    self._error = str(e)
+            if self._error is not None:
+                self.suspend()
+                return f"Upload incomplete: {self._error}."
+
+        if self.size == self.filesize:
+            if self.sha256 and self._hasher.hexdigest() != self.sha256:
+                self.abort()
+                return "Upload failed verification (SHA-256 mismatch)."
+            self.commit()
+            return None
+        if self.size < self.filesize:
+            self.suspend()
+            return f"Upload incomplete, received {self.size} of {self.filesize} bytes."
+        self.abort()
+        return f"Received more than the declared {self.filesize} bytes."
+
+def receive_uploaded_file(conn, username, filename, filesize, offset=0, codec=None):
+    # Receives an encrypted upload (DATA frames up to END) and streams it
+    # to disk chunk by chunk, starting at 'offset' of an interrupted one.
+    # 'codec' names the compression the client applied, if any.
+    # The file only appears under its real name once exactly 'filesize'
+    # bytes have arrived; if the connection drops, the bytes received so
+    # far are kept for a resume.
+    # Returns None if the whole file was received, else an error message.
+    try:
+        upload = PendingUpload(username, filename, filesize, offset, codec)
+    except UploadError as e:
+        # Drop the file data so the connection stays in sync
+        conn.skip_data()
+        return str(e)
+
+    try:
+        for chunk in conn.iter_data():
+            # Append the chunk to the .part file (decrypted unless the
+            # files are stored encrypted)
+            upload.write_encrypted(chunk)
+    except BaseException:
+        upload.suspend()
+        raise
+
+    # Sender's data must match the declared size
+    return upload.finish()
+
+def _pwrite(fd, data, position):
+    # Writes all of 'data' at 'position' of an open file descriptor.
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, position)
+        else:
+            # Windows: every range has its own descriptor, so seek + write
+            # does the same job
+            os.lseek(fd, position, os.SEEK_SET)
+            written = os.write(fd, view)
+        view = view[written:]
+        position += written
+
+class RangeUpload:
+    # One byte range of a parallel upload (UPLOAD_RANGE). Several
+    # connections write their ranges into the same .part file at once,
+    # each with pwrite() at its own position. When a range is done it is
+    # added to the sidecar's list of ranges; UPLOAD_COMMIT renames the file
+    # into place once the ranges cover all of it.
+
+    def __init__(self, username, filename, filesize, offset, length, codec=None):
+        if offset < 0 or length < 0 or offset + length > filesize:
+            raise UploadError("Range is outside the file.")
+        self._decompressor = upload_decompressor(codec)
+        self._error = None
+
+        self.filesize = filesize
+        self.user_dir = get_user_directory(username)
+        self.part_path, self.meta_path = part_paths(self.user_dir, filename)
+        self.offset = offset
+        self.end = offset + length
+        self.position = offset
+        self.overflow = False
+        self._file = open_part_file(self.part_path, shared=True)
+
+        try:
+            with directory_lock(self.user_dir):
+                meta = read_part_meta(self.meta_path)
+                if meta is None or meta.get('size') != filesize:
+                    # First range of a new upload: start from an empty
+                    # file of the final size
+                    self._file.truncate(0)
+                    self._file.truncate(filesize)
+                    write_part_meta(self.meta_path, filesize, [])
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _put(self, stored):
+        # Writes bytes already in storage form at the next position.
+        room = self.end - self.position
+        if len(stored) > room:
+            self.overflow = True
+            stored = stored[:room]
+        if stored:
+            with Timer('disk'):
+                _pwrite(self._file.fileno(), stored, self.position)
+            self.position += len(stored)
+
+    def write(self, data):
+        # Writes plaintext at the next position.
+        self._put(to_storage(data))
+
+    def write_encrypted(self, chunk):
+        # Writes a chunk as it arrived on the wire at the next position.
+        if self._decompressor is not None:
+            if self._error is None:
+                self._error = decompress_into(self, self._decompressor, chunk,
+                                              lambda: self.overflow)
+        else:
+            self._put(chunk if storage_encrypted() else decrypt_block(chunk))
+
+    def _record(self):
+        # Makes the bytes written durable and adds them to the sidecar.
+        if self.position == self.offset:
+            return
+        os.fsync(self._file.fileno())
+        with directory_lock(self.user_dir):
+            meta = read_part_meta(self.meta_path)
+            if meta is not None and meta.get('size') == self.filesize:
+                ranges = add_range(meta.get('ranges', []), self.offset, self.position)
+                write_part_meta(self.meta_path, self.filesize, ranges)
+
+    def suspend(self):
+        # Keeps whatever part of the range arrived.
+        try:
+            self._record()
+        finally:
+            self._file.close()
+
+    def finish(self):
+        # Called when the END frame arrived. Returns None if the whole
+        # range was stored, else an error message.
+        if self._decompressor is not None and not self.overflow:
+            if self._error is None:
+                try:
+                    self.write(self._decompressor.finish())
+                except ValueError as e:
+                    self._error = str(e)
+            if self._error is not None:
+                self.suspend()
+                return f"Range incomplete: {self._error}."
+        self.suspend()
+        if self.overflow:
+            return "Received more than the range length."
+        if self.position < self.end:
+            return f"Range incomplete, received {self.position - self.offset} of {self.end - self.offset} bytes."
+        return None
+
+def receive_upload_range(conn, username, filename, filesize, offset, length, codec=None):
+    # Receives one range of a parallel upload (DATA frames up to END).
+    # Returns None if the whole range was stored, else an error message.
+    try:
+        upload = RangeUpload(username, filename, filesize, offset, length, codec)
+    except UploadError as e:
+        conn.skip_data()
+        return str(e)
+
+    try:
+        for chunk in conn.iter_data():
+            upload.write_encrypted(chunk)
+    except BaseException:
+        upload.suspend()
+        raise
+
+    return upload.finish()
+
+def commit_upload(username, filename, filesize):
+    # Completes a parallel upload once every range has arrived
+    # (UPLOAD_COMMIT). Returns None on success, else an error message.
+    have = upload_offset(username, filename, filesize)
+    if have != filesize:
+        return f"Upload incomplete, server has {have} of {filesize} bytes."
+    try:
+        upload = PendingUpload(username, filename, filesize, offset=filesize)
+    except UploadError as e:
+        return str(e)
+    return upload.finish()
+
+class DeltaUpload:
+    # An upload sent as a delta against the user's current copy of the
+    # file (UPLOAD_DELTA, see delta.py). COPY instructions are read from
+    # the old copy, LITERAL ones come from the client; both go into a
+    # PendingUpload, so the new file only replaces the old one once it is
+    # complete and has the SHA-256 the client announced.
+
+    def __init__(self, username, filename, filesize, base_sha256, block_size, sha256):
+        if not delta.MIN_BLOCK_SIZE <= block_size <= delta.MAX_BLOCK_SIZE:
+            raise UploadError("Invalid delta block size.")
+        self._base, self.base_size = open_user_file(username, filename)
+        if self._base is None:
+            raise UploadError("File not found")
+
+        try:
+            entry = get_user_manifest(username).get(filename)
+            if (entry or {}).get('sha256') != base_sha256:
+                raise UploadError("File changed during transfer.")
+            self._upload = PendingUpload(username, filename, filesize, sha256=sha256)
+        except BaseException:
+            self._base.close()
+            raise
+
+        self.filename = filename
+        self.filesize = filesize
+        self.block_size = block_size
+        self.copied = 0
+        self.literal = 0
+        self._error = None
+
+    @classmethod
+    def from_options(cls, username, filename, filesize, options):
+        # UPLOAD_DELTA|filename|filesize|base=H|block=B|sha256=H
+        try:
+            block_size = int(options.get('block', 0))
+        except ValueError:
+            raise UploadError("Invalid UPLOAD_DELTA options.")
+        return cls(username, filename, filesize, options.get('base', ''),
+                   block_size, options.get('sha256', ''))
+
+    def _copy(self, first, count):
+        # Appends blocks first..first+count-1 of the old copy.
+        start = first * self.block_size
+        if count <= 0 or start >= self.base_size:
+            raise ValueError("Block reference outside the file")
+        end = min(start + count * self.block_size, self.base_size)
+        # Never copy more than would overflow the declared size
+        end = min(end, start + self.filesize - self._upload.size + 1)
+        self._base.seek(start)
+        for chunk in read_file_chunks(self._base, limit=end - start):
+            self._upload.write(from_storage(chunk))
+        self.copied += end - start
+
+    def write_encrypted(self, chunk):
+        # Applies one instruction as it arrived on the wire.
+        if self._error is not None:
+            return
+        try:
+            instruction = delta.decode_instruction(caesar_decrypt(chunk))
+            if instruction[0] == 'copy':
+                self._copy(instruction[1], instruction[2])
+            else:
+                self._upload.write(instruction[1])
+                self.literal += len(instruction[1])
+        except ValueError as e:
+            self._error = f"{e}."
+            return
+        if self._upload.size > self.filesize:
+            self._error = f"Received more than the declared {self.filesize} bytes."
+
+    def suspend(self):
+        # A delta can't be continued later; throw it away.
+        self._base.close()
+        self._upload.abort()
+
+    def finish(self):
+        # Called when the END frame arrived. Returns None if the new file
+        # was rebuilt and committed, else an error message.
+        self._base.close()
+        if self._error is not None:
+            self._upload.abort()
+            return self._error
+        transfer_log.info('DELTA', "%s: %s bytes reused, %s bytes received.",
+                          self.filename, self.copied, self.literal,
+                          file=self.filename, copied=self.copied, literal=self.literal)
+        return self._upload.finish()
+
+def receive_delta_upload(conn, username, filename, filesize, options):
+    # Receives an UPLOAD_DELTA (instructions as DATA frames up to END).
+    # Returns None if the new file was stored, else an error message.
+    try:
+        upload = DeltaUpload.from_options(username, filename, filesize, options)
+    except UploadError as e:
+        conn.skip_data()
+        return str(e)
+
+    try:
+        for chunk in conn.iter_data():
+            upload.write_encrypted(chunk)
+    except BaseException:
+        upload.suspend()
+        raise
+
+    return upload.finish()
+
 def get_file_content(username, filename):
     # Reads and returns file content from user's dictionary.
     # Returns 'None' if file doesn't exist.
+    f, filesize = open_user_file(username, filename)
+    if f is None:
+        return None
+
+    with f:
+        content = from_storage(f.read())
+
+    return content.decode('utf-8')
+
+def open_user_file(username, filename):
+    # Opens a user's file for streaming in binary mode.
+    # Returns (file, size), or (None, 0) if the file doesn't exist.
+    # A packed file comes back as a segments.SegmentFile; pass it through
+    # segments.sendfile_source() before handing it to sendfile().
     user_dir = get_user_directory(username)
     filepath = os.path.join(user_dir, filename)
 
-    if not os.path.exists(filepath):
+    try:
+        f = open(filepath, 'rb')
+    except (FileNotFoundError, IsADirectoryError):
+        f = _segments.open(username, filename)
+        return (None, 0) if f is None else (f, f.size)
+
+    # Size comes from the open file, so a concurrent re-upload (which
+    # replaces the path) can't make it disagree with what we send.
+    return f, os.fstat(f.fileno()).st_size
+
+def read_file_chunks(f, chunk_size=CHUNK_SIZE, limit=None):
+    # Generator that yields a file's content one block at a time, up to
+    # 'limit' bytes if given.
+    while limit is None or limit > 0:
+        with Timer('disk'):
+            chunk = f.read(chunk_size if limit is None else min(chunk_size, limit))
+        if not chunk:
+            break
+        if limit is not None:
+            limit -= len(chunk)
+        yield chunk
+
+def encrypt_block(data):
+    # caesar_encrypt(), timed as cipher work in METRICS.
+    with Timer('cipher'):
+        return caesar_encrypt(data)
+
+def decrypt_block(data):
+    with Timer('cipher'):
+        return caesar_decrypt(data)
+
+def encrypt_chunks(chunks):
+    # Generator that encrypts each block as it passes through.
+    for chunk in chunks:
+        yield encrypt_block(chunk)
+
+def wire_chunks(f, offset, length, codec=None, key=None):
+    # Generator yielding 'length' bytes of a stored file from 'offset' in
+    # the form they travel in: compressed with 'codec' if given, then
+    # encrypted. With a 'key' ((username, filename)) the transfer goes
+    # through the download cache: any range of an uncompressed one, the
+    # whole file of a compressed one (a compressed stream can't be cut).
+    size = file_size(f)
+    if download_cached(key, size) and (codec is None or (offset == 0 and length == size)):
+        return cached_wire_chunks(key, f, offset, length, codec)
+    if codec is None and not storage_encrypted() and length >= mapped_io.MMAP_MIN_SIZE:
+        # Large file: encrypt straight from a mapping of it
+        source, start = segments.sendfile_source(f, offset)
+        return mapped_io.mapped_chunks(source, start, length, encrypt_block)
+    f.seek(offset)
+    chunks = read_file_chunks(f, limit=length)
+    if codec is None:
+        return chunks if storage_encrypted() else encrypt_chunks(chunks)
+    plain = (from_storage(chunk) for chunk in chunks)
+    return encrypt_chunks(compression.compress_chunks(plain, codec))
+
+def file_size(f):
+    # Size of a file from open_user_file().
+    return f.size if isinstance(f, segments.SegmentFile) else os.fstat(f.fileno()).st_size
+
+def cached_payload(key, f, codec=None):
+    # Returns the whole file 'f' in wire form (compressed with 'codec' if
+    # given, then encrypted) from the download cache, building and caching
+    # it on a miss. None if it's too big to cache.
+    cache_key = (*key, codec)
+    version = file_version(f)
+    payload = _download_cache.get(cache_key, version)
+    if payload is None and _download_cache.fits(version[-1]):
+        f.seek(0)
+        with Timer('disk'):
+            payload = f.read()
+        if codec is not None:
+            payload = encrypt_block(b''.join(
+                compression.compress_chunks([from_storage(payload)], codec)))
+        elif not storage_encrypted():
+            payload = encrypt_block(payload)
+        _download_cache.put(cache_key, version, payload)
+    return payload
+
+def cached_wire_chunks(key, f, offset, length, codec=None):
+    # wire_chunks() served from the download cache where possible.
+    payload = cached_payload(key, f, codec)
+    if payload is None:
+        yield from wire_chunks(f, offset, length, codec)
+        return
+    if codec is not None:
+        # The whole compressed stream, whatever its length
+        offset, length = 0, len(payload)
+    view = memoryview(payload)
+    end = offset + length
+    for start in range(offset, end, CHUNK_SIZE):
+        yield view[start:min(start + CHUNK_SIZE, end)]
+
+def send_user_file(conn, f, filesize, offset=0, length=None, codec=None, key=None):
+    # Sends a file from open_user_file() as DATA frames and END: 'length'
+    # bytes (default: the rest of the file) starting at byte 'offset'.
+    # 'key' is (username, filename), for the download cache.
+    # Returns the number of bytes sent.
+    if length is None:
+        length = filesize - offset
+
+    if sends_stored_file(codec, key, filesize):
+        # Already in wire form: the kernel copies it straight to the socket
+        source, start = segments.sendfile_source(f, offset)
+        return conn.send_file(source, length, start)
+
+    # Read -> (compress ->) encrypt -> DATA frames, one block at a time
+    return conn.send_data(wire_chunks(f, offset, length, codec, key))
+
+def delta_signatures(username, filename, f, filesize):
+    # For DELTA_SIGNATURES: returns the SIGNATURES reply and a generator
+    # of the (encrypted) DATA payloads with the block signatures of the
+    # stored file.
+    block_size = delta.block_size_for(filesize)
+    entry = get_user_manifest(username).get(filename)
+    sha256 = (entry or {}).get('sha256') or ''
+    f.seek(0)
+    blocks = (from_storage(block) for block in read_file_chunks(f, block_size))
+    return (f"SIGNATURES|{filesize}|{block_size}|{sha256}",
+            encrypt_chunks(delta.signature_frames(blocks)))
+
+def download_codec(f, requested):
+    # Picks the compression for a DOWNLOAD that asked for 'requested':
+    # None if compression is off, the codec is unknown, or (policy auto)
+    # the file's first bytes say it is compressed already.
+    if not requested or requested not in compression.CODECS:
         return None
-    
-    with open(filepath, 'r') as f:
-        content = f.read()
+    if _compression_policy == 'off':
+        return None
+    if _compression_policy == 'auto':
+        f.seek(0)
+        sample = from_storage(f.read(compression.SAMPLE_SIZE))
+        if compression.looks_compressed(sample):
+            return None
+    return requested
+
+def download_start(username, filename, f, filesize, options):
+    # Works out which bytes a DOWNLOAD sends and the FILESIZE reply
+    # announcing them. Options:
+    #   offset=N   continue an interrupted download from byte N
+    #   sha256=H   only continue if the file hasn't changed since
+    #              (otherwise start over)
+    #   length=L   send just L bytes from the offset (one range of a
+    #              parallel download); a changed file is an error here
+    #   compress=C compress the data with codec C; the reply says which
+    #              codec is used (none if empty). Sizes and offsets
+    #              always count uncompressed bytes.
+    # Returns (offset, length, codec, reply); length is None for "to the
+    # end", and reply is an ERROR when the range can't be served.
+    if not options:
+        return 0, None, None, f"FILESIZE|{filesize}"
+
+    codec = download_codec(f, options.get('compress'))
+    suffix = f"|compress={codec or ''}" if 'compress' in options else ""
+
+    entry = get_user_manifest(username).get(filename)
+    sha256 = (entry or {}).get('sha256') or ''
+    changed = options.get('sha256', sha256) != sha256
+
+    try:
+        offset = int(options.get('offset', 0))
+        length = int(options['length']) if 'length' in options else None
+    except ValueError:
+        return 0, None, None, "ERROR|Invalid DOWNLOAD options."
+
+    if length is not None:
+        if changed:
+            return 0, None, None, "ERROR|File changed during transfer."
+        if offset < 0 or length < 0 or offset + length > filesize:
+            return 0, None, None, "ERROR|Range is outside the file."
+        return offset, length, codec, (f"FILESIZE|{filesize}|offset={offset}|length={length}"
+                                       f"|sha256={sha256}{suffix}")
+
+    if not 0 <= offset <= filesize or changed:
+        offset = 0
 
-    return content
+    return offset, None, codec, f"FILESIZE|{filesize}|offset={offset}|sha256={sha256}{suffix}"
 
 def delete_user_file(username, filename):
     # Deletes a file from user's dictionary.
@@ -145,11 +1284,53 @@ def delete_user_file(username, filename):
     user_dir = get_user_directory(username)
     filepath = os.path.join(user_dir, filename)
 
-    if os.path.exists(filepath):
-        os.remove(filepath)
-        return True
-    
-    return False
+    manifest = get_user_manifest(username)
+
+    with directory_lock(user_dir):
+        entry = manifest.get(filename)
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            # Packed, never existed, or another connection deleted it first
+            packed = _segments.delete(username, filename)
+            if entry is not None:
+                manifest.record_delete(filename)
+            file_changed(username, filename)
+            return packed
+        manifest.record_delete(filename)
+    file_changed(username, filename)
+    # One reference fewer; the blob goes with the last one
+    release_blob(entry)
+    return True
+
+# Page size limits for paginated LIST.
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+
+def list_page_reply(username, options):
+    # Builds the reply to a paginated LIST (any LIST with options).
+    # Options: limit, cursor, sort=name|size|mtime, order=asc|desc, detail=1
+    # Reply: PAGE|next_cursor|total|entry|entry|...
+    #   next_cursor is empty on the last page; with detail=1 each entry is
+    #   "name<TAB>size<TAB>mtime<TAB>sha256", otherwise just the name.
+    try:
+        limit = int(options.get('limit', LIST_DEFAULT_LIMIT))
+        limit = max(1, min(limit, LIST_MAX_LIMIT))
+        entries, next_cursor, total = get_user_manifest(username).page(
+            sort=options.get('sort', 'name'),
+            order=options.get('order', 'asc'),
+            limit=limit,
+            cursor=options.get('cursor') or None)
+    except ValueError as e:
+        return f"ERROR|Invalid LIST options: {e}"
+
+    if options.get('detail') == '1':
+        items = [f"{e['name']}\t{e['size']}\t{int(e['mtime'])}\t{e['sha256'] or ''}"
+                 for e in entries]
+    else:
+        items = [e['name'] for e in entries]
+
+    return "|".join(["PAGE", next_cursor, str(total)] + items)
 
 # ============================================================================
 # CLIENT HANDLER
@@ -158,42 +1339,112 @@ def delete_user_file(username, filename):
 def handle_client(client_socket, client_address):
     # Handles the authentication requests from a connected client.
 
-    # Protocol:
+    # Protocol (every message is a frame, see protocol.py):
     # - Client sends: REGISTER|username|password
     # - Server responds: SUCCESS or ERROR|message
 
     # - Client sends: LOGIN|username|password 
+    # - Server responds: SUCCESS|message|token or ERROR|message
+
+    # - Client sends: RESUME|token
+    # - Server responds: SUCCESS|message|username or ERROR|message
+
+    # - Client sends: UPLOAD|filename|filesize[|offset=N|compress=C], then DATA frames and END
     # - Server responds: SUCCESS or ERROR|message
 
-    print(f"[NEW CONNECTION] {client_address} connected.")
+    # - Client sends: UPLOAD_OFFSET|filename|filesize
+    # - Server responds: OFFSET|N (bytes of an interrupted upload it already has)
+
+    # - Client sends: UPLOAD_RANGE|filename|filesize|offset|length, then DATA frames and END
+    # - Server responds: SUCCESS or ERROR|message
+    #   (one range of a parallel upload; see parallel_transfer.py)
+
+    # - Client sends: UPLOAD_RANGES|filename|filesize
+    # - Server responds: RANGES|start-end,start-end,... (ranges it already has)
+
+    # - Client sends: UPLOAD_COMMIT|filename|filesize
+    # - Server responds: SUCCESS or ERROR|message
 
+    # - Client sends: DOWNLOAD|filename[|offset=N|length=L|sha256=H|compress=C]
+    # - Server responds: FILESIZE|size[|offset=N|length=L|sha256=H|compress=C],
+    #   DATA frames (from offset N) and END, then SUCCESS (or just ERROR|message)
+
+    # COMPRESSION:
+    # - Client sends: HELLO|compress=zlib,lzma,bz2 (any time, even before LOGIN)
+    # - Server responds: HELLO|compress=<the codecs both sides support>[|dedup=1]
+    # - UPLOAD and UPLOAD_RANGE then take a compress=C option too
+
+    # UPLOAD BY HASH (with --dedup, see blobstore.py):
+    # - Client sends: UPLOAD_HASH|filename|filesize|sha256
+    # - Server responds: SUCCESS|message if it has that content already,
+    #   otherwise MISSING|message (then UPLOAD as usual)
+
+    # DELTA UPLOAD (see delta.py):
+    # - Client sends: DELTA_SIGNATURES|filename
+    # - Server responds: SIGNATURES|size|block_size|sha256, DATA frames with
+    #   the block signatures and END (or ERROR|message)
+    # - Client sends: UPLOAD_DELTA|filename|filesize|base=H|block=B|sha256=H,
+    #   then DATA frames with COPY/LITERAL instructions and END
+    # - Server responds: SUCCESS|message or ERROR|message
+
+    connection_log.info('NEW CONNECTION', "%s connected.",
+                        client_address, client=client_address)
+
+    conn = FramedSocket(client_socket)
+    meter = CommandMeter(conn)
     authenticated = False
     current_user = None
+    session_token = None
 
     try:
         while True:
+            meter.finish(current_user)
             # Receive encrypted command from client
-            message = receive_encrypted(client_socket)
+            message = receive_encrypted(conn)
             if not message:
                 break
             
             # Parse command (format: COMMAND|username|password)
             parts = message.split('|')
             command = parts[0]
+            meter.start(command, message)
+
+            if invalid_file_command(parts):
+                if command in DATA_COMMANDS:
+                    conn.skip_data()
+                send_encrypted(conn, "ERROR|Invalid filename.")
+
+            elif command == "HELLO":
+                # Capability negotiation
+                # Format: HELLO|compress=zlib,lzma,bz2
+                send_encrypted(conn, hello_reply(parts))
+
+            elif command == "STATS":
+                # Server statistics (admins only)
+                if not authenticated or not is_admin(current_user):
+                    send_encrypted(conn, "ERROR|Permission denied.")
+                    continue
+                send_encrypted(conn, stats_reply())
 
-            if command == "REGISTER":
+            elif command == "REGISTER":
                 # Handle registration
                 username = parts[1]
                 password = parts[2]
 
-                print(f"[REGISTER] Attempting to register user: {username}")
+                session_log.debug('REGISTER', "Attempting to register user: %s",
+                                  username, user=username)
 
-                if register_user(username, password):
-                    print(f"[SUCCESS] User '{username}' registered.")   
-                    send_encrypted(client_socket, "SUCCESS|Registration successful.")
+                if not valid_username(username):
+                    session_log.warning('ERROR', "Invalid username %r.", username, user=username)
+                    send_encrypted(conn, "ERROR|Invalid username.")
+                elif register_user(username, password):
+                    session_log.info('SUCCESS', "User '%s' registered.",
+                                     username, user=username)
+                    send_encrypted(conn, "SUCCESS|Registration successful.")
                 else:
-                    print(f"[ERROR] Username '{username}' already taken.")
-                    send_encrypted(client_socket, "ERROR|Username already exists.")
+                    session_log.warning('ERROR', "Username '%s' already taken.",
+                                        username, user=username)
+                    send_encrypted(conn, "ERROR|Username already exists.")
 
 
             elif command == "LOGIN":
@@ -202,184 +1453,512 @@ def handle_client(client_socket, client_address):
                 username = parts[1]
                 password = parts[2]
 
-                print(f"[LOGIN] Attempting to login for user: {username}")
+                session_log.debug('LOGIN', "Attempting to login for user: %s",
+                                  username, user=username)
 
                 if authenticate_user(username, password):
                     authenticated = True
                     current_user = username
-                    print(f"[SUCCESS] User '{username}' logged in.")
-                    send_encrypted(client_socket, "SUCCESS|Login successful.")
+                    end_session(session_token)
+                    session_token = create_session(username)
+                    session_log.info('SUCCESS', "User '%s' logged in.",
+                                     username, user=username)
+                    send_encrypted(conn, f"SUCCESS|Login successful.|{session_token}")
+                else:
+                    session_log.warning('ERROR', "Invalid credentials for '%s'.",
+                                        username, user=username)
+                    send_encrypted(conn, "ERROR|Invalid username or password.")
+
+            elif command == "RESUME":
+                # Handle reconnect with a session token from an earlier LOGIN
+                # Format: RESUME|token
+                token = parts[1] if len(parts) > 1 else ""
+                username = resume_session(token)
+
+                if username:
+                    authenticated = True
+                    current_user = username
+                    session_token = token
+                    session_log.info('SUCCESS', "User '%s' resumed a session.",
+                                     username, user=username)
+                    send_encrypted(conn, f"SUCCESS|Session resumed.|{username}")
                 else:
-                    print(f"[ERROR] Invalid credentials for '{username}'.")
-                    send_encrypted(client_socket, "ERROR|Invalid username or password.")
+                    session_log.warning('ERROR', "Unknown or expired session token.")
+                    send_encrypted(conn, "ERROR|Session expired, please login.")
             
             elif command == "LOGOUT":
                 # Handle logout
                 if authenticated:
-                    print(f"[LOGOUT] User '{current_user}' logged out.")
+                    session_log.info('LOGOUT', "User '%s' logged out.",
+                                     current_user, user=current_user)
                     authenticated = False
                     current_user = None
-                    send_encrypted(client_socket, "SUCCESS|Logged out")
+                    end_session(session_token)
+                    session_token = None
+                    send_encrypted(conn, "SUCCESS|Logged out")
                 else:
-                    send_encrypted(client_socket, "ERROR|Not logged in")
+                    send_encrypted(conn, "ERROR|Not logged in")
             
             elif command == "UPLOAD":
                 # Handle file upload
                 #  Format: UPLOAD|filename|filesize
 
                 if not authenticated:
-                    send_encrypted(client_socket, "ERROR|Please login first.")
+                    # The file data follows the command; drop it
+                    conn.skip_data()
+                    send_encrypted(conn, "ERROR|Please login first.")
                     continue
 
                 filename = parts[1]
                 filesize = int(parts[2])
+                options = parse_options(parts[3:])
+                offset = int(options.get('offset', 0))
+
+                transfer_log.debug('UPLOAD', "%s uploading %s (%s bytes, from byte %s).",
+                                   current_user, filename, filesize, offset,
+                                   user=current_user, file=filename, size=filesize, offset=offset)
+
+                # Receive file content straight to disk
+                error = receive_uploaded_file(conn, current_user, filename, filesize, offset,
+                                              options.get('compress'))
+                if error is None:
+                    transfer_log.info('SUCCESS', "%s uploaded by %s.",
+                                      filename, current_user,
+                                      file=filename, user=current_user)
+                    send_encrypted(conn, "SUCCESS|File uploaded successfully!")
+                else:
+                    transfer_log.warning('ERROR', "Upload of %s by %s failed: %s",
+                                         filename, current_user, error,
+                                         file=filename, user=current_user, error=error)
+                    send_encrypted(conn, f"ERROR|{error}")
+
+            elif command == "UPLOAD_HASH":
+                # Upload by content hash: no data needed if the server has it
+                # Format: UPLOAD_HASH|filename|filesize|sha256
+                if not authenticated:
+                    send_encrypted(conn, "ERROR|Please login first.")
+                    continue
 
-                print(f"[UPLOAD] {current_user} uploading {filename} ({filesize} bytes.)")
-
-                # Send ready signal
-                send_encrypted(client_socket, "READY")
-
-                # Receive file content
-                file_content = ""
-                remaining = filesize
-
-                while remaining > 0:
-                    chunk_size = min(4096, remaining)
-                    chunk = client_socket.recv(chunk_size)
-                    if not chunk:
-                        break
-                    # Decrypt the chunk
-                    decrypted_chunk = caesar_decrypt(chunk.decode('utf-8'))
-                    file_content += decrypted_chunk
-                    remaining -= len(chunk)
-
-                # Save file
-                if save_uploaded_file(current_user, filename, file_content):
-                    print(f"[SUCCESS] {filename} uploaded by {current_user}.")
-                    send_encrypted(client_socket, "SUCCESS|File uploaded successfully!")
+                filename = parts[1]
+                if upload_by_hash(current_user, filename, int(parts[2]), parts[3]):
+                    transfer_log.info('SUCCESS', "%s uploaded by %s (content already stored).",
+                                      filename, current_user,
+                                      file=filename, user=current_user)
+                    send_encrypted(conn, "SUCCESS|File uploaded successfully! (already on server)")
                 else:
-                    send_encrypted(client_socket, "ERROR|Failed to save file.")
+                    send_encrypted(conn, "MISSING|Content not on server, send the data.")
 
-            elif command == "DOWNLOAD":
-                # Handle file download
-                # Format: DOWNLOAD|filename
+            elif command == "UPLOAD_OFFSET":
+                # Where an interrupted upload can continue from
+                # Format: UPLOAD_OFFSET|filename|filesize
                 if not authenticated:
-                    send_encrypted(client_socket, "ERROR|Please login first.")
+                    send_encrypted(conn, "ERROR|Please login first.")
+                    continue
+
+                offset = upload_offset(current_user, parts[1], int(parts[2]))
+                send_encrypted(conn, f"OFFSET|{offset}")
+
+            elif command == "UPLOAD_RANGE":
+                # One byte range of a parallel upload
+                # Format: UPLOAD_RANGE|filename|filesize|offset|length[|compress=C]
+                if not authenticated:
+                    conn.skip_data()
+                    send_encrypted(conn, "ERROR|Please login first.")
                     continue
 
                 filename = parts[1]
-                print(f"[DOWNLOAD] {current_user} downloading {filename}.")
+                filesize, offset, length = int(parts[2]), int(parts[3]), int(parts[4])
 
-                # Get file content
-                file_content = get_file_content(current_user, filename)
+                codec = parse_options(parts[5:]).get('compress')
 
-                if file_content is None:
-                    print(f"[ERROR] File {filename} not found for {current_user}.")
-                    send_encrypted(client_socket, "ERROR|File not found")
+                error = receive_upload_range(conn, current_user, filename, filesize, offset,
+                                             length, codec)
+                if error is None:
+                    send_encrypted(conn, "SUCCESS|Range stored.")
                 else:
-                    # Encrypt file content
-                    encrypted_content = caesar_encrypt(file_content)
-                    filesize = len(encrypted_content)
+                    transfer_log.warning('ERROR', "Range %s+%s of %s failed: %s",
+                                         offset, length, filename, error,
+                                         offset=offset, length=length, file=filename, error=error)
+                    send_encrypted(conn, f"ERROR|{error}")
+
+            elif command == "UPLOAD_RANGES":
+                # Which ranges of a parallel upload the server already has
+                # Format: UPLOAD_RANGES|filename|filesize
+                if not authenticated:
+                    send_encrypted(conn, "ERROR|Please login first.")
+                    continue
+
+                ranges = upload_ranges(current_user, parts[1], int(parts[2]))
+                send_encrypted(conn, "RANGES|" + ",".join(f"{s}-{e}" for s, e in ranges))
 
-                    # Send file content
-                    send_encrypted(client_socket, f"FILESIZE|{filesize}")
+            elif command == "DELTA_SIGNATURES":
+                # Block signatures of a stored file, for a delta upload
+                # Format: DELTA_SIGNATURES|filename
+                if not authenticated:
+                    send_encrypted(conn, "ERROR|Please login first.")
+                    continue
 
-                    # Wait for ready signal
-                    ready = receive_encrypted(client_socket)
+                f, filesize = open_user_file(current_user, parts[1])
+                if f is None:
+                    send_encrypted(conn, "ERROR|File not found")
+                    continue
 
-                    if ready == "READY":
-                        # Send encrypted file content
-                        print(f"[SUCCESS] {filename} sent to {current_user}")
-                        client_socket.send(encrypted_content.encode('utf-8'))
+                with f:
+                    reply, frames = delta_signatures(current_user, parts[1], f, filesize)
+                    send_encrypted(conn, reply)
+                    conn.send_data(frames)
 
-                        # Wait for confirmation
-                        confirmation = receive_encrypted(client_socket)
-                        send_encrypted(client_socket, "SUCCESS|File downloaded successfully!")
+            elif command == "UPLOAD_DELTA":
+                # A new version of a stored file, as a delta against it
+                # Format: UPLOAD_DELTA|filename|filesize|base=H|block=B|sha256=H
+                if not authenticated:
+                    conn.skip_data()
+                    send_encrypted(conn, "ERROR|Please login first.")
+                    continue
+
+                filename = parts[1]
+                filesize = int(parts[2])
+                transfer_log.debug('UPLOAD', "%s uploading %s (%s bytes) as a delta.",
+                                   current_user, filename, filesize,
+                                   user=current_user, file=filename, size=filesize)
+
+                error = receive_delta_upload(conn, current_user, filename, filesize,
+                                             parse_options(parts[3:]))
+                if error is None:
+                    transfer_log.info('SUCCESS', "%s uploaded by %s.",
+                                      filename, current_user,
+                                      file=filename, user=current_user)
+                    send_encrypted(conn, "SUCCESS|File uploaded successfully!")
+                else:
+                    transfer_log.warning('ERROR', "Delta upload of %s by %s failed: %s",
+                                         filename, current_user, error,
+                                         file=filename, user=current_user, error=error)
+                    send_encrypted(conn, f"ERROR|{error}")
+
+            elif command == "UPLOAD_COMMIT":
+                # All ranges are uploaded: put the file in place
+                # Format: UPLOAD_COMMIT|filename|filesize
+                if not authenticated:
+                    send_encrypted(conn, "ERROR|Please login first.")
+                    continue
+
+                filename = parts[1]
+                error = commit_upload(current_user, filename, int(parts[2]))
+                if error is None:
+                    transfer_log.info('SUCCESS', "%s uploaded by %s.",
+                                      filename, current_user,
+                                      file=filename, user=current_user)
+                    send_encrypted(conn, "SUCCESS|File uploaded successfully!")
+                else:
+                    transfer_log.warning('ERROR', "Upload of %s by %s failed: %s",
+                                         filename, current_user, error,
+                                         file=filename, user=current_user, error=error)
+                    send_encrypted(conn, f"ERROR|{error}")
+
+            elif command == "DOWNLOAD":
+                # Handle file download
+                # Format: DOWNLOAD|filename
+                if not authenticated:
+                    send_encrypted(conn, "ERROR|Please login first.")
+                    continue
+
+                filename = parts[1]
+                options = parse_options(parts[2:])
+                transfer_log.debug('DOWNLOAD', "%s downloading %s.",
+                                   current_user, filename, user=current_user, file=filename)
+
+                # Open the file (content is streamed, never loaded whole)
+                f, filesize = open_user_file(current_user, filename)
+
+                if f is None:
+                    transfer_log.warning('ERROR', "File %s not found for %s.",
+                                         filename, current_user,
+                                         file=filename, user=current_user)
+                    send_encrypted(conn, "ERROR|File not found")
+                    continue
+
+                with f:
+                    # Caesar cipher keeps the size unchanged
+                    offset, length, codec, reply = download_start(current_user, filename, f,
+                                                                  filesize, options)
+                    send_encrypted(conn, reply)
+                    if reply.startswith("ERROR"):
+                        continue
+
+                    send_user_file(conn, f, filesize, offset, length, codec,
+                                   key=(current_user, filename))
+                    transfer_log.info('SUCCESS', "%s sent to %s",
+                                      filename, current_user,
+                                      file=filename, user=current_user)
+
+                send_encrypted(conn, "SUCCESS|File downloaded successfully!")
 
             elif command == "LIST":
                 # Handle list files
                 if not authenticated:
-                    send_encrypted(client_socket, "ERROR| Please login first.")    
+                    send_encrypted(conn, "ERROR| Please login first.")    
                     continue
 
-                print(f"[LIST] {current_user} requesting file list.")
+                files_log.debug('LIST', "%s requesting file list.",
+                                current_user, user=current_user)
+
+                # Format: LIST (everything) or LIST|limit=N|cursor=...|sort=...
+                options = parse_options(parts[1:])
+                if options:
+                    send_encrypted(conn, list_page_reply(current_user, options))
+                    continue
 
                 files = list_user_files(current_user)
 
                 if files:
                     file_list = "|".join(files)
-                    send_encrypted(client_socket, f"LIST|{file_list}")
-                    print(f"[SUCCESS] Sent file list to {current_user}: {len(files)} files.")
+                    send_encrypted(conn, f"LIST|{file_list}")
+                    files_log.info('SUCCESS', "Sent file list to %s: %s files.",
+                                   current_user, len(files),
+                                   user=current_user, count=len(files))
                 else:
-                    print(f"[INFO] {current_user} has no files.")
-                    send_encrypted(client_socket, "LIST|No files available.")
+                    files_log.info('INFO', "%s has no files.",
+                                   current_user, user=current_user)
+                    send_encrypted(conn, "LIST|No files available.")
 
             elif command == "DELETE":
                 # Handle file Deletion
                 # Format: DELETE|filename
 
                 if not authenticated:
-                    send_encrypted(client_socket, "ERROR| Please login first.")    
+                    send_encrypted(conn, "ERROR| Please login first.")    
                     continue
 
                 filename = parts[1]
 
                 if delete_user_file(current_user, filename):
-                    send_encrypted(client_socket, "SUCCESS|File deleted successfully!")
-                    print(f"[SUCCESS] {filename} deleted by {current_user}.")
+                    send_encrypted(conn, "SUCCESS|File deleted successfully!")
+                    files_log.info('SUCCESS', "%s deleted by %s.",
+                                   filename, current_user, file=filename, user=current_user)
                 else:
-                    send_encrypted(client_socket, "ERROR|File not found")
-                    print(f"[ERROR] File {filename} not found for {current_user}.")
+                    send_encrypted(conn, "ERROR|File not found")
+                    files_log.warning('ERROR', "File %s not found for %s.",
+                                      filename, current_user,
+                                      file=filename, user=current_user)
 
             elif command == "EXIT":
                 # Client wants to disconnect
-                send_encrypted(client_socket, "GOODBYE")
+                send_encrypted(conn, "GOODBYE")
                 break
     
     except Exception as e:
-        print(f"[ERROR] Exception with {client_address}: {e}")
+        connection_log.error('ERROR', "Exception with %s: %s",
+                             client_address, e, client=client_address, error=str(e))
     finally:
+        meter.close(current_user)
         client_socket.close()
-        print(f"[DISCONNECTED] {client_address} disconnected.")
+        connection_log.info('DISCONNECTED', "%s disconnected.",
+                            client_address, client=client_address)
 
 # ============================================================================
 # MAIN SERVER
 # ============================================================================
 
+# Default size of the worker pool and the most connections the server will
+# hold at once (active + waiting in the queue). The asyncio engine doesn't
+# need a thread per connection, so it allows far more.
+DEFAULT_WORKERS = 16
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_ASYNC_MAX_CONNECTIONS = 10000
+
+def worker_loop(connection_queue, connection_slots):
+    # Runs in each pool thread: takes accepted sockets off the queue and
+    # serves them one at a time until it receives the None sentinel.
+    while True:
+        item = connection_queue.get()
+        if item is None:
+            break
+
+        client_socket, client_address = item
+        try:
+            handle_client(client_socket, client_address)
+        finally:
+            connection_slots.release()
 
-def main():
-    
-    def start_auth_server(host='127.0.0.1', port=5555):
-        # Starts the authentication server.
-        # Create socket
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-        # Bind and listen
-        server_socket.bind((host, port))
-        server_socket.listen(5)
-
-        print("=" * 60)
-        print("AUTHENTICATION SERVER")
-        print("=" * 60)
-        print(f"[STARTING] Server starting {host}:{port}")
-        print(f"[LISTENING] Waiting for connections...")
-        print("=" * 60)
+def reject_connection(client_socket, client_address):
+    # Tells a client the server is full and closes its socket.
+    connection_log.warning('BUSY', "Rejecting %s: too many connections.",
+                           client_address, client=client_address)
+    try:
+        send_encrypted(FramedSocket(client_socket), "ERROR|Server busy, try again later.")
+    except OSError:
+        pass
+    finally:
+        client_socket.close()
 
-        try:
-            while True:
-                # Accept connection
-                client_socket, client_address = server_socket.accept()
+def start_auth_server(host='127.0.0.1', port=5555, workers=DEFAULT_WORKERS,
+                      max_connections=DEFAULT_MAX_CONNECTIONS, reuse_port=False):
+    # Starts the authentication server.
+    # Accepted sockets go onto a queue served by 'workers' threads. At most
+    # 'max_connections' are held at once; extra clients are turned away.
+    # workers=0 keeps the original behaviour of serving clients one by one.
+    # reuse_port lets several worker processes listen on the same port.
+
+    # Create socket
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    # Bind and listen
+    server_socket.bind((host, port))
+    server_socket.listen(max(5, max_connections))
+
+    connection_queue = queue.Queue()
+    connection_slots = threading.BoundedSemaphore(max(1, max_connections))
+    threads = []
+
+    for i in range(workers):
+        thread = threading.Thread(target=worker_loop, name=f"worker-{i}",
+                                  args=(connection_queue, connection_slots), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    server_log.info('STARTING', "Authentication server starting %s:%s", host, port,
+                    engine='threads')
+    if workers:
+        server_log.info('WORKERS', "%s worker threads, up to %s connections",
+                        workers, max_connections)
+    server_log.info('LISTENING', "Waiting for connections...")
+
+    try:
+        while True:
+            # Accept connection
+            client_socket, client_address = server_socket.accept()
+
+            if not workers:
                 handle_client(client_socket, client_address)
-        
-        except KeyboardInterrupt:
-            print("\n[SHUTDOWN] Server shutting down...")
-        
-        finally:
-            server_socket.close()
-            print(f"[CLOSED] Server closed and offline.")
+            elif connection_slots.acquire(blocking=False):
+                connection_queue.put((client_socket, client_address))
+            else:
+                reject_connection(client_socket, client_address)
     
-    start_auth_server()
+    except KeyboardInterrupt:
+        server_log.info('SHUTDOWN', "Server shutting down...")
+    
+    finally:
+        for _ in threads:
+            connection_queue.put(None)
+        server_socket.close()
+        server_log.info('CLOSED', "Server closed and offline.")
+
+def parse_args(argv=None):
+    # Command-line options for the server.
+    parser = argparse.ArgumentParser(description="Secure file sharing server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help="threads: worker pool (default); asyncio: single event loop")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="worker threads (0 = serve one client at a time); "
+                             "with --engine asyncio, threads for disk I/O")
+    parser.add_argument('--max-connections', type=int, default=None,
+                        help="most connections held at once, per process (default: "
+                             f"{DEFAULT_MAX_CONNECTIONS} threads, {DEFAULT_ASYNC_MAX_CONNECTIONS} asyncio)")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="worker processes sharing the port via SO_REUSEPORT (Linux/BSD)")
+    parser.add_argument('--user-store', choices=user_store.BACKENDS, default='text',
+                        help="text: users.txt (default); sqlite: SQLite database")
+    parser.add_argument('--user-db', default=None,
+                        help=f"path of the user store (default: {USERS_FILE} or {user_store.USERS_DB})")
+    parser.add_argument('--storage', choices=storage.STORAGE_MODES, default=None,
+                        help="plain: files stored decrypted; encrypted: stored as sent on "
+                             "the wire and downloaded with sendfile() (default: current mode "
+                             f"of {storage.STORAGE_ROOT}/, plain for a new tree)")
+    parser.add_argument('--dedup', action='store_true',
+                        help="store identical files once, as hard links to a shared blob "
+                             f"in {storage.STORAGE_ROOT}/{storage.BLOB_DIR}/, and accept "
+                             "uploads by content hash")
+    parser.add_argument('--compression', choices=COMPRESSION_POLICIES, default='auto',
+                        help="auto: compress transfers when the client asks, except files "
+                             "that are compressed already (default); always; off")
+    serverlog.add_arguments(parser)
+    parser.add_argument('--trace', metavar='FILE',
+                        help="append every command (timing, sizes; no passwords or file "
+                             "content) to a JSONL trace for traffic.py replay")
+    parser.add_argument('--admins', default='', metavar='NAMES',
+                        help="comma-separated usernames allowed to use STATS")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics "
+                             "(with --processes, worker N uses PORT+N; default: 0, off)")
+    parser.add_argument('--metrics-host', default='127.0.0.1',
+                        help="address of the metrics endpoint (default: 127.0.0.1)")
+    parser.add_argument('--cache-size', type=int, default=0, metavar='BYTES',
+                        help="keep up to BYTES of hot files encrypted in memory for "
+                             "downloads (default: 0, off)")
+    parser.add_argument('--pack-threshold', type=int, default=0, metavar='BYTES',
+                        help="pack uploads of at most BYTES into shared segment files in "
+                             f"{storage.STORAGE_ROOT}/{storage.SEGMENT_DIR}/ (default: 0, off)")
+    return parser.parse_args(argv)
+
+def prepare_user_store(args):
+    # First start with the SQLite backend: copy users.txt into the new
+    # database once so existing accounts keep working.
+    if args.user_store != 'sqlite':
+        return
+    store = open_user_store(args.user_store, args.user_db)
+    if len(store) == 0 and os.path.exists(USERS_FILE):
+        count = store.import_users_file(USERS_FILE)
+        server_log.info('USERS', "Imported %s users from %s into %s.", count, USERS_FILE, store.path)
+
+def prepare_storage(args):
+    # Checks that --storage matches the files already on disk and fills in
+    # the mode to use when it wasn't given.
+    try:
+        args.storage = storage.resolve_storage_mode(args.storage)
+    except StorageError as e:
+        sys.exit(f"[ERROR] {e}")
+    server_log.info('STORAGE', "Files are stored %s.", args.storage)
+
+def run_engine(args, reuse_port=False):
+    # Runs the selected engine in the current process.
+    serverlog.configure_from_args(args)
+    configure_user_store(args.user_store, args.user_db)
+    configure_storage(args.storage or 'plain')
+    configure_compression(args.compression)
+    configure_dedup(args.dedup)
+    configure_packing(args.pack_threshold)
+    configure_download_cache(args.cache_size)
+    configure_admins(args.admins.split(','))
+    configure_trace(args.trace)
+    if args.metrics_port:
+        from prefork import worker_slot
+        serve_prometheus(args.metrics_host, args.metrics_port + worker_slot, prometheus_text)
+    if args.pack_threshold:
+        segments.start_compactor(_segments)
+
+    if args.engine == 'asyncio':
+        from async_server import start_async_server
+        start_async_server(args.host, args.port, args.workers,
+                           args.max_connections or DEFAULT_ASYNC_MAX_CONNECTIONS,
+                           reuse_port=reuse_port)
+    else:
+        start_auth_server(args.host, args.port, args.workers,
+                          args.max_connections or DEFAULT_MAX_CONNECTIONS,
+                          reuse_port=reuse_port)
+
+def main():
+    args = parse_args()
+    # Start-up messages are written directly; run_engine() moves logging to
+    # a writer thread (in each worker process, with --processes)
+    serverlog.configure_from_args(args, background=False)
+    prepare_user_store(args)
+    prepare_storage(args)
+
+    if args.processes > 1:
+        from prefork import run_prefork
+        run_prefork(args.processes, run_engine, (args, True))
+    else:
+        run_engine(args)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Run main() from the importable module rather than __main__, so
+    # async_server (which imports auth_server) sees the same configured
+    # user store and storage mode.
+    import auth_server
+    auth_server.main()
@@ -0,0 +1,105 @@
+# bench_cipher.py
+# Compares the original character-by-character Caesar cipher with the
+# table-driven engine in caesar_cipher.py and reports MB/s for each.
+#
+# Usage:
+#   python benchmarks/bench_cipher.py
+#   python benchmarks/bench_cipher.py --sizes 1024 65536 1048576 --repeat 5
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from caesar_cipher import caesar_encrypt, caesar_decrypt
+
+# ============================================================================
+# ORIGINAL IMPLEMENTATION (kept here only for comparison)
+# ============================================================================
+
+def legacy_caesar_encrypt(text, shift=3):
+    # The per-character version that used to live in auth_server.py.
+    result = ""
+    for char in text:
+        if char.isalpha():
+            shift_base = ord('A') if char.isupper() else ord('a')
+            result += chr((ord(char) - shift_base + shift) % 26 + shift_base)
+        else:
+            result += char
+    return result
+
+# ============================================================================
+# BENCHMARK HELPERS
+# ============================================================================
+
+def make_text(size, seed=0):
+    # Builds ASCII text that looks roughly like a log / CSV file.
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + " ,.|:-_\n"
+    return "".join(rng.choice(alphabet) for _ in range(size))
+
+def best_time(func, arg, repeat):
+    # Returns the fastest of `repeat` runs, in seconds.
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def mb_per_second(size, seconds):
+    if seconds <= 0:
+        return float('inf')
+    return size / seconds / (1024 * 1024)
+
+def check_equivalence(text):
+    # The new engine must give byte-for-byte the same output on ASCII input.
+    expected = legacy_caesar_encrypt(text)
+    assert caesar_encrypt(text) == expected
+    assert caesar_encrypt(text.encode('ascii')) == expected.encode('ascii')
+    assert caesar_decrypt(caesar_encrypt(text)) == text
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Caesar cipher throughput benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1024, 64 * 1024, 1024 * 1024])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-legacy-above', type=int, default=4 * 1024 * 1024,
+                        help="don't time the slow version on inputs larger than this")
+    args = parser.parse_args()
+
+    check_equivalence(make_text(10000, seed=42))
+
+    print("=" * 72)
+    print(f"{'size':>10} {'legacy str':>14} {'table str':>14} {'table bytes':>14} {'speedup':>10}")
+    print("=" * 72)
+
+    for size in args.sizes:
+        text = make_text(size)
+        data = text.encode('ascii')
+
+        if size <= args.skip_legacy_above:
+            legacy = mb_per_second(size, best_time(legacy_caesar_encrypt, text, args.repeat))
+        else:
+            legacy = None
+        table_str = mb_per_second(size, best_time(caesar_encrypt, text, args.repeat))
+        table_bytes = mb_per_second(size, best_time(caesar_encrypt, data, args.repeat))
+
+        legacy_col = f"{legacy:11.2f} MB/s" if legacy else f"{'-':>14}"
+        speedup = f"{table_bytes / legacy:9.0f}x" if legacy else f"{'-':>10}"
+        print(f"{size:>10} {legacy_col} {table_str:9.2f} MB/s {table_bytes:9.2f} MB/s {speedup}")
+
+    print("=" * 72)
+
+if __name__ == "__main__":
+    main()
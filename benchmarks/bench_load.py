@@ -0,0 +1,464 @@
+# bench_load.py
+# Load generator: starts the server in a temporary directory and has N
+# simulated users hammer it at once, each running a weighted mix of
+# REGISTER, LOGIN, UPLOAD, DOWNLOAD, LIST and DELETE with upload sizes
+# drawn from a weighted distribution. Reports ops/s, MB/s and p50/p95/p99
+# latency per command, as a table or as JSON (--json, --output) that a
+# later run can be compared against (--compare).
+#
+# Users are spread over several client processes (--processes) so the
+# clients' own encryption doesn't share one GIL and cap what the server
+# is asked to do. Every user registers and logs in before the clock
+# starts. During the run:
+#
+#   REGISTER - registers a new account (the user stays logged in as itself)
+#   LOGIN    - logs in again on the same connection
+#   UPLOAD   - uploads a new file of a size drawn from --sizes
+#   DOWNLOAD - downloads one of the user's files (uploads first if none)
+#   LIST     - requests one page of the listing
+#   DELETE   - deletes one of the user's files (uploads first if none)
+#
+# Upload data is random (--data text for compressible data) and every
+# upload's content is different, so a deduplicating server stores each one.
+# MB/s counts file bytes uploaded and downloaded.
+#
+# Usage:
+#   python benchmarks/bench_load.py
+#   python benchmarks/bench_load.py --users 64 --seconds 30 --json --output run.json
+#   python benchmarks/bench_load.py --mix download=80,list=20 --sizes 1MiB=1
+#   python benchmarks/bench_load.py --compare run.json --max-regression 10
+#   python benchmarks/bench_load.py --server-args --engine asyncio
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import auth_client
+import traffic
+from protocol import ProtocolError
+
+COMMANDS = ('REGISTER', 'LOGIN', 'UPLOAD', 'DOWNLOAD', 'LIST', 'DELETE')
+
+DEFAULT_MIX = 'upload=20,download=40,list=25,delete=10,login=4,register=1'
+DEFAULT_SIZES = '4KiB=50,64KiB=30,1MiB=15,8MiB=5'
+
+PASSWORD = 'load'
+
+UNITS = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'KIB': 1024,
+         'M': 1024 ** 2, 'MB': 1024 ** 2, 'MIB': 1024 ** 2,
+         'G': 1024 ** 3, 'GB': 1024 ** 3, 'GIB': 1024 ** 3}
+
+# ============================================================================
+# OPTIONS
+# ============================================================================
+
+def parse_size(text):
+    # "64KiB" -> 65536, "1M" -> 1048576, "100" -> 100
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([A-Za-z]*)\s*', text)
+    if not match or match.group(2).upper() not in UNITS:
+        raise ValueError(f"Bad size {text!r}")
+    return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+def parse_weights(text, parse_key):
+    # "a=3,b=1" -> {parse_key('a'): 3.0, parse_key('b'): 1.0}
+    weights = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        key, sep, weight = item.partition('=')
+        if not sep:
+            raise ValueError(f"Bad weight {item!r} (expected NAME=WEIGHT)")
+        weight = float(weight)
+        if weight < 0:
+            raise ValueError(f"Weight of {key} must not be negative")
+        weights[parse_key(key.strip())] = weight
+    if not weights or not any(weights.values()):
+        raise ValueError("At least one weight must be positive")
+    return weights
+
+def parse_command(name):
+    command = name.upper()
+    if command not in COMMANDS:
+        raise ValueError(f"Unknown command {name!r} (one of {', '.join(COMMANDS)})")
+    return command
+
+def mix_argument(text):
+    try:
+        return parse_weights(text, parse_command)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def sizes_argument(text):
+    try:
+        return parse_weights(text, parse_size)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+# ============================================================================
+# SIMULATED USERS
+# ============================================================================
+
+class LoadUser:
+    # One simulated user on its own connection. run() repeats weighted
+    # random commands until the deadline and returns its samples:
+    # (command, seconds, error, file bytes moved).
+
+    def __init__(self, port, index, directory, config):
+        self.port = port
+        self.index = index
+        self.username = f"load{index}"
+        self.directory = directory
+        self.config = config
+        self.random = random.Random(config['seed'] * 100003 + index)
+        self.files = []            # (name, size) of files on the server
+        self.sources = {}          # size -> local file uploads are sent from
+        self.counter = 0
+        self.conn = None
+
+    def connect(self):
+        self.conn = auth_client.connect_to_server('127.0.0.1', self.port)
+        auth_client.send_encrypted(self.conn, f"REGISTER|{self.username}|{PASSWORD}")
+        auth_client.receive_encrypted(self.conn)
+        self.login()
+
+    def login(self):
+        auth_client.send_encrypted(self.conn, f"LOGIN|{self.username}|{PASSWORD}")
+        parts = auth_client.receive_encrypted(self.conn).split('|')
+        if parts[0] != "SUCCESS":
+            raise ProtocolError(parts[1])
+
+    def close(self):
+        try:
+            auth_client.send_encrypted(self.conn, "EXIT")
+            auth_client.receive_encrypted(self.conn)
+        except (OSError, ProtocolError):
+            pass
+        self.conn.close()
+
+    def source(self, size):
+        # A local file of 'size' bytes whose first bytes are made unique
+        # for each upload, so no two uploads have the same content.
+        path = self.sources.get(size)
+        if path is None:
+            path = self.sources[size] = os.path.join(self.directory, f"{self.username}-{size}")
+            with open(path, 'wb') as f:
+                if self.config['data'] == 'text':
+                    line = b"The quick brown fox jumps over the lazy dog. 0123456789\n"
+                    f.write((line * (size // len(line) + 1))[:size])
+                else:
+                    f.write(os.urandom(size))
+        self.counter += 1
+        with open(path, 'r+b') as f:
+            f.write(f"{self.username}:{self.counter}:".encode()[:size])
+        return path
+
+    def pick_size(self):
+        sizes = self.config['sizes']
+        return self.random.choices(list(sizes), weights=list(sizes.values()))[0]
+
+    def run_command(self, command):
+        # Runs one command; returns (command actually run, error, bytes).
+        # The work to prepare an upload's file isn't timed.
+        if command in ('DOWNLOAD', 'DELETE') and not self.files:
+            command = 'UPLOAD'
+        compress = self.config['compress']
+
+        if command == 'UPLOAD':
+            size = self.pick_size()
+            path = self.source(size)
+            name = f"file-{self.counter}.bin"
+            started = time.perf_counter()
+            ok, _ = auth_client.upload(self.conn, path, name, retries=0, compress=compress)
+            if ok:
+                self.files.append((name, size))
+            return command, started, not ok, size if ok else 0
+
+        started = time.perf_counter()
+        if command == 'DOWNLOAD':
+            name, size = self.random.choice(self.files)
+            target = os.path.join(self.directory, f"{self.username}-download")
+            ok, _ = auth_client.download(self.conn, name, target, retries=0, compress=compress)
+            return command, started, not ok, size if ok else 0
+
+        if command == 'DELETE':
+            name, size = self.files.pop(self.random.randrange(len(self.files)))
+            auth_client.send_encrypted(self.conn, f"DELETE|{name}")
+            reply = auth_client.receive_encrypted(self.conn)
+        elif command == 'LIST':
+            auth_client.list_page(self.conn, limit=self.config['list_limit'])
+            reply = "PAGE"
+        elif command == 'LOGIN':
+            auth_client.send_encrypted(self.conn, f"LOGIN|{self.username}|{PASSWORD}")
+            reply = auth_client.receive_encrypted(self.conn)
+        else:
+            self.counter += 1
+            auth_client.send_encrypted(self.conn,
+                                       f"REGISTER|{self.username}-{self.counter}|{PASSWORD}")
+            reply = auth_client.receive_encrypted(self.conn)
+        return command, started, reply.startswith("ERROR"), 0
+
+    def run(self, deadline):
+        mix = self.config['mix']
+        commands, weights = list(mix), list(mix.values())
+        samples = []
+        while time.perf_counter() < deadline:
+            command = self.random.choices(commands, weights=weights)[0]
+            started = time.perf_counter()
+            try:
+                command, started, error, moved = self.run_command(command)
+                samples.append((command, time.perf_counter() - started, error, moved))
+            except (OSError, ProtocolError):
+                # Count the failure and carry on with a new connection
+                samples.append((command, time.perf_counter() - started, True, 0))
+                self.conn.close()
+                self.connect()
+        return samples
+
+def client(port, first, count, directory, config, ready, start, results):
+    # Runs in its own process: sets up users first..first+count-1, reports
+    # ready, waits for 'start' and runs them in threads for the configured
+    # time. Puts the samples of all its users on 'results'.
+    sys.stdout = open(os.devnull, 'w')   # the client prints progress lines
+    users = [LoadUser(port, index, directory, config) for index in range(first, first + count)]
+    for user in users:
+        user.connect()
+    ready.put(count)
+    start.wait()
+
+    deadline = time.perf_counter() + config['seconds']
+    samples = []
+    lock = threading.Lock()
+
+    def run(user):
+        collected = user.run(deadline)
+        with lock:
+            samples.extend(collected)
+
+    threads = [threading.Thread(target=run, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for user in users:
+        user.close()
+    results.put(samples)
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+def start_server(server, directory, port, server_args):
+    # Starts the server in 'directory' and waits until it accepts.
+    process = subprocess.Popen(
+        [sys.executable, server, '--port', str(port)] + server_args,
+        cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Server did not start")
+
+def report(samples, seconds):
+    # Per-command and total ops/s, MB/s and latency percentiles.
+    latency = traffic.latency_table((command, elapsed, error)
+                                    for command, elapsed, error, _ in samples)
+    moved = {}
+    for command, _, _, size in samples:
+        moved[command] = moved.get(command, 0) + size
+    commands = {}
+    for command, stats in latency.items():
+        commands[command] = {
+            'count': stats['count'],
+            'errors': stats['errors'],
+            'ops_per_second': round(stats['count'] / seconds, 1),
+            'mb_per_second': round(moved[command] / seconds / (1024 * 1024), 3),
+            'mean_ms': stats['mean_ms'],
+            'p50_ms': stats['p50_ms'],
+            'p95_ms': stats['p95_ms'],
+            'p99_ms': stats['p99_ms'],
+        }
+    total = traffic.latency_table(('ALL', elapsed, error) for _, elapsed, error, _ in samples)
+    total = total.get('ALL', {'count': 0, 'errors': 0})
+    total.update({
+        'ops_per_second': round(total['count'] / seconds, 1),
+        'mb_per_second': round(sum(moved.values()) / seconds / (1024 * 1024), 3),
+    })
+    return {'total': total, 'commands': commands}
+
+def run(args):
+    directory = tempfile.mkdtemp(prefix='fsp-load-')
+    server_dir = os.path.join(directory, 'server')
+    os.mkdir(server_dir)
+    process = None
+    config = {'mix': args.mix, 'sizes': args.sizes, 'data': args.data,
+              'compress': args.compress, 'list_limit': args.list_limit,
+              'seconds': args.seconds, 'seed': args.seed}
+    try:
+        process = start_server(args.server, server_dir, args.port, args.server_args)
+
+        processes = max(1, min(args.processes, args.users))
+        ready, start, results = multiprocessing.Queue(), multiprocessing.Event(), multiprocessing.Queue()
+        workers = []
+        first = 0
+        for n in range(processes):
+            count = args.users // processes + (n < args.users % processes)
+            workers.append(multiprocessing.Process(
+                target=client,
+                args=(args.port, first, count, directory, config, ready, start, results)))
+            first += count
+        for worker in workers:
+            worker.start()
+        for _ in workers:
+            ready.get(timeout=120)
+
+        started = time.perf_counter()
+        start.set()
+        samples = []
+        for _ in workers:
+            samples.extend(results.get(timeout=args.seconds + 300))
+        # Commands in flight at the deadline finish after it
+        seconds = time.perf_counter() - started
+        for worker in workers:
+            worker.join()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    result = {
+        'server': args.server,
+        'server_args': args.server_args,
+        'users': args.users,
+        'processes': processes,
+        'seconds': round(seconds, 3),
+        'mix': args.mix,
+        'sizes': {str(size): weight for size, weight in args.sizes.items()},
+        'data': args.data,
+        'compress': args.compress,
+    }
+    result.update(report(samples, seconds))
+    return result
+
+# ============================================================================
+# OUTPUT
+# ============================================================================
+
+def change(new, old):
+    # Relative change in percent, or None if there is nothing to compare.
+    if not old:
+        return None
+    return (new - old) / old * 100
+
+def regressions(result, baseline, limit):
+    # Commands whose ops/s fell or whose p95 rose by more than 'limit'
+    # percent against 'baseline'.
+    found = []
+    pairs = [('TOTAL', result['total'], baseline.get('total', {}))]
+    pairs += [(command, stats, baseline.get('commands', {}).get(command, {}))
+              for command, stats in result['commands'].items()]
+    for command, new, old in pairs:
+        rate = change(new.get('ops_per_second', 0), old.get('ops_per_second'))
+        p95 = change(new.get('p95_ms', 0), old.get('p95_ms'))
+        if rate is not None and rate < -limit:
+            found.append(f"{command}: ops/s {rate:+.1f}%")
+        if p95 is not None and p95 > limit:
+            found.append(f"{command}: p95 {p95:+.1f}%")
+    return found
+
+def print_result(result, baseline=None):
+    print("=" * 84)
+    print(f"{result['users']} users on {result['processes']} client processes, "
+          f"{result['seconds']}s")
+    print("=" * 84)
+    print(f"{'command':<10} {'count':>7} {'errors':>6} {'ops/s':>9} {'MB/s':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'vs base':>9}")
+    rows = list(result['commands'].items()) + [('TOTAL', result['total'])]
+    for command, stats in rows:
+        if baseline is None:
+            versus = ''
+        else:
+            old = (baseline.get('total', {}) if command == 'TOTAL'
+                   else baseline.get('commands', {}).get(command, {}))
+            rate = change(stats['ops_per_second'], old.get('ops_per_second'))
+            versus = '-' if rate is None else f"{rate:+.1f}%"
+        print(f"{command:<10} {stats['count']:>7} {stats['errors']:>6} "
+              f"{stats['ops_per_second']:>9} {stats['mb_per_second']:>9} "
+              f"{stats.get('p50_ms', 0):>9} {stats.get('p95_ms', 0):>9} "
+              f"{stats.get('p99_ms', 0):>9} {versus:>9}")
+    print("=" * 84)
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-client load generator")
+    parser.add_argument('--users', type=int, default=16,
+                        help="simulated users, each on its own connection (default: 16)")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help="client processes the users are spread over (default: CPUs)")
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--mix', type=mix_argument, default=mix_argument(DEFAULT_MIX),
+                        metavar='COMMAND=WEIGHT,...',
+                        help=f"command mix (default: {DEFAULT_MIX})")
+    parser.add_argument('--sizes', type=sizes_argument, default=sizes_argument(DEFAULT_SIZES),
+                        metavar='SIZE=WEIGHT,...',
+                        help=f"upload size distribution (default: {DEFAULT_SIZES})")
+    parser.add_argument('--data', choices=('random', 'text'), default='random',
+                        help="upload content: incompressible or compressible (default: random)")
+    parser.add_argument('--compress', action='store_true',
+                        help="let transfers use compression")
+    parser.add_argument('--list-limit', type=int, default=20,
+                        help="entries per LIST page (default: 20)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=5630)
+    parser.add_argument('--server', default=os.path.join(REPO, 'auth_server.py'),
+                        help="auth_server.py to run (default: this checkout)")
+    parser.add_argument('--json', action='store_true', help="print the result as JSON")
+    parser.add_argument('--output', metavar='FILE', help="also write the JSON result to FILE")
+    parser.add_argument('--compare', metavar='FILE', help="JSON result of an earlier run")
+    parser.add_argument('--max-regression', type=float, metavar='PERCENT',
+                        help="with --compare: exit 1 if ops/s fell or p95 rose by more")
+    parser.add_argument('--server-args', nargs=argparse.REMAINDER, default=[],
+                        help="extra arguments for auth_server.py (must come last)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    result = run(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_result(result, baseline)
+
+    if baseline is not None and args.max_regression is not None:
+        found = regressions(result, baseline, args.max_regression)
+        for line in found:
+            print(f"[REGRESSION] {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
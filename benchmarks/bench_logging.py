@@ -0,0 +1,168 @@
+# bench_logging.py
+# Measures what server logging costs: request throughput of a real server
+# (started in a temporary directory) under different logging settings,
+# with its stdout going to a pipe read by this process, the way a terminal
+# or log collector would take it.
+#
+# Each client logs in and repeats LIST and a small DOWNLOAD, the commands
+# that log the most per byte of work. Settings compared:
+#
+#   payloads - --log-payloads --log-level DEBUG: every message echoed, as
+#              the server did before it had log levels
+#   info     - the default
+#   warning  - --log-level WARNING
+#   json     - the default level as JSON lines
+#   legacy   - no logging options at all
+#
+# To compare against an older checkout (one that printed every message
+# synchronously), point --server at its auth_server.py and use
+# --settings legacy.
+#
+# Usage:
+#   python benchmarks/bench_logging.py
+#   python benchmarks/bench_logging.py --clients 16 --seconds 10
+#   python benchmarks/bench_logging.py --server ../old/auth_server.py --settings legacy
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import auth_client
+
+SETTINGS = {
+    'legacy': [],
+    'payloads': ['--log-payloads', '--log-level', 'DEBUG'],
+    'info': ['--log-level', 'INFO'],
+    'warning': ['--log-level', 'WARNING'],
+    'json': ['--log-format', 'json'],
+}
+
+# ============================================================================
+# BENCHMARK HELPERS
+# ============================================================================
+
+def start_server(server, directory, port, server_args):
+    # Starts the server with stdout on a pipe that a thread keeps reading.
+    # Returns (process, line counter).
+    process = subprocess.Popen(
+        [sys.executable, server, '--port', str(port)] + server_args,
+        cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    lines = [0]
+
+    def drain():
+        for _ in process.stdout:
+            lines[0] += 1
+
+    threading.Thread(target=drain, daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return process, lines
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Server did not start")
+
+def login(port, username, password='bench'):
+    conn = auth_client.connect_to_server('127.0.0.1', port)
+    auth_client.send_encrypted(conn, f"REGISTER|{username}|{password}")
+    auth_client.receive_encrypted(conn)
+    auth_client.send_encrypted(conn, f"LOGIN|{username}|{password}")
+    conn.session_token = auth_client.receive_encrypted(conn).split('|')[2]
+    return conn
+
+def client(port, index, source, seconds, start, results):
+    # Runs in its own process (so clients don't share a GIL): waits for
+    # 'start', then repeats LIST and DOWNLOAD for 'seconds' and puts its
+    # count of completed commands on the 'results' queue.
+    sys.stdout = open(os.devnull, 'w')   # the client prints progress lines
+    conn = login(port, f"bench{index}")
+    target = os.path.join(os.path.dirname(source), f"out-{index}")
+    ok, message = auth_client.upload(conn, source, 'small.txt')
+    if not ok:
+        raise RuntimeError(message)
+    start.wait()
+    deadline = time.perf_counter() + seconds
+    count = 0
+    while time.perf_counter() < deadline:
+        auth_client.send_encrypted(conn, "LIST")
+        auth_client.receive_encrypted(conn)
+        ok, message = auth_client.download(conn, 'small.txt', target, compress=False)
+        if not ok:
+            raise RuntimeError(message)
+        count += 2
+    auth_client.send_encrypted(conn, "EXIT")
+    auth_client.receive_encrypted(conn)
+    conn.close()
+    results.put(count)
+
+def run(server, setting, clients, seconds, port):
+    # Returns (commands per second, log lines per second) for one setting.
+    directory = tempfile.mkdtemp()
+    process = None
+    try:
+        source = os.path.join(directory, 'small.txt')
+        with open(source, 'wb') as f:
+            f.write(b"A small file, downloaded over and over.\n" * 100)
+        process, lines = start_server(server, directory, port, SETTINGS[setting])
+
+        start, results = multiprocessing.Event(), multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=client,
+                                           args=(port, i, source, seconds, start, results))
+                   for i in range(clients)]
+        for worker in workers:
+            worker.start()
+        time.sleep(1.0)   # let every client log in and upload first
+        lines_before = lines[0]
+        start.set()
+        counts = [results.get(timeout=seconds + 60) for _ in workers]
+        lines_logged = lines[0] - lines_before
+        for worker in workers:
+            worker.join()
+        return sum(counts) / seconds, lines_logged / seconds
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Server logging overhead benchmark")
+    parser.add_argument('--settings', nargs='+', choices=list(SETTINGS),
+                        default=['payloads', 'info', 'warning', 'json'])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--port', type=int, default=5610)
+    parser.add_argument('--server', default=os.path.join(REPO, 'auth_server.py'),
+                        help="auth_server.py to run (default: this checkout)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"{'setting':<10} {'commands/s':>12} {'log lines/s':>12} {'vs first':>10}")
+    print("=" * 60)
+    first = None
+    for setting in args.settings:
+        rates = [run(args.server, setting, args.clients, args.seconds, args.port)
+                 for _ in range(args.repeat)]
+        rate, lines = max(rates)
+        first = first or rate
+        print(f"{setting:<10} {rate:12.0f} {lines:12.0f} {rate / first:9.2f}x")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
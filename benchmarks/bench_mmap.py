@@ -0,0 +1,175 @@
+# bench_mmap.py
+# Compares the buffered and memory-mapped transfer paths for large files
+# (see mapped_io.py) in plain storage mode:
+#
+#   download - auth_server.send_user_file() to a real TCP connection on
+#              127.0.0.1, read() + encrypt vs. encrypt from a mapping
+#   upload   - a PendingUpload fed wire chunks, write() vs. writes into a
+#              preallocated, mapped .part file
+#
+# Every case runs in a fresh process so its peak RSS can be reported next
+# to MB/s: the mapped path maps one window at a time, so memory should
+# stay flat as files grow.
+#
+# Usage:
+#   python benchmarks/bench_mmap.py
+#   python benchmarks/bench_mmap.py --sizes 268435456 1073741824 --repeat 3
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import auth_server
+import mapped_io
+import storage
+from caesar_cipher import caesar_encrypt
+from protocol import FramedSocket
+
+# ============================================================================
+# ONE CASE (runs in its own process)
+# ============================================================================
+
+def connected_pair():
+    # Returns two ends of a loopback TCP connection.
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return FramedSocket(server), FramedSocket(client)
+
+def drain(conn, result):
+    # Receiver: counts payload bytes until END.
+    result['received'] = sum(len(payload) for payload in conn.iter_data())
+
+def run_download(path, size):
+    server, client = connected_pair()
+    result = {}
+    receiver = threading.Thread(target=drain, args=(client, result))
+    receiver.start()
+    try:
+        with open(path, 'rb') as f:
+            start = time.perf_counter()
+            auth_server.send_user_file(server, f, size)
+        receiver.join()
+        seconds = time.perf_counter() - start
+    finally:
+        server.close()
+        client.close()
+    assert result['received'] == size
+    return seconds
+
+def run_upload(path, size, directory):
+    # Feeds the file as 64 KiB wire chunks into a PendingUpload, the way
+    # receive_uploaded_file() does, and commits it. Reading and encrypting
+    # the chunks (the client's share) is timed too, the same for both paths.
+    storage.STORAGE_ROOT = os.path.join(directory, 'server_files')
+    start = time.perf_counter()
+    upload = auth_server.PendingUpload('bench', 'upload', size)
+    with open(path, 'rb') as f:
+        for chunk in auth_server.read_file_chunks(f):
+            upload.write_encrypted(caesar_encrypt(chunk))
+    assert upload.finish() is None
+    seconds = time.perf_counter() - start
+    os.remove(os.path.join(storage.STORAGE_ROOT, 'bench', 'upload'))
+    return seconds
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1024 * 1024)
+
+def run_case(direction, path, size, mapped, directory):
+    # Prints {"seconds", "rss_mb"} for one transfer.
+    auth_server.configure_storage('plain')
+    if not mapped:
+        mapped_io.MMAP_MIN_SIZE = float('inf')
+    if direction == 'download':
+        seconds = run_download(path, size)
+    else:
+        seconds = run_upload(path, size, directory)
+    print(json.dumps({'seconds': seconds, 'rss_mb': peak_rss_mb()}))
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def measure(direction, path, size, mapped, directory, repeat):
+    # Returns the fastest seconds and the highest peak RSS over 'repeat'
+    # fresh processes.
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--case', direction, path,
+             str(size), '1' if mapped else '0', directory],
+            check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    rss = [run['rss_mb'] for run in runs if run['rss_mb'] is not None]
+    return min(run['seconds'] for run in runs), max(rss) if rss else None
+
+def mb_per_second(size, seconds):
+    if seconds <= 0:
+        return float('inf')
+    return size / seconds / (1024 * 1024)
+
+def format_rss(rss):
+    return f"{rss:7.1f}MB" if rss is not None else f"{'n/a':>9}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Buffered vs memory-mapped transfer benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[16 * 1024 * 1024, 256 * 1024 * 1024])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--case', nargs=5, metavar=('DIRECTION', 'PATH', 'SIZE', 'MAPPED', 'DIR'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        direction, path, size, mapped, directory = args.case
+        run_case(direction, path, int(size), mapped == '1', directory)
+        return
+
+    print("=" * 78)
+    print(f"{'direction':<10} {'size':>11} {'buffered':>14} {'rss':>9} "
+          f"{'mapped':>14} {'rss':>9} {'speedup':>6}")
+    print("=" * 78)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            path = os.path.join(directory, f'file-{size}')
+            with open(path, 'wb') as f:
+                # Text-like data, so the cipher has letters to shift
+                block = os.urandom(1024 * 1024).hex().encode('ascii')[:1024 * 1024]
+                for start in range(0, size, len(block)):
+                    f.write(block[:size - start])
+
+            for direction in ('download', 'upload'):
+                plain, plain_rss = measure(direction, path, size, False, directory, args.repeat)
+                mapped, mapped_rss = measure(direction, path, size, True, directory, args.repeat)
+                print(f"{direction:<10} {size:>11} {mb_per_second(size, plain):9.1f} MB/s "
+                      f"{format_rss(plain_rss)} {mb_per_second(size, mapped):9.1f} MB/s "
+                      f"{format_rss(mapped_rss)} {plain / mapped:6.2f}x")
+            os.remove(path)
+
+    print("=" * 78)
+    print("rss = peak resident set size of the process running the transfer")
+
+if __name__ == "__main__":
+    main()
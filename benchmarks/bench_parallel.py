@@ -0,0 +1,116 @@
+# bench_parallel.py
+# Measures upload and download throughput of parallel_transfer.py for a
+# range of stream (connection) counts against a real server started in a
+# temporary directory. 1 stream is the single-connection baseline.
+#
+# Usage:
+#   python benchmarks/bench_parallel.py
+#   python benchmarks/bench_parallel.py --size 268435456 --streams 1 2 4 8 16
+#   python benchmarks/bench_parallel.py --server-args --storage encrypted
+
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import auth_client
+import parallel_transfer
+
+# ============================================================================
+# BENCHMARK HELPERS
+# ============================================================================
+
+def start_server(directory, port, server_args):
+    # Starts auth_server.py in 'directory' and waits until it accepts.
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(REPO, 'auth_server.py'), '--port', str(port)] + server_args,
+        cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("Server did not start")
+
+def login(port, username='bench', password='bench'):
+    conn = auth_client.connect_to_server('127.0.0.1', port)
+    auth_client.send_encrypted(conn, f"REGISTER|{username}|{password}")
+    auth_client.receive_encrypted(conn)
+    auth_client.send_encrypted(conn, f"LOGIN|{username}|{password}")
+    conn.session_token = auth_client.receive_encrypted(conn).split('|')[2]
+    return conn
+
+def timed(func, *args, **kwargs):
+    # Returns the seconds func took; fails loudly if the transfer failed.
+    start = time.perf_counter()
+    ok, message = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    if not ok:
+        raise RuntimeError(message)
+    return elapsed
+
+def mb_per_second(size, seconds):
+    if seconds <= 0:
+        return float('inf')
+    return size / seconds / (1024 * 1024)
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel range transfer benchmark")
+    parser.add_argument('--size', type=int, default=128 * 1024 * 1024)
+    parser.add_argument('--streams', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--range-size', type=int, default=parallel_transfer.RANGE_SIZE)
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--port', type=int, default=5600)
+    parser.add_argument('--server-args', nargs=argparse.REMAINDER, default=[],
+                        help="extra arguments for auth_server.py (must come last)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='fsp-bench-')
+    server = start_server(directory, args.port, args.server_args)
+
+    try:
+        conn = login(args.port)
+        login_pair = ('bench', 'bench')
+        source = os.path.join(directory, 'source.bin')
+        target = os.path.join(directory, 'target.bin')
+        with open(source, 'wb') as f:
+            f.write(os.urandom(args.size))
+
+        print("=" * 60)
+        print(f"{args.size} byte file, {args.range_size} byte ranges")
+        print(f"{'streams':>8} {'upload':>16} {'download':>16}")
+        print("=" * 60)
+
+        for streams in args.streams:
+            upload = min(timed(parallel_transfer.parallel_upload, conn, source, 'bench.bin',
+                               streams=streams, range_size=args.range_size, login=login_pair)
+                         for _ in range(args.repeat))
+            download = min(timed(parallel_transfer.parallel_download, conn, 'bench.bin', target,
+                                 streams=streams, range_size=args.range_size, login=login_pair)
+                           for _ in range(args.repeat))
+            print(f"{streams:>8} {mb_per_second(args.size, upload):11.2f} MB/s "
+                  f"{mb_per_second(args.size, download):11.2f} MB/s")
+
+        print("=" * 60)
+        conn.close()
+
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+# bench_primitives.py
+# Microbenchmarks of the server's building blocks, compared against a
+# saved baseline so an optimization (or a regression) of one function
+# shows up on its own, without the noise of a full client/server run:
+#
+#   cipher - caesar_encrypt / caesar_decrypt: input sizes x character mixes
+#            (letters, log-like text, non-ASCII text, random bytes)
+#   users  - load_users and authenticate_user with 1k / 100k / 1M users:
+#            full parse, first login after the file changed (index build),
+#            and logins against a loaded index
+#   files  - list_user_files for large directories: manifest in memory,
+#            manifest read from disk, and the first listing of a directory
+#            without a manifest (scan + hash)
+#   io     - save_uploaded_file / get_file_content throughput
+#
+# Everything runs through auth_server's functions in a temporary working
+# directory. Each case reports the best of --repeat timings; a timing
+# repeats the call until it has run for at least MIN_TIME.
+#
+# Results are compared with a baseline file (default:
+# benchmarks/baselines/bench_primitives.json) and a case regressed when it
+# got slower by more than its group's threshold (THRESHOLDS, or
+# --threshold for all). Timings of memory- and disk-bound code swing a lot
+# between runs, so a case that looks regressed is measured again (up to
+# --confirm more times, keeping the best) before it counts. The exit
+# status is 1 if anything regressed.
+#
+# Baselines depend on the machine: record one with --save-baseline before
+# changing code, then compare after, on the same machine with as little
+# else running as possible. The committed baseline is only a reference
+# point; on a busy or shared machine whole runs drift by more than the
+# thresholds.
+#
+# Usage:
+#   python benchmarks/bench_primitives.py --save-baseline benchmarks/baselines/bench_primitives.json
+#   python benchmarks/bench_primitives.py
+#   python benchmarks/bench_primitives.py --groups cipher io --threshold 10
+#   python benchmarks/bench_primitives.py --user-counts 1000 --file-counts 1000 --json
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import string
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import auth_server
+import manifest
+from caesar_cipher import caesar_encrypt, caesar_decrypt
+
+DEFAULT_BASELINE = os.path.join(REPO, 'benchmarks', 'baselines', 'bench_primitives.json')
+
+GROUPS = ('cipher', 'users', 'files', 'io')
+
+# Allowed slowdown per group, in percent. Small inputs and disk-bound
+# cases are noisy even as the best of several timings, so these catch
+# real slowdowns (an O(n) path turning O(n^2), a per-character loop
+# coming back), not a few percent; for fine comparisons use a quiet
+# machine, more --repeat and a lower --threshold.
+THRESHOLDS = {'cipher': 30, 'users': 30, 'files': 40, 'io': 50}
+
+# A timing repeats the call until it took at least this long.
+MIN_TIME = 0.1
+
+CIPHER_SIZES = [1024, 64 * 1024, 1024 * 1024]
+IO_SIZES = [4 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+USER_COUNTS = [1000, 100000, 1000000]
+FILE_COUNTS = [1000, 10000, 100000]
+
+# ============================================================================
+# BENCHMARK HELPERS
+# ============================================================================
+
+def size_label(size):
+    # 1024 -> '1KiB', 1048576 -> '1MiB'
+    for unit, scale in (('MiB', 1024 * 1024), ('KiB', 1024)):
+        if size >= scale and size % scale == 0:
+            return f"{size // scale}{unit}"
+    return f"{size}B"
+
+def count_label(count):
+    # 1000 -> '1k', 1000000 -> '1M'
+    for unit, scale in (('M', 1000000), ('k', 1000)):
+        if count >= scale and count % scale == 0:
+            return f"{count // scale}{unit}"
+    return str(count)
+
+def best_time(func, repeat, setup=None):
+    # Seconds per call of func(): the best of 'repeat' timings, each
+    # repeating the call until MIN_TIME has passed. setup(), if given,
+    # runs untimed before every call.
+    best = None
+    for _ in range(repeat):
+        calls = elapsed = 0
+        while elapsed < MIN_TIME:
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            elapsed += time.perf_counter() - start
+            calls += 1
+        per_call = elapsed / calls
+        if best is None or per_call < best:
+            best = per_call
+    return best
+
+def make_result(name, unit, seconds, amount=1):
+    # One case's result from the seconds per call. 'amount' is the bytes
+    # (MB/s) or operations (ops/s) one call handles.
+    if unit == 'MB/s':
+        value = round(amount / seconds / (1024 * 1024), 2)
+    elif unit == 'ops/s':
+        value = round(amount / seconds, 1)
+    else:
+        value = round(seconds * 1000, 3)
+    return {'name': name, 'value': value, 'unit': unit, 'higher_is_better': unit != 'ms'}
+
+class Runner:
+    # Measures cases and collects their results, re-measuring a case that
+    # looks regressed against the baseline (see compare_result()).
+
+    def __init__(self, args, baseline):
+        self.args = args
+        self.baseline = baseline
+        self.results = []
+
+    def measure(self, name, unit, func, setup=None, amount=1):
+        if self.args.filter not in name:
+            return
+        seconds = best_time(func, self.args.repeat, setup)
+        result = make_result(name, unit, seconds, amount)
+        for _ in range(self.args.confirm):
+            if compare_result(result, self.baseline, self.args.threshold) != 'REGRESSED':
+                break
+            seconds = min(seconds, best_time(func, self.args.repeat, setup))
+            result = make_result(name, unit, seconds, amount)
+        compare_result(result, self.baseline, self.args.threshold)
+        self.results.append(result)
+
+# ============================================================================
+# CASES
+# ============================================================================
+
+def make_input(mix, size, seed=0):
+    # 'size' bytes (UTF-8 encoded for str) of one character mix.
+    rng = random.Random(seed)
+    if mix == 'bytes':
+        return rng.randbytes(size)
+    if mix == 'letters':
+        return ''.join(rng.choices(string.ascii_letters, k=size))
+    if mix == 'text':
+        alphabet = string.ascii_letters + string.digits + " ,.|:-_\n"
+        return ''.join(rng.choices(alphabet, k=size))
+    # unicode: mostly ASCII with 2- and 3-byte characters mixed in
+    alphabet = string.ascii_letters + " .\n" + "éüßçñЖяλΩ" + "中文字"
+    chars, total = [], 0
+    while total < size:
+        char = rng.choice(alphabet)
+        chars.append(char)
+        total += len(char.encode('utf-8'))
+    return ''.join(chars)
+
+def bench_cipher(runner, args):
+    for mix in ('letters', 'text', 'unicode', 'bytes'):
+        for size in args.cipher_sizes:
+            data = make_input(mix, size)
+            encrypted = caesar_encrypt(data)
+            label = f"{mix}.{size_label(size)}"
+            runner.measure(f"cipher.encrypt.{label}", 'MB/s',
+                           lambda: caesar_encrypt(data), amount=size)
+            runner.measure(f"cipher.decrypt.{label}", 'MB/s',
+                           lambda: caesar_decrypt(encrypted), amount=size)
+
+def write_users(count):
+    # A users.txt with 'count' users, written directly (REGISTER would be
+    # far slower than what is measured).
+    with open(auth_server.USERS_FILE, 'w') as f:
+        for start in range(0, count, 10000):
+            f.write(''.join(f"user{i:07d}|pass{i}\n"
+                            for i in range(start, min(start + 10000, count))))
+
+def bench_users(runner, args):
+    rng = random.Random(0)
+    for count in args.user_counts:
+        write_users(count)
+        label = count_label(count)
+        runner.measure(f"users.load_users.{label}", 'ms', auth_server.load_users)
+
+        # First LOGIN after users.txt changed: the index is (re)built
+        def fresh_index():
+            auth_server.configure_user_store('text')
+        runner.measure(f"users.authenticate.cold.{label}", 'ms',
+                       lambda: auth_server.authenticate_user('user0000000', 'pass0'),
+                       setup=fresh_index)
+
+        # Logins against the loaded index: existing users, wrong passwords
+        # and unknown users
+        names = [f"user{rng.randrange(count):07d}" for _ in range(1000)]
+        attempts = [(name, 'pass' + str(int(name[4:])) if i % 3 else 'wrong')
+                    for i, name in enumerate(names)] + [('nobody', 'x')] * 100
+
+        def logins():
+            for username, password in attempts:
+                auth_server.authenticate_user(username, password)
+        runner.measure(f"users.authenticate.warm.{label}", 'ops/s', logins,
+                       amount=len(attempts))
+        os.remove(auth_server.USERS_FILE)
+    auth_server.configure_user_store('text')
+
+def bench_files(runner, args):
+    for count in args.file_counts:
+        username = f"list{count}"
+        user_dir = auth_server.get_user_directory(username)
+        for i in range(count):
+            with open(os.path.join(user_dir, f"file-{i:07d}.txt"), 'wb') as f:
+                f.write(b"x" * 64)
+        manifest_path = os.path.join(user_dir, manifest.MANIFEST_NAME)
+        label = count_label(count)
+
+        def list_files():
+            names = auth_server.list_user_files(username)
+            assert len(names) == count
+
+        # First listing of a directory without a manifest: scanned, hashed
+        def no_manifest():
+            manifest._manifests.pop(user_dir, None)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+        runner.measure(f"files.list.scan.{label}", 'ms', list_files, setup=no_manifest)
+
+        # First listing in a new process: the manifest is read from disk
+        def not_loaded():
+            manifest._manifests.pop(user_dir, None)
+        runner.measure(f"files.list.cold.{label}", 'ms', list_files, setup=not_loaded)
+
+        runner.measure(f"files.list.warm.{label}", 'ms', list_files)
+        manifest._manifests.pop(user_dir, None)
+        shutil.rmtree(user_dir)
+
+def bench_io(runner, args):
+    for size in args.io_sizes:
+        content = make_input('text', size)
+        label = size_label(size)
+        runner.measure(f"io.save_uploaded_file.{label}", 'MB/s',
+                       lambda: auth_server.save_uploaded_file('io', 'data.txt', content),
+                       amount=size)
+        runner.measure(f"io.get_file_content.{label}", 'MB/s',
+                       lambda: auth_server.get_file_content('io', 'data.txt'), amount=size)
+
+BENCHMARKS = {'cipher': bench_cipher, 'users': bench_users, 'files': bench_files, 'io': bench_io}
+
+# ============================================================================
+# BASELINES
+# ============================================================================
+
+def group_of(name):
+    return name.split('.', 1)[0]
+
+def compare_result(result, baseline, threshold=None):
+    # Adds 'baseline', 'change' (percent, positive = better) and 'status'
+    # (ok, improved, REGRESSED or new) to a result. Returns the status.
+    old = (baseline or {}).get('results', {}).get(result['name'])
+    if not old or not old.get('value'):
+        result['status'] = 'new'
+        return result['status']
+    change = (result['value'] - old['value']) / old['value'] * 100
+    if not result['higher_is_better']:
+        change = -change
+    limit = threshold if threshold is not None else old.get(
+        'threshold', THRESHOLDS[group_of(result['name'])])
+    result['baseline'] = old['value']
+    result['change'] = round(change, 1)
+    if change < -limit:
+        result['status'] = 'REGRESSED'
+    else:
+        result['status'] = 'improved' if change > limit else 'ok'
+    return result['status']
+
+def save_baseline(path, results, merge=True):
+    # Writes results as a baseline. With merge, cases not run this time
+    # keep their old values.
+    baseline = {'results': {}}
+    if merge and os.path.exists(path):
+        with open(path) as f:
+            baseline = json.load(f)
+    baseline['machine'] = {'python': platform.python_version(), 'platform': platform.platform(),
+                           'processor': platform.machine(), 'cpus': os.cpu_count()}
+    baseline['recorded'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    for result in results:
+        baseline['results'][result['name']] = {
+            'value': result['value'], 'unit': result['unit'],
+            'higher_is_better': result['higher_is_better'],
+            'threshold': THRESHOLDS[group_of(result['name'])],
+        }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+def print_results(results):
+    print("=" * 86)
+    print(f"{'case':<42} {'value':>12} {'unit':<6} {'baseline':>10} {'change':>8}  status")
+    print("=" * 86)
+    for result in results:
+        baseline = result.get('baseline', '-')
+        change = f"{result['change']:+.1f}%" if 'change' in result else '-'
+        print(f"{result['name']:<42} {result['value']:>12} {result['unit']:<6} "
+              f"{baseline:>10} {change:>8}  {result.get('status', '')}")
+    print("=" * 86)
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks with baselines")
+    parser.add_argument('--groups', nargs='+', choices=GROUPS, default=list(GROUPS))
+    parser.add_argument('--filter', default='', help="only report cases containing this text")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--cipher-sizes', type=int, nargs='+', default=CIPHER_SIZES)
+    parser.add_argument('--io-sizes', type=int, nargs='+', default=IO_SIZES)
+    parser.add_argument('--user-counts', type=int, nargs='+', default=USER_COUNTS)
+    parser.add_argument('--file-counts', type=int, nargs='+', default=FILE_COUNTS)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help="baseline to compare with (default: %(default)s)")
+    parser.add_argument('--threshold', type=float, metavar='PERCENT',
+                        help="allowed slowdown for every case (default: per group)")
+    parser.add_argument('--confirm', type=int, default=3,
+                        help="times a case that looks regressed is measured again (default: 3)")
+    parser.add_argument('--save-baseline', metavar='FILE',
+                        help="write the results to FILE as the new baseline")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    save_path = os.path.abspath(args.save_baseline) if args.save_baseline else None
+
+    # auth_server works relative to the current directory
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp(prefix='fsp-bench-')
+    os.chdir(directory)
+    runner = Runner(args, baseline)
+    try:
+        for group in args.groups:
+            BENCHMARKS[group](runner, args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+    results = runner.results
+
+    regressed = [result['name'] for result in results if result['status'] == 'REGRESSED']
+    if save_path:
+        save_baseline(save_path, results)
+
+    if args.json:
+        print(json.dumps({'results': results, 'regressed': regressed}, indent=2))
+    else:
+        print_results(results)
+    if regressed and not save_path:
+        print(f"[REGRESSION] {len(regressed)} case(s) slower than the baseline allows: "
+              f"{', '.join(regressed)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
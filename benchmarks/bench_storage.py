@@ -0,0 +1,122 @@
+# bench_storage.py
+# Compares DOWNLOAD throughput of the two storage modes (see storage.py):
+#
+#   plain     - read the file, encrypt each block in Python, send it
+#   encrypted - file is already in wire form, sent with sendfile()
+#
+# The server side is auth_server.send_user_file() writing to a real TCP
+# connection on 127.0.0.1; a thread on the other end reads the frames.
+# Besides MB/s, the CPU time spent by the sending thread is reported,
+# since that is what limits how many downloads one server can carry.
+#
+# Usage:
+#   python benchmarks/bench_storage.py
+#   python benchmarks/bench_storage.py --sizes 1048576 104857600 --repeat 5
+
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth_server
+from caesar_cipher import caesar_encrypt
+from protocol import FramedSocket
+
+# ============================================================================
+# BENCHMARK HELPERS
+# ============================================================================
+
+def connected_pair():
+    # Returns two ends of a loopback TCP connection.
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return FramedSocket(server), FramedSocket(client)
+
+def drain(conn, result):
+    # Receiver: counts payload bytes until END.
+    result['received'] = sum(len(payload) for payload in conn.iter_data())
+
+def time_download(path, size, mode):
+    # Sends the file once in the given mode.
+    # Returns (wall seconds, sender CPU seconds).
+    auth_server.configure_storage(mode)
+    server, client = connected_pair()
+    result = {}
+    receiver = threading.Thread(target=drain, args=(client, result))
+    receiver.start()
+
+    try:
+        with open(path, 'rb') as f:
+            start = time.perf_counter()
+            cpu_start = time.thread_time()
+            auth_server.send_user_file(server, f, size)
+            cpu = time.thread_time() - cpu_start
+        receiver.join()
+        wall = time.perf_counter() - start
+    finally:
+        server.close()
+        client.close()
+
+    assert result['received'] == size
+    return wall, cpu
+
+def best_times(path, size, mode, repeat):
+    # Returns the fastest (wall, cpu) of `repeat` runs.
+    runs = [time_download(path, size, mode) for _ in range(repeat)]
+    return min(run[0] for run in runs), min(run[1] for run in runs)
+
+def mb_per_second(size, seconds):
+    if seconds <= 0:
+        return float('inf')
+    return size / seconds / (1024 * 1024)
+
+def make_files(directory, size):
+    # Writes the same random content in both storage forms.
+    data = os.urandom(size)
+    plain_path = os.path.join(directory, f'plain-{size}')
+    encrypted_path = os.path.join(directory, f'encrypted-{size}')
+    with open(plain_path, 'wb') as f:
+        f.write(data)
+    with open(encrypted_path, 'wb') as f:
+        f.write(caesar_encrypt(data))
+    return plain_path, encrypted_path
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage mode download benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[64 * 1024, 1024 * 1024, 64 * 1024 * 1024])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print("=" * 78)
+    print(f"{'size':>10} {'plain':>14} {'cpu':>9} {'encrypted':>14} {'cpu':>9} {'speedup':>9}")
+    print("=" * 78)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            plain_path, encrypted_path = make_files(directory, size)
+            plain_wall, plain_cpu = best_times(plain_path, size, 'plain', args.repeat)
+            enc_wall, enc_cpu = best_times(encrypted_path, size, 'encrypted', args.repeat)
+
+            print(f"{size:>10} {mb_per_second(size, plain_wall):9.2f} MB/s {plain_cpu * 1000:7.1f}ms "
+                  f"{mb_per_second(size, enc_wall):9.2f} MB/s {enc_cpu * 1000:7.1f}ms "
+                  f"{plain_wall / enc_wall:8.1f}x")
+
+    print("=" * 78)
+    print("cpu = CPU time of the sending thread (best run)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# blobstore.py
+# Content-addressed storage that keeps every distinct file content once.
+# Blobs live in server_files/.fsp-blobs/<first 2 hex digits>/<sha256>,
+# named by the SHA-256 of the plaintext and stored in the tree's storage
+# mode. A user's file is a hard link to its blob, so everything that reads
+# files (open(), sendfile(), the manifest) works unchanged, and the
+# inode's link count is the reference count: once it drops to 1 (only the
+# store's own link is left) nobody uses the blob and it is removed.
+#
+# Linked files must never be written in place. Every writer builds a new
+# file and renames it over the old name, which just drops one reference.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import argparse
+import os
+import string
+import uuid
+
+from caesar_cipher import caesar_decrypt
+from manifest import hash_file
+from storage import BLOB_DIR, INTERNAL_PREFIX, STORAGE_ROOT, iter_user_files, read_storage_mode
+import serverlog
+
+_log = serverlog.get_logger('storage')
+
+# Temporary links in a user's directory, renamed into place right away.
+LINK_PREFIX = INTERNAL_PREFIX + 'link-'
+
+def valid_hash(sha256):
+    return len(sha256) == 64 and all(c in string.hexdigits.lower() for c in sha256)
+
+def blob_path(sha256, root=STORAGE_ROOT):
+    return os.path.join(root, BLOB_DIR, sha256[:2], sha256)
+
+def add(path, sha256, root=STORAGE_ROOT):
+    # Makes the complete file at 'path' the blob for 'sha256' if the store
+    # has none yet. Returns True if it became the blob, False if there
+    # already was one (or the filesystem can't hard-link; the file then
+    # simply isn't shared).
+    blob = blob_path(sha256, root)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    try:
+        os.link(path, blob)
+    except FileExistsError:
+        return False
+    except OSError as e:
+        _log.warning('WARNING', "Could not add %s to the blob store: %s", sha256[:12], e,
+                     sha256=sha256, error=str(e))
+        return False
+    return True
+
+def link(sha256, size, directory, root=STORAGE_ROOT):
+    # Returns a new hidden name in 'directory' linked to the blob with this
+    # hash, for the caller to rename into place, or None if the store has
+    # no such blob of 'size' bytes.
+    blob = blob_path(sha256, root)
+    try:
+        if os.stat(blob).st_size != size:
+            return None
+        temp_path = os.path.join(directory, LINK_PREFIX + uuid.uuid4().hex)
+        os.link(blob, temp_path)
+    except OSError:
+        # Gone (released meanwhile) or no hard links here
+        return None
+    return temp_path
+
+def release(sha256, root=STORAGE_ROOT):
+    # Called after a user file with this content was deleted or replaced:
+    # removes the blob once no user file refers to it any more.
+    # A link made at the same moment keeps its content; only the store's
+    # copy goes, so at worst a later upload isn't deduplicated.
+    if not sha256 or not valid_hash(sha256):
+        return
+    blob = blob_path(sha256, root)
+    try:
+        if os.stat(blob).st_nlink <= 1:
+            os.remove(blob)
+    except FileNotFoundError:
+        pass
+
+def iter_blobs(root=STORAGE_ROOT):
+    # Yields (sha256, path) for every blob in the store.
+    blob_dir = os.path.join(root, BLOB_DIR)
+    if not os.path.isdir(blob_dir):
+        return
+    for prefix in sorted(os.listdir(blob_dir)):
+        prefix_dir = os.path.join(blob_dir, prefix)
+        if os.path.isdir(prefix_dir):
+            for name in sorted(os.listdir(prefix_dir)):
+                yield name, os.path.join(prefix_dir, name)
+
+def collect_garbage(root=STORAGE_ROOT):
+    # Removes blobs no user file refers to. Returns how many.
+    removed = 0
+    for sha256, path in iter_blobs(root):
+        try:
+            if os.stat(path).st_nlink <= 1:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+def store_stats(root=STORAGE_ROOT):
+    # Returns {'blobs', 'references', 'bytes', 'saved_bytes'}: the bytes
+    # the blobs take, and how many more separate copies would take.
+    stats = {'blobs': 0, 'references': 0, 'bytes': 0, 'saved_bytes': 0}
+    for sha256, path in iter_blobs(root):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        refs = st.st_nlink - 1
+        stats['blobs'] += 1
+        stats['references'] += refs
+        stats['bytes'] += st.st_size
+        stats['saved_bytes'] += st.st_size * max(refs - 1, 0)
+    return stats
+
+# ============================================================================
+# COMMAND-LINE TOOL
+# ============================================================================
+
+def dedup_tree(root=STORAGE_ROOT):
+    # Puts the files already in the tree into the store: each becomes a
+    # blob, or is replaced by a link to an identical one. Returns
+    # (files replaced by a link, bytes saved).
+    decode = caesar_decrypt if read_storage_mode(root) == 'encrypted' else None
+    linked = saved = 0
+    for relative_path, path in iter_user_files(root):
+        sha256 = hash_file(path, decode=decode)
+        if add(path, sha256, root):
+            continue
+        st = os.stat(path)
+        if os.stat(blob_path(sha256, root)).st_ino == st.st_ino:
+            continue
+        temp_path = link(sha256, st.st_size, os.path.dirname(path), root)
+        if temp_path is not None:
+            os.replace(temp_path, path)
+            linked += 1
+            saved += st.st_size
+    return linked, saved
+
+def main():
+    # python blobstore.py status|dedup|gc [--root server_files]
+    parser = argparse.ArgumentParser(description="Deduplicating blob store tools")
+    parser.add_argument('command', choices=['status', 'dedup', 'gc'],
+                        help="status: show store usage; dedup: add the existing files "
+                             "(stop the server first); gc: remove unreferenced blobs")
+    parser.add_argument('--root', default=STORAGE_ROOT)
+    args = parser.parse_args()
+
+    if args.command == 'dedup':
+        linked, saved = dedup_tree(args.root)
+        print(f"[DEDUP] {linked} files now share content with another; {saved} bytes freed.")
+    elif args.command == 'gc':
+        print(f"[DEDUP] Removed {collect_garbage(args.root)} unreferenced blobs.")
+
+    stats = store_stats(args.root)
+    print(f"[DEDUP] {stats['blobs']} blobs ({stats['bytes']} bytes) referenced by "
+          f"{stats['references']} files; {stats['saved_bytes']} bytes saved.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# caesar_cipher.py
+# Shared Caesar cipher engine used by auth_server.py and auth_client.py
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import string
+
+# ============================================================================
+# TRANSLATION TABLES
+# ============================================================================
+
+# Instead of shifting one character at a time, we build a lookup table for
+# each shift once and let str.translate / bytes.translate do the work in C.
+# Only the 52 ASCII letters move; digits, symbols, spaces and any non-ASCII
+# bytes pass through unchanged. Because UTF-8 never uses bytes below 0x80
+# inside a multi-byte character, shifting the raw bytes gives the same
+# result as shifting the decoded text.
+
+_TABLES = {}
+
+def _build_tables(shift):
+    # Returns (str_table, bytes_table) for the given shift (0-25).
+    upper = string.ascii_uppercase
+    lower = string.ascii_lowercase
+    source = upper + lower
+    target = upper[shift:] + upper[:shift] + lower[shift:] + lower[:shift]
+
+    str_table = str.maketrans(source, target)
+    bytes_table = bytes.maketrans(source.encode('ascii'), target.encode('ascii'))
+    return str_table, bytes_table
+
+def get_tables(shift=3):
+    # Returns the cached (str_table, bytes_table) pair for a shift.
+    # There are only 26 distinct shifts, so the cache never grows past that.
+    shift %= 26
+    tables = _TABLES.get(shift)
+    if tables is None:
+        tables = _TABLES[shift] = _build_tables(shift)
+    return tables
+
+def get_byte_table(shift=3):
+    # Returns the 256-byte table for bytes.translate().
+    return get_tables(shift)[1]
+
+# ============================================================================
+# ENCRYPTION FUNCTIONS
+# ============================================================================
+
+def caesar_encrypt(data, shift=3):
+    # Encrypts text using Caesar cipher.
+    # Accepts str (returns str) or bytes-like socket data (returns bytes,
+    # or bytearray for bytearray input) so buffers never need decoding.
+    str_table, bytes_table = get_tables(shift)
+
+    if isinstance(data, str):
+        return data.translate(str_table)
+    if isinstance(data, (bytes, bytearray)):
+        return data.translate(bytes_table)
+    # memoryview or other buffer objects
+    return bytes(data).translate(bytes_table)
+
+def caesar_decrypt(data, shift=3):
+    # Decrypts Caesar cipher text or bytes.
+    return caesar_encrypt(data, -shift)
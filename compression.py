@@ -0,0 +1,247 @@
+# compression.py
+# Per-transfer compression. Client and server agree on the codecs both
+# support (HELLO), then each UPLOAD/DOWNLOAD may name one. File content is
+# compressed as a stream *before* the cipher and decompressed after it, so
+# text files cross the network at a fraction of their size.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import threading
+import time
+import zlib
+
+import serverlog
+
+_log = serverlog.get_logger('transfer')
+
+# bz2 and lzma are optional parts of some Python builds
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# name -> (compressor factory, decompressor factory), in order of
+# preference: zlib is fastest, lzma and bz2 compress harder but slower.
+CODECS = {'zlib': (lambda: zlib.compressobj(6), zlib.decompressobj)}
+if lzma is not None:
+    CODECS['lzma'] = (lambda: lzma.LZMACompressor(preset=1), lzma.LZMADecompressor)
+if bz2 is not None:
+    CODECS['bz2'] = (bz2.BZ2Compressor, bz2.BZ2Decompressor)
+
+# Most output a decompressor may produce per call, so a tiny malicious
+# frame can't expand into gigabytes of memory at once.
+MAX_OUTPUT_CHUNK = 1024 * 1024
+
+# What the codecs raise for data that isn't a valid stream (bz2 raises
+# OSError); Decompressor turns them all into ValueError.
+CORRUPT_ERRORS = (zlib.error, EOFError, OSError) + ((lzma.LZMAError,) if lzma else ())
+
+def available():
+    # Codec names this side supports, most preferred first.
+    return list(CODECS)
+
+def negotiate(offered):
+    # Picks the codecs from 'offered' (the peer's list) that we support
+    # too, keeping the peer's order.
+    return [name for name in offered if name in CODECS]
+
+# ============================================================================
+# ALREADY-COMPRESSED DETECTION
+# ============================================================================
+
+# Bytes a sample is judged on.
+SAMPLE_SIZE = 64 * 1024
+
+# Leading bytes of common formats that are compressed already. ZIP covers
+# .docx/.xlsx/.pptx/.jar/.apk as well.
+COMPRESSED_SIGNATURES = (
+    b'PK\x03\x04',          # zip, Office Open XML
+    b'\x1f\x8b',            # gzip
+    b'BZh',                 # bzip2
+    b'\xfd7zXZ\x00',        # xz
+    b'(\xb5/\xfd',          # zstd
+    b'7z\xbc\xaf\x27\x1c',  # 7-Zip
+    b'Rar!',                # rar
+    b'\x89PNG',             # png
+    b'\xff\xd8\xff',        # jpeg
+    b'GIF8',                # gif
+    b'OggS',                # ogg
+    b'fLaC',                # flac
+    b'ID3',                 # mp3
+)
+
+# A sample that zlib can't shrink below this fraction isn't worth it.
+MIN_SAVING_RATIO = 0.9
+
+def looks_compressed(sample):
+    # Guesses from the first bytes of a file whether compressing it again
+    # would be wasted work: known compressed formats by signature, anything
+    # else by trying a fast zlib pass over the sample.
+    if not sample:
+        return False
+    sample = bytes(sample[:SAMPLE_SIZE])
+    if sample.startswith(COMPRESSED_SIGNATURES) or sample[4:8] == b'ftyp':  # mp4/mov
+        return True
+    return len(zlib.compress(sample, 1)) > MIN_SAVING_RATIO * len(sample)
+
+# ============================================================================
+# STATISTICS
+# ============================================================================
+
+class CompressionStats:
+    # Totals per direction ('upload' is data the server decompresses,
+    # 'download' data it compresses): transfers, raw (uncompressed) bytes,
+    # wire (compressed) bytes and seconds spent in the codec.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, direction, codec, raw_bytes, wire_bytes, seconds):
+        with self._lock:
+            totals = self._totals.setdefault(direction, {
+                'transfers': 0, 'raw_bytes': 0, 'wire_bytes': 0, 'seconds': 0.0})
+            totals['transfers'] += 1
+            totals['raw_bytes'] += raw_bytes
+            totals['wire_bytes'] += wire_bytes
+            totals['seconds'] += seconds
+        _log.info('COMPRESSION', "%s %s: %s -> %s bytes (%.1f%%) in %.3fs",
+                  direction, codec, raw_bytes, wire_bytes,
+                  100 * wire_bytes / raw_bytes if raw_bytes else 100, seconds,
+                  direction=direction, codec=codec, raw_bytes=raw_bytes,
+                  wire_bytes=wire_bytes, seconds=seconds)
+
+    def snapshot(self):
+        # Returns {direction: {..., 'ratio': wire/raw}}.
+        with self._lock:
+            result = {}
+            for direction, totals in self._totals.items():
+                entry = dict(totals)
+                raw = entry['raw_bytes']
+                entry['ratio'] = entry['wire_bytes'] / raw if raw else 1.0
+                result[direction] = entry
+            return result
+
+STATS = CompressionStats()
+
+# ============================================================================
+# STREAMING CODECS
+# ============================================================================
+
+class Compressor:
+    # Compresses one transfer as a stream of chunks.
+
+    def __init__(self, codec, direction='download', stats=STATS):
+        self.codec = codec
+        self.direction = direction
+        self.stats = stats
+        self._compressor = CODECS[codec][0]()
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.seconds = 0.0
+
+    def compress(self, data):
+        start = time.perf_counter()
+        out = self._compressor.compress(data)
+        self.seconds += time.perf_counter() - start
+        self.raw_bytes += len(data)
+        self.wire_bytes += len(out)
+        return out
+
+    def flush(self):
+        start = time.perf_counter()
+        out = self._compressor.flush()
+        self.seconds += time.perf_counter() - start
+        self.wire_bytes += len(out)
+        if self.stats is not None:
+            self.stats.record(self.direction, self.codec, self.raw_bytes,
+                              self.wire_bytes, self.seconds)
+        return out
+
+class Decompressor:
+    # Decompresses one transfer as a stream of chunks.
+
+    def __init__(self, codec, direction='upload', stats=STATS):
+        self.codec = codec
+        self.direction = direction
+        self.stats = stats
+        self._decompressor = CODECS[codec][1]()
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.seconds = 0.0
+
+    def _step(self, data):
+        # One bounded call into the decompressor.
+        # zlib hands back the input it didn't get to; bz2/lzma keep it
+        # internally and say whether they need more
+        d = self._decompressor
+        try:
+            if hasattr(d, 'unconsumed_tail'):
+                out = d.decompress(data or d.unconsumed_tail, MAX_OUTPUT_CHUNK)
+                more = bool(d.unconsumed_tail)
+            else:
+                out = d.decompress(data, MAX_OUTPUT_CHUNK)
+                more = not d.needs_input and not d.eof
+        except CORRUPT_ERRORS as e:
+            raise ValueError(f"Corrupt compressed data ({e})") from None
+        return out, more
+
+    def feed(self, data):
+        # Generator yielding the plaintext for one chunk of compressed data.
+        # Raises ValueError if the data is corrupt.
+        self.wire_bytes += len(data)
+        start = time.perf_counter()
+        try:
+            out, more = self._step(data)
+            while True:
+                if out:
+                    self.raw_bytes += len(out)
+                    self.seconds += time.perf_counter() - start
+                    yield out
+                    start = time.perf_counter()
+                if not more:
+                    break
+                out, more = self._step(b'')
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def finish(self):
+        # Returns any remaining plaintext and records the transfer.
+        # Raises ValueError if the compressed stream was cut short.
+        out = b''
+        if hasattr(self._decompressor, 'flush'):
+            try:
+                out = self._decompressor.flush()
+            except CORRUPT_ERRORS as e:
+                raise ValueError(f"Corrupt compressed data ({e})") from None
+            self.raw_bytes += len(out)
+        if not self._decompressor.eof:
+            raise ValueError("Compressed data ended early")
+        if self.stats is not None:
+            self.stats.record(self.direction, self.codec, self.raw_bytes,
+                              self.wire_bytes, self.seconds)
+        return out
+
+def compress_chunks(chunks, codec, direction='download', stats=STATS):
+    # Generator that compresses a stream of plaintext chunks.
+    compressor = Compressor(codec, direction, stats)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    out = compressor.flush()
+    if out:
+        yield out
+
+def decompress_chunks(chunks, codec, direction='download', stats=None):
+    # Generator that decompresses a stream of compressed chunks.
+    decompressor = Decompressor(codec, direction, stats)
+    for chunk in chunks:
+        yield from decompressor.feed(chunk)
+    out = decompressor.finish()
+    if out:
+        yield out
@@ -0,0 +1,206 @@
+# delta.py
+# rsync-style delta transfer. To re-upload a file the server already has a
+# copy of, the client asks for the block signatures of the server's copy,
+# finds those blocks in the new file with a rolling checksum, and sends
+# only block references and the bytes in between (literals). The server
+# rebuilds the new file from its old copy plus the literals.
+#
+#   signature: one record per block of the old file, a weak checksum that
+#              can be rolled one byte at a time (Adler-32) and a strong
+#              hash (BLAKE2b, 16 bytes) to confirm a match
+#   delta:     a stream of instructions, one per DATA frame:
+#                COPY    b'C' + first block index + block count
+#                LITERAL b'L' + raw bytes
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import hashlib
+import math
+import struct
+import zlib
+
+# Blocks are about sqrt(filesize) bytes (as in rsync), rounded up to a
+# whole KiB and kept within these bounds: small blocks find more matches,
+# large ones keep the signature list short.
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 128 * 1024
+
+# Signature records per DATA frame.
+RECORDS_PER_FRAME = 4096
+
+# Literal runs are sent in pieces of at most this size.
+MAX_LITERAL = 1024 * 1024
+
+SIGNATURE_RECORD = struct.Struct('!I16s')   # weak checksum, strong hash
+COPY_INSTRUCTION = struct.Struct('!cII')    # b'C', first block, block count
+OP_COPY = b'C'
+OP_LITERAL = b'L'
+
+# Adler-32 works modulo the largest prime below 2**16.
+_ADLER_MOD = 65521
+
+def block_size_for(filesize):
+    # Block size used for the signature of a file of this size.
+    size = math.isqrt(max(filesize, 0))
+    size = (size + 1023) // 1024 * 1024
+    return min(max(size, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+
+def weak_checksum(block):
+    return zlib.adler32(block)
+
+def strong_hash(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+# ============================================================================
+# SIGNATURES (server side)
+# ============================================================================
+
+def signature_frames(blocks):
+    # Generator that turns the blocks of a file into signature payloads,
+    # RECORDS_PER_FRAME records each.
+    frame = []
+    for block in blocks:
+        frame.append(SIGNATURE_RECORD.pack(weak_checksum(block), strong_hash(block)))
+        if len(frame) == RECORDS_PER_FRAME:
+            yield b''.join(frame)
+            frame = []
+    if frame:
+        yield b''.join(frame)
+
+def parse_signatures(payloads):
+    # Payloads from signature_frames() -> [(weak, strong), ...] by block.
+    records = []
+    for payload in payloads:
+        payload = bytes(payload)
+        if len(payload) % SIGNATURE_RECORD.size:
+            raise ValueError("Truncated signature data")
+        records.extend(SIGNATURE_RECORD.iter_unpack(payload))
+    return records
+
+# ============================================================================
+# DELTA (client side)
+# ============================================================================
+
+class Signature:
+    # The block signatures of the server's copy of a file, indexed for
+    # matching. Only full blocks are looked up while rolling; a short last
+    # block can only match at the very end of the new file.
+
+    def __init__(self, records, filesize, block_size):
+        self.block_size = block_size
+        self.blocks = {}
+        self.tail = None
+        full = filesize // block_size
+        for index, (weak, strong) in enumerate(records):
+            if index < full:
+                self.blocks.setdefault(weak, {}).setdefault(strong, index)
+            else:
+                self.tail = (index, filesize - index * block_size, strong)
+
+class DeltaTooLarge(Exception):
+    # Raised by compute_delta() once more of the new file is literal than
+    # the caller allowed; a plain upload is cheaper then.
+    pass
+
+def compute_delta(data, signature, max_literal=None):
+    # Returns the instructions that turn the old file into 'data' (bytes
+    # or an mmap of the new file): ('copy', first_block, count) and
+    # ('literal', start, end) with offsets into 'data'. Consecutive blocks
+    # are merged into one copy. Raises DeltaTooLarge when the literals
+    # pass 'max_literal' bytes.
+    size = len(data)
+    block_size = signature.block_size
+    blocks = signature.blocks
+    instructions = []
+    literal_bytes = 0
+    literal_start = 0
+    position = 0
+    # Scanning stops early once the literal run in progress would blow the
+    # budget: past this position, plus what's been spent already
+    budget = size if max_literal is None else max_literal
+
+    def add_literal(end):
+        nonlocal literal_bytes
+        if literal_start < end:
+            instructions.append(('literal', literal_start, end))
+            literal_bytes += end - literal_start
+            if literal_bytes > budget:
+                raise DeltaTooLarge(f"more than {budget} bytes differ")
+
+    def add_copy(index):
+        last = instructions[-1] if instructions else None
+        if last is not None and last[0] == 'copy' and last[1] + last[2] == index:
+            instructions[-1] = ('copy', last[1], last[2] + 1)
+        else:
+            instructions.append(('copy', index, 1))
+
+    if blocks and size >= block_size:
+        checksum = weak_checksum(data[0:block_size])
+        a, b = checksum & 0xffff, checksum >> 16
+        last_start = size - block_size
+
+        while True:
+            candidates = blocks.get((b << 16) | a)
+            if candidates is not None:
+                index = candidates.get(strong_hash(data[position:position + block_size]))
+                if index is not None:
+                    add_literal(position)
+                    add_copy(index)
+                    position += block_size
+                    literal_start = position
+                    if position > last_start:
+                        break
+                    checksum = weak_checksum(data[position:position + block_size])
+                    a, b = checksum & 0xffff, checksum >> 16
+                    continue
+
+            if position == last_start:
+                break
+            if position - literal_start + literal_bytes > budget:
+                raise DeltaTooLarge(f"more than {budget} bytes differ")
+
+            # Roll the window one byte: drop data[position], add the next
+            out_byte = data[position]
+            a = (a - out_byte + data[position + block_size]) % _ADLER_MOD
+            b = (b - block_size * out_byte + a - 1) % _ADLER_MOD
+            position += 1
+
+    # The old file's short last block can only match at the end
+    if signature.tail is not None:
+        index, length, strong = signature.tail
+        if size - literal_start >= length and strong_hash(data[size - length:size]) == strong:
+            add_literal(size - length)
+            add_copy(index)
+            return instructions
+
+    add_literal(size)
+    return instructions
+
+def delta_payloads(data, instructions):
+    # Generator of DATA payloads for compute_delta()'s instructions;
+    # literals are cut into pieces of at most MAX_LITERAL bytes.
+    for instruction in instructions:
+        if instruction[0] == 'copy':
+            yield encode_instruction(instruction)
+            continue
+        _, start, end = instruction
+        while start < end:
+            piece = min(end - start, MAX_LITERAL)
+            yield encode_instruction(('literal', data[start:start + piece]))
+            start += piece
+
+def encode_instruction(instruction):
+    # ('copy', first, count) / ('literal', data) -> DATA payload
+    if instruction[0] == 'copy':
+        return COPY_INSTRUCTION.pack(OP_COPY, instruction[1], instruction[2])
+    return OP_LITERAL + bytes(instruction[1])
+
+def decode_instruction(payload):
+    # DATA payload -> ('copy', first, count) or ('literal', data).
+    # Raises ValueError for anything else.
+    op = bytes(payload[:1])
+    if op == OP_COPY and len(payload) == COPY_INSTRUCTION.size:
+        _, first, count = COPY_INSTRUCTION.unpack(payload)
+        return ('copy', first, count)
+    if op == OP_LITERAL:
+        return ('literal', payload[1:])
+    raise ValueError("Invalid delta instruction")
@@ -0,0 +1,98 @@
+# download_cache.py
+# Server-side cache of hot files in wire form (compressed if the download
+# is, then encrypted), so repeated DOWNLOADs of the same file skip the disk
+# read, the compression and caesar_encrypt(). Entries are whole files; the
+# cipher works byte by byte, so any range of an uncompressed payload is
+# exactly what encrypting that range would give.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import os
+import threading
+from collections import OrderedDict
+
+import segments
+
+# No single file may take more than this share of the budget, so one big
+# download can't flush every hot small file.
+MAX_ENTRY_FRACTION = 0.25
+
+def file_version(f):
+    # Identifies the content of an open file from open_user_file(): a
+    # replaced file is a new inode, an in-place change moves the mtime.
+    # A packed file's window of its append-only segment never changes.
+    st = os.fstat(f.fileno())
+    if isinstance(f, segments.SegmentFile):
+        return (st.st_dev, st.st_ino, f.start, f.size)
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+class DownloadCache:
+    # (username, filename, codec) -> wire payload, bounded by a byte
+    # budget and evicted least recently used first. Every entry carries the
+    # file_version() it was read at; a lookup with a different version is
+    # a miss and drops the stale entry.
+
+    def __init__(self, budget=0):
+        self.budget = budget
+        self._entries = OrderedDict()   # key -> (version, payload)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def fits(self, size):
+        # Whether a file of 'size' bytes may be cached at all.
+        return 0 < size <= self.budget * MAX_ENTRY_FRACTION
+
+    def _drop_locked(self, key):
+        version, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def get(self, key, version):
+        # Returns the cached payload for this version of the file, or None.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop_locked(key)
+                self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, version, payload):
+        # Caches a payload, evicting the least recently used entries to
+        # stay within the budget.
+        if not self.fits(len(payload)):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop_locked(key)
+            self._entries[key] = (version, payload)
+            self._bytes += len(payload)
+            while self._bytes > self.budget:
+                self._drop_locked(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        # Forgets a file that was uploaded over or deleted.
+        with self._lock:
+            if key in self._entries:
+                self._drop_locked(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def snapshot(self):
+        # Returns the counters and current size, for STATS.
+        with self._lock:
+            return {'budget': self.budget, 'bytes': self._bytes,
+                    'entries': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'invalidations': self.invalidations}
@@ -0,0 +1,58 @@
+# locking.py
+# File locks that work across threads AND processes, so several server
+# worker processes can share users.txt and server_files/ safely.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Without fcntl (Windows) only one server process is supported, so a plain
+# per-path thread lock is enough there.
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+def _get_thread_lock(path):
+    with _thread_locks_guard:
+        lock = _thread_locks.get(path)
+        if lock is None:
+            lock = _thread_locks[path] = threading.Lock()
+        return lock
+
+@contextmanager
+def file_lock(lock_path, shared=False):
+    # Holds an exclusive (or shared) lock on 'lock_path' for the duration of
+    # the with-block. The lock file is created if needed and never removed.
+    #
+    # flock() locks belong to the open file, and every call opens the file
+    # again, so two threads of the same process block each other exactly
+    # like two processes do.
+    if fcntl is None:
+        with _get_thread_lock(os.path.abspath(lock_path)):
+            yield
+        return
+
+    with open(lock_path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def try_lock_file(f, shared=False):
+    # Takes an exclusive (or shared) lock on an already open file without
+    # waiting. Returns False if another thread or process holds a
+    # conflicting lock. The lock is released when the file is closed.
+    if fcntl is None:
+        # Single-process fallback: nothing else can hold it across processes
+        return True
+    try:
+        fcntl.flock(f.fileno(), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
@@ -0,0 +1,284 @@
+# manifest.py
+# Per-user file manifest: name, size, mtime and SHA-256 of every file in a
+# user's directory, kept up to date by uploads and deletes, so LIST never
+# has to scan or stat the directory.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import base64
+import bisect
+import hashlib
+import json
+import os
+import threading
+
+# The manifest lives inside the user's directory. It is an append-only log
+# of JSON lines:
+#   {"op": "put", "name": ..., "size": ..., "mtime": ..., "sha256": ...}
+#   {"op": "del", "name": ...}
+# Replaying the log gives the current set of files. Appends are cheap; once
+# the log holds many more records than live files it is compacted.
+MANIFEST_NAME = '.fsp-manifest'
+
+# Compact when the log has this many times more records than live entries.
+COMPACT_RATIO = 2
+COMPACT_MIN_RECORDS = 256
+
+SORT_KEYS = ('name', 'size', 'mtime')
+
+def hash_file(path, chunk_size=1024 * 1024, decode=None):
+    # Returns the SHA-256 hex digest of a file's content.
+    # 'decode' turns stored bytes back into plaintext before hashing.
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(decode(chunk) if decode else chunk)
+    return hasher.hexdigest()
+
+def encode_cursor(key, name):
+    # Opaque, '|'-free text form of a pagination position.
+    raw = json.dumps([key, name]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+# Type of the key each sort compares by (bool is an int to isinstance, but
+# never a valid key).
+CURSOR_KEY_TYPES = {'name': str, 'size': int, 'mtime': (int, float)}
+
+def decode_cursor(cursor, sort='name'):
+    # Position from encode_cursor(). Raises ValueError unless it is a
+    # [key, name] pair whose key fits 'sort', so it can only be compared
+    # with that sort's keys.
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, list) or len(position) != 2:
+        raise ValueError("Invalid cursor")
+    key, name = position
+    if (not isinstance(name, str) or isinstance(key, bool)
+            or not isinstance(key, CURSOR_KEY_TYPES[sort])):
+        raise ValueError("Invalid cursor")
+    return key, name
+
+class Manifest:
+    # In-memory view of one user's manifest log.
+    #
+    # Writers (upload commit, delete) must hold the user's directory lock
+    # so records from different worker processes never interleave. Readers
+    # only stat() the log: if it grew we read just the new tail, if it was
+    # replaced (compaction) we reload it.
+
+    def __init__(self, user_dir):
+        self.user_dir = user_dir
+        self.path = os.path.join(user_dir, MANIFEST_NAME)
+        self._entries = {}
+        self._hashes = {}           # sha256 -> number of entries with it
+        self._records = 0
+        self._offset = 0
+        self._inode = None
+        self._sorted = {}
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _count_hash(self, entry, change):
+        sha256 = entry and entry.get('sha256')
+        if sha256:
+            count = self._hashes.get(sha256, 0) + change
+            if count > 0:
+                self._hashes[sha256] = count
+            else:
+                self._hashes.pop(sha256, None)
+
+    def _apply(self, record):
+        name = record.get('name')
+        if record.get('op') == 'put':
+            self._count_hash(self._entries.get(name), -1)
+            self._entries[name] = {
+                'name': name,
+                'size': record['size'],
+                'mtime': record['mtime'],
+                'sha256': record.get('sha256'),
+            }
+            self._count_hash(self._entries[name], 1)
+        elif record.get('op') == 'del':
+            self._count_hash(self._entries.pop(name, None), -1)
+        self._records += 1
+        self._sorted.clear()
+
+    def _refresh_locked(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._inode is not None:
+                self._entries, self._records, self._offset, self._inode = {}, 0, 0, None
+                self._hashes = {}
+                self._sorted.clear()
+            return
+
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            # New or compacted file: start over
+            self._entries, self._records, self._offset = {}, 0, 0
+            self._hashes = {}
+            self._inode = st.st_ino
+            self._sorted.clear()
+
+        if st.st_size == self._offset:
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+
+        # Only apply complete lines; a partial last line is read next time
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                try:
+                    self._apply(json.loads(line))
+                except ValueError:
+                    continue
+        self._offset += end
+
+    def refresh(self):
+        # Picks up records appended by this or any other process.
+        with self._lock:
+            self._refresh_locked()
+
+    # ------------------------------------------------------------------
+    # Writing (caller holds the directory lock)
+    # ------------------------------------------------------------------
+
+    def _append(self, record):
+        with self._lock:
+            self._refresh_locked()
+            with open(self.path, 'ab') as f:
+                f.write(json.dumps(record).encode('utf-8') + b'\n')
+            self._refresh_locked()
+            if (self._records >= COMPACT_MIN_RECORDS
+                    and self._records > COMPACT_RATIO * len(self._entries)):
+                self._compact_locked()
+
+    def record_put(self, name, size, mtime, sha256):
+        self._append({'op': 'put', 'name': name, 'size': size,
+                      'mtime': mtime, 'sha256': sha256})
+
+    def record_delete(self, name):
+        self._append({'op': 'del', 'name': name})
+
+    def _write_all_locked(self, entries):
+        # Rewrites the log with one 'put' per entry and swaps it in.
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            for entry in entries:
+                record = dict(entry, op='put')
+                f.write(json.dumps(record).encode('utf-8') + b'\n')
+        os.replace(temp_path, self.path)
+        self._inode = None
+        self._refresh_locked()
+
+    def _compact_locked(self):
+        self._write_all_locked(list(self._entries.values()))
+
+    def rebuild(self, files, decode=None):
+        # Creates the manifest from scratch for an existing directory.
+        # 'files' is a list of (name, path). Caller holds the directory lock.
+        # 'decode' is passed to hash_file() for files not stored as plaintext.
+        entries = []
+        for name, path in files:
+            try:
+                st = os.stat(path)
+                entries.append({'name': name, 'size': st.st_size,
+                                'mtime': st.st_mtime, 'sha256': hash_file(path, decode=decode)})
+            except OSError:
+                continue
+        with self._lock:
+            self._write_all_locked(entries)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def get(self, name):
+        self.refresh()
+        return self._entries.get(name)
+
+    def has_content(self, sha256):
+        # Whether any file in the manifest has this SHA-256.
+        self.refresh()
+        return sha256 in self._hashes
+
+    def names(self):
+        self.refresh()
+        return list(self._entries)
+
+    def __len__(self):
+        self.refresh()
+        return len(self._entries)
+
+    def _sorted_keys(self, sort):
+        # Returns [(key, name), ...] sorted ascending, cached until the
+        # manifest changes. Caller holds self._lock.
+        keys = self._sorted.get(sort)
+        if keys is None:
+            if sort == 'name':
+                keys = sorted((name, name) for name in self._entries)
+            else:
+                keys = sorted((entry[sort], name) for name, entry in self._entries.items())
+            self._sorted[sort] = keys
+        return keys
+
+    def page(self, sort='name', order='asc', limit=100, cursor=None):
+        # Returns (entries, next_cursor, total) for one page of the listing.
+        # Cursors are positions (sort key + name), not offsets, so pages
+        # stay consistent while files are added or removed.
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"Unknown sort order: {order}")
+
+        with self._lock:
+            self._refresh_locked()
+            keys = self._sorted_keys(sort)
+            total = len(keys)
+
+            if order == 'asc':
+                start = 0
+                if cursor:
+                    start = bisect.bisect_right(keys, decode_cursor(cursor, sort))
+                window = keys[start:start + limit]
+                more = start + limit < total
+            else:
+                end = total
+                if cursor:
+                    end = bisect.bisect_left(keys, decode_cursor(cursor, sort))
+                start = max(0, end - limit)
+                window = keys[start:end][::-1]
+                more = start > 0
+
+            entries = [self._entries[name] for _, name in window]
+
+        next_cursor = encode_cursor(*window[-1]) if window and more else ''
+        return entries, next_cursor, total
+
+# ============================================================================
+# MANIFEST CACHE
+# ============================================================================
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+def get_manifest(user_dir):
+    # Returns the process-wide Manifest object for a user directory.
+    with _manifests_lock:
+        manifest = _manifests.get(user_dir)
+        if manifest is None:
+            manifest = _manifests[user_dir] = Manifest(user_dir)
+        return manifest
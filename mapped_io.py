@@ -0,0 +1,112 @@
+# mapped_io.py
+# Memory-mapped transfer path for large files. Instead of read()/write()
+# through Python file buffers, the file is mapped a window at a time:
+# downloads encrypt straight from the mapped pages, uploads are written
+# into a mapping of a file preallocated to its declared size. Only one
+# window is mapped per transfer, so memory use stays flat however big the
+# file is.
+#
+# Stored files are never changed in place (every writer renames a new
+# file over the old name, and segments are append-only), so a mapping
+# can't lose its pages to a truncate while a download reads it.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import mmap
+import os
+
+# Transfers smaller than this aren't worth the mapping setup.
+MMAP_MIN_SIZE = 8 * 1024 * 1024
+
+# Bytes mapped at a time. A multiple of any page size / Windows allocation
+# granularity.
+WINDOW_SIZE = 8 * 1024 * 1024
+
+# Downloads send DATA frames of this size from the mapping.
+FRAME_SIZE = 1024 * 1024
+
+def map_window(fileno, position, length, writable=False):
+    # Maps the 'length' bytes at 'position' of a file. mmap offsets must be
+    # aligned, so the mapping may start a little earlier.
+    # Returns (mapping, index of 'position' in the mapping).
+    skip = position % mmap.ALLOCATIONGRANULARITY
+    access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+    mapping = mmap.mmap(fileno, length + skip, access=access, offset=position - skip)
+    return mapping, skip
+
+def mapped_chunks(f, offset, length, transform, frame_size=FRAME_SIZE):
+    # Generator yielding transform(block) for 'length' bytes of 'f' from
+    # 'offset', FRAME_SIZE bytes at a time, read from a mapping.
+    # Every block is copied into the same preallocated buffer rather than
+    # sliced into a new bytes object, so 'transform' must return a new
+    # object (bytes.translate() does), never its argument or a view of it.
+    end = offset + length
+    buffer = bytearray(frame_size)
+    while offset < end:
+        window = min(WINDOW_SIZE, end - offset)
+        mapping, skip = map_window(f.fileno(), offset, window)
+        try:
+            with memoryview(mapping) as view:
+                for start in range(skip, skip + window, frame_size):
+                    count = min(frame_size, skip + window - start)
+                    buffer[:count] = view[start:start + count]
+                    yield transform(buffer if count == frame_size else buffer[:count])
+        finally:
+            mapping.close()
+        offset += window
+
+def preallocate(f, size):
+    # Grows an open file to 'size' bytes, reserving the disk blocks where
+    # the OS can, so a full disk shows up now rather than as SIGBUS on a
+    # write into the mapping later.
+    f.flush()
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError:
+            pass  # e.g. the filesystem doesn't support it
+    f.truncate(size)
+
+class MappedWriter:
+    # Sequential writer into an open file through a sliding writable
+    # mapping. The file is preallocated to 'size' bytes first; bytes past
+    # 'size' are dropped (the caller counts them and rejects the upload).
+
+    def __init__(self, f, position, size):
+        self._fileno = f.fileno()
+        self.position = position
+        self.size = size
+        self._mapping = None
+        self._window_start = 0
+        self._window_end = 0
+        preallocate(f, size)
+
+    def _next_window(self):
+        self.close()
+        length = min(WINDOW_SIZE, self.size - self.position)
+        self._mapping, skip = map_window(self._fileno, self.position, length, writable=True)
+        self._window_start = self.position - skip
+        self._window_end = self.position + length
+
+    def write(self, data):
+        # Copies 'data' into the file at the current position.
+        view = memoryview(data)
+        while view and self.position < self.size:
+            if self.position >= self._window_end:
+                self._next_window()
+            count = min(len(view), self._window_end - self.position)
+            start = self.position - self._window_start
+            self._mapping[start:start + count] = view[:count]
+            self.position += count
+            view = view[count:]
+
+    def flush(self):
+        # Writes the dirty pages of the current window to disk.
+        if self._mapping is not None:
+            self._mapping.flush()
+
+    def close(self):
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+            self._window_end = 0
@@ -0,0 +1,240 @@
+# metrics.py
+# Built-in server instrumentation: per-command latency histograms, bytes
+# in and out, errors, active connections, and time spent in the cipher
+# versus on disk. Admins read it with the STATS command; with
+# --metrics-port it is also served in the Prometheus text format on a
+# separate local HTTP port.
+#
+# Everything is a counter bumped under one lock per event (a command, a
+# file chunk), which costs far less than the work being measured, so the
+# metrics can stay on in production.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import bisect
+import contextvars
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import serverlog
+
+_log = serverlog.get_logger('server')
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Command being handled by the current thread (threads engine) or task
+# (asyncio engine), so error replies can be counted against it.
+current_command = contextvars.ContextVar('current_command', default=None)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Histogram:
+    # Counts observations per bucket, plus their sum.
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Estimate: upper bound of the bucket holding the q-th observation
+        # (the largest finite bound for the +Inf bucket).
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+class CommandStats:
+    # Everything recorded about one command name.
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+class ServerMetrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self._commands = {}
+        self.connections_active = 0
+        self.connections_total = 0
+        self.seconds = {'cipher': 0.0, 'disk': 0.0}
+
+    def _command_locked(self, command):
+        stats = self._commands.get(command)
+        if stats is None:
+            stats = self._commands[command] = CommandStats()
+        return stats
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections_active += 1
+            self.connections_total += 1
+
+    def connection_closed(self):
+        with self._lock:
+            self.connections_active -= 1
+
+    def observe_command(self, command, seconds, bytes_in, bytes_out):
+        # One command handled: its latency and the bytes (frames included)
+        # it received and sent.
+        with self._lock:
+            stats = self._command_locked(command)
+            stats.latency.observe(seconds)
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+
+    def reply(self, message):
+        # Called for every reply sent; counts ERROR replies against the
+        # command being handled.
+        if message.startswith("ERROR"):
+            command = current_command.get() or 'NONE'
+            with self._lock:
+                self._command_locked(command).errors += 1
+
+    def add_time(self, kind, seconds):
+        # kind: 'cipher' or 'disk'
+        with self._lock:
+            self.seconds[kind] += seconds
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    def snapshot(self):
+        # Returns a dict of everything, for STATS.
+        with self._lock:
+            commands = {}
+            for command, stats in sorted(self._commands.items()):
+                latency = stats.latency
+                commands[command] = {
+                    'count': latency.count,
+                    'errors': stats.errors,
+                    'bytes_in': stats.bytes_in,
+                    'bytes_out': stats.bytes_out,
+                    'mean_ms': latency.sum / latency.count * 1000 if latency.count else 0.0,
+                    'p50_ms': latency.quantile(0.50) * 1000,
+                    'p95_ms': latency.quantile(0.95) * 1000,
+                    'p99_ms': latency.quantile(0.99) * 1000,
+                }
+            return {
+                'uptime_seconds': time.time() - self.started,
+                'connections': {'active': self.connections_active,
+                                'total': self.connections_total},
+                'seconds': dict(self.seconds),
+                'commands': commands,
+            }
+
+    def render_prometheus(self, extra=()):
+        # Returns the metrics in the Prometheus text exposition format.
+        # 'extra' is a list of (name, type, help, value) for gauges and
+        # counters owned by other modules.
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            commands = sorted(self._commands.items())
+
+            family('fsp_command_duration_seconds', 'histogram',
+                   'Time to handle a command, including its file data.')
+            for command, stats in commands:
+                latency = stats.latency
+                cumulative = 0
+                for bound, count in zip(latency.buckets + ('+Inf',), latency.counts):
+                    cumulative += count
+                    lines.append(f'fsp_command_duration_seconds_bucket'
+                                 f'{{command="{command}",le="{bound}"}} {cumulative}')
+                lines.append(f'fsp_command_duration_seconds_sum{{command="{command}"}} {latency.sum}')
+                lines.append(f'fsp_command_duration_seconds_count{{command="{command}"}} {latency.count}')
+
+            for name, attribute, help_text in (
+                    ('fsp_command_errors_total', 'errors', 'ERROR replies.'),
+                    ('fsp_received_bytes_total', 'bytes_in', 'Bytes received, frames included.'),
+                    ('fsp_sent_bytes_total', 'bytes_out', 'Bytes sent, frames included.')):
+                family(name, 'counter', help_text)
+                for command, stats in commands:
+                    lines.append(f'{name}{{command="{command}"}} {getattr(stats, attribute)}')
+
+            family('fsp_connections_active', 'gauge', 'Open client connections.')
+            lines.append(f'fsp_connections_active {self.connections_active}')
+            family('fsp_connections_total', 'counter', 'Client connections accepted.')
+            lines.append(f'fsp_connections_total {self.connections_total}')
+            family('fsp_cipher_seconds_total', 'counter', 'Time spent in the Caesar cipher on file data.')
+            lines.append(f"fsp_cipher_seconds_total {self.seconds['cipher']}")
+            family('fsp_disk_seconds_total', 'counter', 'Time spent reading and writing file data.')
+            lines.append(f"fsp_disk_seconds_total {self.seconds['disk']}")
+
+        for name, kind, help_text, value in extra:
+            family(name, kind, help_text)
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+METRICS = ServerMetrics()
+
+class Timer:
+    # with Timer('cipher'): ... adds the block's wall time to METRICS.
+
+    __slots__ = ('kind', 'start')
+
+    def __init__(self, kind):
+        self.kind = kind
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        METRICS.add_time(self.kind, time.perf_counter() - self.start)
+
+# ============================================================================
+# PROMETHEUS ENDPOINT
+# ============================================================================
+
+def serve_prometheus(host, port, render):
+    # Serves render() at http://host:port/metrics from a daemon thread.
+    # Returns the HTTP server.
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes every few seconds would flood the log
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    _log.info('METRICS', "Prometheus metrics at http://%s:%s/metrics", host, port)
+    return server
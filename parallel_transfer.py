@@ -0,0 +1,273 @@
+# parallel_transfer.py
+# Moves one large file over several connections at once. The file is split
+# into byte ranges that a few worker threads, each with its own logged-in
+# connection, take from a shared queue:
+#
+#   download: DOWNLOAD|name|offset=N|length=L|sha256=H per range; every
+#             worker writes its ranges into place in '<save_as>.part'
+#   upload:   UPLOAD_RANGE|name|size|offset|length per range; the server
+#             writes them into place and UPLOAD_COMMIT puts the file live
+#
+# Socket reads/writes and file I/O release the GIL, so the connections
+# really do overlap. A range whose connection drops goes back on the queue
+# and the worker reconnects. Each range is compressed on its own when the
+# server supports it (see compression.py).
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import os
+import queue
+import threading
+import time
+
+import compression
+from caesar_cipher import caesar_encrypt, caesar_decrypt
+from protocol import ProtocolError
+from auth_client import (
+    MAX_RETRIES,
+    RETRY_DELAY,
+    connect_to_server,
+    send_encrypted,
+    receive_encrypted,
+    resume_session,
+    upload_codec,
+    upload_by_hash,
+)
+
+DEFAULT_STREAMS = 4
+
+# Files are split into ranges of this size. Smaller ranges balance the
+# work better between connections; larger ones mean fewer round-trips.
+RANGE_SIZE = 8 * 1024 * 1024
+
+# Block size read, encrypted and sent per DATA frame while uploading.
+CHUNK_SIZE = 1024 * 1024
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+def split_ranges(filesize, range_size=RANGE_SIZE, have=()):
+    # Returns [(offset, length), ...] covering the file, minus the
+    # (start, end) ranges in 'have'.
+    ranges = []
+    position = 0
+    for start, end in sorted(have) + [(filesize, filesize)]:
+        while position < start:
+            length = min(range_size, start - position)
+            ranges.append((position, length))
+            position += length
+        position = max(position, end)
+    return ranges
+
+def parse_ranges(text):
+    # "0-100,200-300" -> [(0, 100), (200, 300)]
+    ranges = []
+    for item in text.split(','):
+        if item:
+            start, end = item.split('-')
+            ranges.append((int(start), int(end)))
+    return ranges
+
+def open_stream(conn, login=None):
+    # Opens another connection to conn's server, logged in as the same
+    # user: RESUME with conn's session token, or LOGIN with 'login'
+    # (username, password) if the token isn't known there (with
+    # --processes each server process has its own sessions).
+    stream = connect_to_server(conn.host, conn.port)
+    try:
+        if conn.session_token and resume_session(stream, conn.session_token):
+            return stream
+        if login:
+            send_encrypted(stream, f"LOGIN|{login[0]}|{login[1]}")
+            parts = receive_encrypted(stream).split('|')
+            if parts[0] == "SUCCESS":
+                return stream
+        raise ProtocolError("Could not log in on an extra connection.")
+    except BaseException:
+        stream.close()
+        raise
+
+def run_workers(conn, ranges, streams, transfer_range, login=None):
+    # Moves 'ranges' over up to 'streams' connections by calling
+    # transfer_range(stream, offset, length) in worker threads.
+    # Returns None when every range is done, else an error message.
+    work = queue.Queue()
+    for item in ranges:
+        work.put(item)
+
+    state = {'failures': 0, 'error': None}
+    lock = threading.Lock()
+
+    def worker():
+        stream = None
+        try:
+            while state['error'] is None:
+                try:
+                    offset, length = work.get_nowait()
+                except queue.Empty:
+                    return
+
+                try:
+                    if stream is None:
+                        stream = open_stream(conn, login)
+                    transfer_range(stream, offset, length)
+
+                except (ConnectionError, TimeoutError) as e:
+                    # Put the range back and try again on a new connection
+                    work.put((offset, length))
+                    with lock:
+                        state['failures'] += 1
+                        if state['failures'] > MAX_RETRIES:
+                            state['error'] = f"Too many connection failures ({e})"
+                    if stream is not None:
+                        stream.close()
+                        stream = None
+                    time.sleep(RETRY_DELAY)
+
+                except (ProtocolError, OSError) as e:
+                    state['error'] = str(e)
+
+        finally:
+            if stream is not None:
+                try:
+                    send_encrypted(stream, "EXIT")
+                except OSError:
+                    pass
+                stream.close()
+
+    threads = [threading.Thread(target=worker, name=f"transfer-{i}", daemon=True)
+               for i in range(min(streams, len(ranges)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return state['error']
+
+# ============================================================================
+# PARALLEL DOWNLOAD
+# ============================================================================
+
+def parallel_download(conn, filename, save_as, streams=DEFAULT_STREAMS,
+                      range_size=RANGE_SIZE, login=None, compress=True):
+    # Downloads 'filename' over 'streams' connections into 'save_as'.
+    # 'conn' is a logged-in ServerConnection.
+    # Returns (True, message) or (False, error message).
+    request = f"|compress={conn.codecs[0]}" if compress and conn.codecs else ""
+
+    # Size and hash first (a zero-length range); every range request then
+    # carries the hash so a file replaced mid-way is detected
+    send_encrypted(conn, f"DOWNLOAD|{filename}|offset=0|length=0")
+    parts = receive_encrypted(conn).split('|')
+    if parts[0] != "FILESIZE":
+        return False, parts[1]
+    conn.skip_data()
+    receive_encrypted(conn)
+
+    filesize = int(parts[1])
+    options = dict(p.split('=', 1) for p in parts[2:] if '=' in p)
+    sha256 = options.get('sha256', '')
+
+    part_path = save_as + '.part'
+    with open(part_path, 'wb') as f:
+        f.truncate(filesize)
+
+    def transfer_range(stream, offset, length):
+        send_encrypted(stream, f"DOWNLOAD|{filename}|offset={offset}|length={length}"
+                               f"|sha256={sha256}{request}")
+        reply = receive_encrypted(stream).split('|')
+        if reply[0] != "FILESIZE":
+            raise ProtocolError(reply[1])
+        codec = dict(p.split('=', 1) for p in reply[2:] if '=' in p).get('compress')
+
+        # Each range has its own file object, so positions never clash
+        position = offset
+        with open(part_path, 'r+b') as f:
+            f.seek(offset)
+            data = (caesar_decrypt(chunk) for chunk in stream.iter_data())
+            if codec:
+                data = compression.decompress_chunks(data, codec)
+            try:
+                for chunk in data:
+                    f.write(chunk)
+                    position += len(chunk)
+            except ValueError as e:
+                # Corrupt compressed data; the transfer fails as a whole
+                raise ProtocolError(f"Range {offset}+{length}: {e}")
+
+        reply = receive_encrypted(stream).split('|', 1)
+        if reply[0] != "SUCCESS":
+            raise ProtocolError(reply[1])
+        if position != offset + length:
+            raise ProtocolError(f"Range {offset}+{length} came back short.")
+
+    error = run_workers(conn, split_ranges(filesize, range_size), streams, transfer_range, login)
+    if error is not None:
+        return False, error
+
+    os.replace(part_path, save_as)
+    return True, f"File saved as {save_as}"
+
+# ============================================================================
+# PARALLEL UPLOAD
+# ============================================================================
+
+def read_range(path, offset, length):
+    # Generator that reads 'length' bytes from 'offset'.
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def read_encrypted_range(path, offset, length, codec=None):
+    # Generator that reads 'length' bytes from 'offset' and encrypts them,
+    # compressing them with 'codec' first if given.
+    chunks = read_range(path, offset, length)
+    if codec is not None:
+        chunks = compression.compress_chunks(chunks, codec, 'upload', stats=None)
+    for chunk in chunks:
+        yield caesar_encrypt(chunk)
+
+def parallel_upload(conn, filepath, filename=None, streams=DEFAULT_STREAMS,
+                    range_size=RANGE_SIZE, resume=False, login=None, compress=True):
+    # Uploads a local file over 'streams' connections.
+    # With resume=True, ranges the server kept from an earlier, interrupted
+    # parallel upload of the same file are skipped.
+    # Returns (True, message) or (False, error message).
+    filename = filename or os.path.basename(filepath)
+    filesize = os.path.getsize(filepath)
+    with open(filepath, 'rb') as f:
+        if not resume:
+            stored = upload_by_hash(conn, f, filename, filesize)
+            if stored is not None:
+                return True, stored[1]
+        codec = upload_codec(conn, f) if compress else None
+    request = f"|compress={codec}" if codec else ""
+
+    have = []
+    if resume:
+        send_encrypted(conn, f"UPLOAD_RANGES|{filename}|{filesize}")
+        parts = receive_encrypted(conn).split('|')
+        if parts[0] == "RANGES":
+            have = parse_ranges(parts[1])
+
+    def transfer_range(stream, offset, length):
+        send_encrypted(stream, f"UPLOAD_RANGE|{filename}|{filesize}|{offset}|{length}{request}")
+        stream.send_data(read_encrypted_range(filepath, offset, length, codec))
+        reply = receive_encrypted(stream).split('|', 1)
+        if reply[0] != "SUCCESS":
+            raise ProtocolError(reply[1])
+
+    error = run_workers(conn, split_ranges(filesize, range_size, have), streams,
+                        transfer_range, login)
+    if error is not None:
+        return False, error
+
+    # Every range is on the server: assemble
+    send_encrypted(conn, f"UPLOAD_COMMIT|{filename}|{filesize}")
+    parts = receive_encrypted(conn).split('|', 1)
+    return parts[0] == "SUCCESS", parts[1]
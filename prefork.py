@@ -0,0 +1,95 @@
+# prefork.py
+# Pre-fork supervisor: runs N copies of the server on the same port (each
+# binds with SO_REUSEPORT and the kernel spreads connections between them)
+# and restarts any worker process that dies.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import multiprocessing
+import multiprocessing.connection
+import signal
+import socket
+import time
+
+import serverlog
+
+_log = serverlog.get_logger('server')
+
+# A worker that dies sooner than this after starting is considered to be
+# crash-looping; wait a bit before starting it again.
+MIN_UPTIME = 1.0
+RESTART_DELAY = 1.0
+
+# Index of this worker (0 .. processes-1), set in each worker process; 0
+# when the server runs without the supervisor.
+worker_slot = 0
+
+def reuse_port_supported():
+    return hasattr(socket, 'SO_REUSEPORT')
+
+def _worker_main(target, args, slot=0):
+    # Entry point of each worker process. Ctrl+C is handled by the
+    # supervisor, which stops workers with SIGTERM.
+    global worker_slot
+    worker_slot = slot
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    target(*args)
+
+def run_prefork(processes, target, args=()):
+    # Starts 'processes' workers running target(*args) and keeps them alive.
+    # Returns when the supervisor is interrupted (Ctrl+C).
+    if not reuse_port_supported():
+        raise RuntimeError("SO_REUSEPORT is not available on this platform")
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('fork')
+    else:
+        ctx = multiprocessing.get_context()
+
+    workers = {}
+
+    # Treat SIGTERM like Ctrl+C so workers are never left behind
+    def on_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+    def spawn(slot):
+        process = ctx.Process(target=_worker_main, args=(target, args, slot),
+                              name=f"server-worker-{slot}", daemon=False)
+        process.start()
+        workers[slot] = (process, time.monotonic())
+        _log.info('SUPERVISOR', "Worker %s started (pid %s).", slot, process.pid,
+                  worker=slot, worker_pid=process.pid)
+
+    _log.info('SUPERVISOR', "Starting %s worker processes.", processes)
+    for slot in range(processes):
+        spawn(slot)
+
+    try:
+        while True:
+            sentinels = {process.sentinel: slot for slot, (process, _) in workers.items()}
+            for sentinel in multiprocessing.connection.wait(list(sentinels)):
+                slot = sentinels[sentinel]
+                process, started = workers[slot]
+                process.join()
+                _log.warning('SUPERVISOR', "Worker %s (pid %s) exited with code %s; restarting.",
+                             slot, process.pid, process.exitcode,
+                             worker=slot, worker_pid=process.pid, exitcode=process.exitcode)
+
+                if time.monotonic() - started < MIN_UPTIME:
+                    time.sleep(RESTART_DELAY)
+                spawn(slot)
+
+    except KeyboardInterrupt:
+        _log.info('SUPERVISOR', "Stopping workers...")
+
+    finally:
+        # Don't let a second signal interrupt the cleanup
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for process, _ in workers.values():
+            if process.is_alive():
+                process.terminate()
+        for process, _ in workers.values():
+            process.join()
+        _log.info('SUPERVISOR', "All workers stopped.")
@@ -0,0 +1,285 @@
+# protocol.py
+# Length-prefixed framing shared by auth_server.py and auth_client.py
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+# Every message on the wire is a frame:
+#
+#   +--------+----------------+---------------------+
+#   | type   | length         | payload             |
+#   | 1 byte | 4 bytes (big)  | 'length' bytes      |
+#   +--------+----------------+---------------------+
+#
+# Frame types:
+#   CONTROL - an encrypted command or reply (e.g. "LOGIN|alice|secret")
+#   DATA    - one block of encrypted file content
+#   END     - marks the end of a run of DATA frames (empty payload)
+#
+# Because the receiver always knows how many bytes belong to each message,
+# commands, replies and file data can be sent back-to-back on the same
+# connection without READY/RECEIVED handshakes in between.
+
+import asyncio
+import socket
+import struct
+
+# ============================================================================
+# FRAME FORMAT
+# ============================================================================
+
+HEADER = struct.Struct('!BI')
+
+MSG_CONTROL = 1
+MSG_DATA = 2
+MSG_END = 3
+
+# Largest payload we accept. Protects the receiver from allocating a huge
+# buffer because of a corrupt or malicious header.
+MAX_PAYLOAD = 16 * 1024 * 1024
+
+# Initial size of the reusable receive buffer (grows on demand).
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+# DATA frame size used by send_file(). Each frame costs one small header
+# write, so frames from sendfile() are larger than the 64 KiB read chunks.
+SENDFILE_FRAME_SIZE = 1024 * 1024
+
+# Payloads from this size up are sent with sendmsg() next to their header
+# instead of being joined to it (see FramedSocket.send_frame()).
+GATHER_MIN_PAYLOAD = 64 * 1024
+
+class ProtocolError(Exception):
+    # Raised when the peer sends something that breaks the framing rules.
+    pass
+
+def parse_options(fields):
+    # Turns the optional "key=value" fields at the end of a command
+    # (e.g. LIST|limit=50|sort=size) into a dict.
+    options = {}
+    for field in fields:
+        key, sep, value = field.partition('=')
+        if sep:
+            options[key] = value
+    return options
+
+# ============================================================================
+# FRAMED SOCKET
+# ============================================================================
+
+class FramedSocket:
+    # Wraps a connected TCP socket and sends/receives whole frames.
+    # Frames are read with recv_into() into one reusable buffer, so the
+    # payload returned by recv_frame() is only valid until the next call.
+    # bytes_sent / bytes_received count whole frames, headers included.
+
+    def __init__(self, sock, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.sock = sock
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._header = bytearray(HEADER.size)
+        self._buffer = bytearray(buffer_size)
+
+        # Headers are tiny; don't let Nagle's algorithm hold them back
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
+
+    def close(self):
+        self.sock.close()
+
+    # ------------------------------------------------------------------
+    # Sending
+    # ------------------------------------------------------------------
+
+    def send_frame(self, frame_type, payload=b''):
+        # Sends one frame. Header and payload go out in a single call:
+        # joined for small payloads, with sendmsg() for large ones so the
+        # payload isn't copied just to put 5 bytes in front of it.
+        if len(payload) > MAX_PAYLOAD:
+            raise ProtocolError(f"Payload of {len(payload)} bytes exceeds limit")
+        header = HEADER.pack(frame_type, len(payload))
+        self.bytes_sent += len(header) + len(payload)
+        if len(payload) < GATHER_MIN_PAYLOAD or not hasattr(self.sock, 'sendmsg'):
+            self.sock.sendall(header + payload)
+            return
+        sent = self.sock.sendmsg([header, payload])
+        if sent < len(header):
+            self.sock.sendall(header[sent:])
+            sent = len(header)
+        if sent - len(header) < len(payload):
+            self.sock.sendall(memoryview(payload)[sent - len(header):])
+
+    def send_data(self, chunks):
+        # Sends every chunk as a DATA frame, followed by an END frame.
+        # Returns the number of payload bytes sent.
+        sent = 0
+        for chunk in chunks:
+            if chunk:
+                self.send_frame(MSG_DATA, chunk)
+                sent += len(chunk)
+        self.send_frame(MSG_END)
+        return sent
+
+    def send_file(self, f, count, offset=0, frame_size=SENDFILE_FRAME_SIZE):
+        # Sends 'count' bytes of an open file, as they are, as DATA frames
+        # followed by END. The payload goes from the page cache to the
+        # socket with sendfile() and is never copied into Python.
+        # Returns the number of payload bytes sent.
+        sent = 0
+        while sent < count:
+            size = min(frame_size, count - sent)
+            self.sock.sendall(HEADER.pack(MSG_DATA, size))
+            if self.sock.sendfile(f, offset + sent, size) != size:
+                # The header promised 'size' bytes; the stream can't recover
+                raise ConnectionError("File ended early during transfer")
+            sent += size
+            self.bytes_sent += HEADER.size + size
+        self.send_frame(MSG_END)
+        return sent
+
+    # ------------------------------------------------------------------
+    # Receiving
+    # ------------------------------------------------------------------
+
+    def _recv_exact(self, view):
+        # Fills 'view' completely. Returns False if the peer closed the
+        # connection before sending anything, raises if it closed mid-way.
+        received = 0
+        total = len(view)
+        while received < total:
+            n = self.sock.recv_into(view[received:])
+            if n == 0:
+                if received == 0:
+                    return False
+                raise ConnectionError("Connection closed in the middle of a frame")
+            received += n
+        return True
+
+    def recv_frame(self):
+        # Receives one frame. Returns (frame_type, payload) where payload is
+        # a memoryview into the reusable buffer, or (None, None) if the peer
+        # closed the connection cleanly between frames.
+        if not self._recv_exact(memoryview(self._header)):
+            return None, None
+
+        frame_type, length = HEADER.unpack(self._header)
+        if length > MAX_PAYLOAD:
+            raise ProtocolError(f"Frame of {length} bytes exceeds limit")
+
+        if length > len(self._buffer):
+            self._buffer = bytearray(length)
+
+        payload = memoryview(self._buffer)[:length]
+        if length and not self._recv_exact(payload):
+            raise ConnectionError("Connection closed in the middle of a frame")
+        self.bytes_received += HEADER.size + length
+        return frame_type, payload
+
+    def iter_data(self):
+        # Generator that yields DATA payloads until the END frame arrives.
+        # Each payload must be used before asking for the next one.
+        while True:
+            frame_type, payload = self.recv_frame()
+            if frame_type is None:
+                raise ConnectionError("Connection closed during file transfer")
+            if frame_type == MSG_END:
+                return
+            if frame_type != MSG_DATA:
+                raise ProtocolError(f"Expected file data, got frame type {frame_type}")
+            yield payload
+
+    def skip_data(self):
+        # Reads and discards a run of DATA frames (used when rejecting an
+        # upload, so the connection stays in sync).
+        for _ in self.iter_data():
+            pass
+
+# ============================================================================
+# ASYNCIO STREAMS
+# ============================================================================
+
+class AsyncFramedStream:
+    # The asyncio counterpart of FramedSocket, built on the (reader, writer)
+    # pair from asyncio.start_server. Same frames, same rules.
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (OSError, AttributeError):
+            pass
+
+    # ------------------------------------------------------------------
+    # Sending
+    # ------------------------------------------------------------------
+
+    async def send_frame(self, frame_type, payload=b''):
+        # Queues one frame and waits until the transport has room again.
+        if len(payload) > MAX_PAYLOAD:
+            raise ProtocolError(f"Payload of {len(payload)} bytes exceeds limit")
+        self.writer.write(HEADER.pack(frame_type, len(payload)) + payload)
+        self.bytes_sent += HEADER.size + len(payload)
+        await self.writer.drain()
+
+    async def send_file(self, f, count, offset=0, frame_size=SENDFILE_FRAME_SIZE):
+        # asyncio version of FramedSocket.send_file(); loop.sendfile() uses
+        # os.sendfile() on the transport's socket when it can.
+        loop = asyncio.get_running_loop()
+        sent = 0
+        while sent < count:
+            size = min(frame_size, count - sent)
+            self.writer.write(HEADER.pack(MSG_DATA, size))
+            await self.writer.drain()
+            if await loop.sendfile(self.writer.transport, f, offset + sent, size) != size:
+                raise ConnectionError("File ended early during transfer")
+            sent += size
+            self.bytes_sent += HEADER.size + size
+        await self.send_frame(MSG_END)
+        return sent
+
+    # ------------------------------------------------------------------
+    # Receiving
+    # ------------------------------------------------------------------
+
+    async def recv_frame(self):
+        # Returns (frame_type, payload) or (None, None) on a clean close.
+        try:
+            header = await self.reader.readexactly(HEADER.size)
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None, None
+            raise ConnectionError("Connection closed in the middle of a frame")
+
+        frame_type, length = HEADER.unpack(header)
+        if length > MAX_PAYLOAD:
+            raise ProtocolError(f"Frame of {length} bytes exceeds limit")
+
+        try:
+            payload = await self.reader.readexactly(length) if length else b''
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Connection closed in the middle of a frame")
+        self.bytes_received += HEADER.size + length
+        return frame_type, payload
+
+    async def iter_data(self):
+        # Async generator that yields DATA payloads until the END frame.
+        while True:
+            frame_type, payload = await self.recv_frame()
+            if frame_type is None:
+                raise ConnectionError("Connection closed during file transfer")
+            if frame_type == MSG_END:
+                return
+            if frame_type != MSG_DATA:
+                raise ProtocolError(f"Expected file data, got frame type {frame_type}")
+            yield payload
+
+    async def skip_data(self):
+        # Reads and discards a run of DATA frames.
+        async for _ in self.iter_data():
+            pass
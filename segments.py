@@ -0,0 +1,409 @@
+# segments.py
+# Packed storage for small files. With --pack-threshold, an upload of at
+# most that many bytes is appended to a large shared segment file instead
+# of getting a file of its own, so a tree with millions of small files
+# doesn't need millions of inodes, directory entries and open() calls.
+#
+#   server_files/.fsp-segments/segment-000001.dat   append-only data
+#   server_files/.fsp-segments/index.log            where each file is
+#
+# The index is an append-only log of JSON lines, like the manifest:
+#   {"op": "put", "user": ..., "name": ..., "segment": N, "offset": ...,
+#    "size": ..., "mtime": ..., "sha256": ...}
+#   {"op": "del", "user": ..., "name": ...}
+# Replaying it gives the in-memory index. Segments hold data in the tree's
+# storage mode, exactly like loose files. A deleted or replaced file leaves
+# dead bytes behind; compact() copies the live files out of segments that
+# are mostly dead and removes them.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import argparse
+import json
+import os
+import threading
+import time
+
+from locking import file_lock
+from storage import SEGMENT_DIR, STORAGE_ROOT
+import serverlog
+
+_log = serverlog.get_logger('storage')
+
+INDEX_NAME = 'index.log'
+LOCK_NAME = 'lock'
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.dat'
+
+# A segment takes new files until it is this big, then the next one starts.
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# A full segment is compacted once at least this fraction of it is dead.
+COMPACT_GARBAGE_RATIO = 0.5
+
+# Compact the index log when it has this many times more records than
+# live entries.
+INDEX_COMPACT_RATIO = 2
+INDEX_COMPACT_MIN_RECORDS = 1024
+
+# Seconds between background compaction passes.
+COMPACT_INTERVAL = 60
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def segment_name(number):
+    return f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}"
+
+def segment_number(name):
+    # segment-000042.dat -> 42, anything else -> None
+    if not (name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)):
+        return None
+    digits = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+    return int(digits) if digits.isdigit() else None
+
+def _pread(fd, size, position):
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, position)
+    # Windows: every SegmentFile has its own descriptor
+    os.lseek(fd, position, os.SEEK_SET)
+    return os.read(fd, size)
+
+class SegmentFile:
+    # Read-only file object for one packed file: a window of 'size' bytes
+    # at 'start' in a segment. Reads use pread(), so the position is our
+    # own and nothing else sharing the segment can move it. A segment
+    # removed by compaction stays readable through an open SegmentFile.
+
+    def __init__(self, path, start, size):
+        self.segment = open(path, 'rb', buffering=0)
+        self.start = start
+        self.size = size
+        self._position = 0
+
+    def fileno(self):
+        return self.segment.fileno()
+
+    def read(self, size=-1):
+        remaining = self.size - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b''
+        data = _pread(self.segment.fileno(), size, self.start + self._position)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self.segment.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def sendfile_source(f, offset):
+    # (file, offset) to hand to sendfile() for byte 'offset' of a file
+    # that may be a SegmentFile: the segment itself, at the absolute offset.
+    if isinstance(f, SegmentFile):
+        return f.segment, f.start + offset
+    return f, offset
+
+class SegmentStore:
+    # In-memory view of the index plus the operations on the segments.
+    #
+    # Every change (put, delete, compaction) holds the store's lock file,
+    # so worker processes never interleave records or appends. Readers
+    # only stat() the index log and read the new tail, as with manifests.
+
+    def __init__(self, root=STORAGE_ROOT):
+        self.dir = os.path.join(root, SEGMENT_DIR)
+        self.index_path = os.path.join(self.dir, INDEX_NAME)
+        self.lock_path = os.path.join(self.dir, LOCK_NAME)
+        self._entries = {}   # (user, name) -> entry
+        self._records = 0
+        self._offset = 0
+        self._inode = None
+        self._lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    def segment_path(self, number):
+        return os.path.join(self.dir, segment_name(number))
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def _apply(self, record):
+        key = (record.get('user'), record.get('name'))
+        if record.get('op') == 'put':
+            self._entries[key] = {
+                'segment': record['segment'],
+                'offset': record['offset'],
+                'size': record['size'],
+                'mtime': record['mtime'],
+                'sha256': record.get('sha256'),
+            }
+        elif record.get('op') == 'del':
+            self._entries.pop(key, None)
+        self._records += 1
+
+    def _refresh_locked(self):
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            if self._inode is not None:
+                self._entries, self._records, self._offset, self._inode = {}, 0, 0, None
+            return
+
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            # New or compacted log: start over
+            self._entries, self._records, self._offset = {}, 0, 0
+            self._inode = st.st_ino
+
+        if st.st_size == self._offset:
+            return
+
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(st.st_size - self._offset)
+
+        # Only apply complete lines; a partial last line is read next time
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError):
+                    continue
+        self._offset += end
+
+    def refresh(self):
+        with self._lock:
+            self._refresh_locked()
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def get(self, user, name):
+        # Returns the index entry of a packed file, or None.
+        with self._lock:
+            self._refresh_locked()
+            return self._entries.get((user, name))
+
+    def entries(self, user):
+        # Returns [(name, entry), ...] for every packed file of a user.
+        with self._lock:
+            self._refresh_locked()
+            return [(name, entry) for (owner, name), entry in self._entries.items()
+                    if owner == user]
+
+    def open(self, user, name):
+        # Opens a packed file. Returns a SegmentFile, or None if there's no
+        # such file.
+        for _ in range(3):
+            entry = self.get(user, name)
+            if entry is None:
+                return None
+            try:
+                return SegmentFile(self.segment_path(entry['segment']),
+                                   entry['offset'], entry['size'])
+            except FileNotFoundError:
+                # Compacted away since we read the index; look again
+                continue
+        return None
+
+    # ------------------------------------------------------------------
+    # Writing (each holds the store lock)
+    # ------------------------------------------------------------------
+
+    def _append_record_locked(self, record):
+        with open(self.index_path, 'ab') as f:
+            f.write(json.dumps(record).encode('utf-8') + b'\n')
+        self._refresh_locked()
+
+    def _segment_numbers(self):
+        return sorted(n for n in map(segment_number, os.listdir(self.dir)) if n is not None)
+
+    def _append_data_locked(self, chunks):
+        # Appends the data from 'chunks' to the newest segment (starting a
+        # new one if it's full). Returns (segment, offset, size).
+        numbers = self._segment_numbers()
+        number = numbers[-1] if numbers else 1
+        if numbers and os.path.getsize(self.segment_path(number)) >= SEGMENT_SIZE:
+            number += 1
+        with open(self.segment_path(number), 'ab') as f:
+            offset = f.tell()
+            for chunk in chunks:
+                f.write(chunk)
+            size = f.tell() - offset
+        return number, offset, size
+
+    def _put_locked(self, user, name, chunks, mtime, sha256):
+        number, offset, size = self._append_data_locked(chunks)
+        self._append_record_locked({'op': 'put', 'user': user, 'name': name,
+                                    'segment': number, 'offset': offset, 'size': size,
+                                    'mtime': mtime, 'sha256': sha256})
+
+    def put(self, user, name, data, mtime, sha256):
+        # Stores 'data' (already in storage form) as 'name' of 'user',
+        # replacing any packed file of that name.
+        os.makedirs(self.dir, exist_ok=True)
+        with file_lock(self.lock_path):
+            with self._lock:
+                self._refresh_locked()
+                self._put_locked(user, name, [data], mtime, sha256)
+                self._compact_index_locked()
+
+    def delete(self, user, name):
+        # Forgets a packed file. Returns True if there was one.
+        if not self.exists():
+            return False
+        with file_lock(self.lock_path):
+            with self._lock:
+                self._refresh_locked()
+                if (user, name) not in self._entries:
+                    return False
+                self._append_record_locked({'op': 'del', 'user': user, 'name': name})
+                self._compact_index_locked()
+                return True
+
+    # ------------------------------------------------------------------
+    # Compaction
+    # ------------------------------------------------------------------
+
+    def _compact_index_locked(self):
+        # Rewrites the log with one 'put' per live entry once it's mostly
+        # superseded records.
+        if (self._records < INDEX_COMPACT_MIN_RECORDS
+                or self._records <= INDEX_COMPACT_RATIO * len(self._entries)):
+            return
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            for (user, name), entry in self._entries.items():
+                record = dict(entry, op='put', user=user, name=name)
+                f.write(json.dumps(record).encode('utf-8') + b'\n')
+        os.replace(temp_path, self.index_path)
+        self._inode = None
+        self._refresh_locked()
+
+    def _live_bytes_locked(self):
+        live = {}
+        for entry in self._entries.values():
+            live[entry['segment']] = live.get(entry['segment'], 0) + entry['size']
+        return live
+
+    def _copy_chunks(self, path, offset, size):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while size > 0:
+                chunk = f.read(min(COPY_CHUNK_SIZE, size))
+                if not chunk:
+                    raise OSError(f"{path} ended early")
+                size -= len(chunk)
+                yield chunk
+
+    def compact(self):
+        # Rewrites the live files of every full segment that is at least
+        # COMPACT_GARBAGE_RATIO dead into the newest segment, and removes
+        # the old one. Readers holding it open keep reading it.
+        # Returns (segments removed, bytes reclaimed).
+        if not self.exists():
+            return 0, 0
+        removed = reclaimed = 0
+        with file_lock(self.lock_path):
+            with self._lock:
+                self._refresh_locked()
+                numbers = self._segment_numbers()
+                live = self._live_bytes_locked()
+                for number in numbers[:-1]:
+                    path = self.segment_path(number)
+                    total = os.path.getsize(path)
+                    if total - live.get(number, 0) < COMPACT_GARBAGE_RATIO * total:
+                        continue
+                    moving = [(key, entry) for key, entry in self._entries.items()
+                              if entry['segment'] == number]
+                    for (user, name), entry in moving:
+                        self._put_locked(user, name,
+                                         self._copy_chunks(path, entry['offset'], entry['size']),
+                                         entry['mtime'], entry['sha256'])
+                    os.remove(path)
+                    removed += 1
+                    reclaimed += total - live.get(number, 0)
+                self._compact_index_locked()
+        return removed, reclaimed
+
+    def stats(self):
+        # Returns {'files', 'segments', 'bytes', 'live_bytes'}.
+        with self._lock:
+            self._refresh_locked()
+            live = self._live_bytes_locked()
+            files = len(self._entries)
+        numbers = self._segment_numbers() if os.path.isdir(self.dir) else []
+        total = 0
+        for number in numbers:
+            try:
+                total += os.path.getsize(self.segment_path(number))
+            except FileNotFoundError:
+                pass
+        return {'files': files, 'segments': len(numbers), 'bytes': total,
+                'live_bytes': sum(live.values())}
+
+def start_compactor(store, interval=COMPACT_INTERVAL):
+    # Runs store.compact() every 'interval' seconds in a daemon thread.
+    # With several worker processes each runs one; the lock serialises them.
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                removed, reclaimed = store.compact()
+            except OSError as e:
+                _log.error('SEGMENTS', "Compaction failed: %s", e, error=str(e))
+                continue
+            if removed:
+                _log.info('SEGMENTS', "Compacted %s segments, %s bytes reclaimed.",
+                          removed, reclaimed, segments=removed, reclaimed=reclaimed)
+
+    thread = threading.Thread(target=run, name='segment-compactor', daemon=True)
+    thread.start()
+    return thread
+
+# ============================================================================
+# COMMAND-LINE TOOL
+# ============================================================================
+
+def main():
+    # python segments.py status|compact [--root server_files]
+    parser = argparse.ArgumentParser(description="Packed segment storage tools")
+    parser.add_argument('command', choices=['status', 'compact'],
+                        help="status: show segment usage; compact: reclaim the space "
+                             "of deleted files now")
+    parser.add_argument('--root', default=STORAGE_ROOT)
+    args = parser.parse_args()
+
+    store = SegmentStore(args.root)
+    if args.command == 'compact':
+        removed, reclaimed = store.compact()
+        print(f"[SEGMENTS] Compacted {removed} segments, {reclaimed} bytes reclaimed.")
+
+    stats = store.stats()
+    print(f"[SEGMENTS] {stats['files']} packed files, {stats['live_bytes']} bytes live in "
+          f"{stats['segments']} segments of {stats['bytes']} bytes.")
+
+if __name__ == "__main__":
+    main()
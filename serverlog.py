@@ -0,0 +1,208 @@
+# serverlog.py
+# Server logging. Events are handed to a queue and written to stdout by a
+# background thread, so a slow terminal or log pipe never holds up a
+# request. Each event has a level, a category and a tag (the "[LOGIN]"
+# style prefix the server has always printed), and is written either as
+# that familiar text line or as one JSON object per line.
+#
+# Categories can be sampled (e.g. keep 10% of 'transfer' events); warnings
+# and errors are always kept. Echoing every message's ciphertext and
+# plaintext (category 'wire') is a demo feature and is off unless asked for.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+# Categories used by the server:
+#   connection - clients connecting, disconnecting, being turned away
+#   session    - REGISTER, LOGIN, RESUME, LOGOUT
+#   transfer   - uploads and downloads (DELTA, COMPRESSION included)
+#   files      - LIST and DELETE
+#   storage    - segment compaction, blob store
+#   server     - start-up and shutdown
+#   wire       - every CONTROL message, encrypted and decrypted (demo only)
+CATEGORIES = ('connection', 'session', 'transfer', 'files', 'storage', 'server', 'wire')
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+ROOT_NAME = 'fsp'
+
+# Fraction of events kept per category (1.0 when absent).
+_sample_rates = {}
+
+_listener = None
+_json_output = False
+
+# ============================================================================
+# FORMATTERS
+# ============================================================================
+
+class TextFormatter(logging.Formatter):
+    # "[TAG] message", as the server printed before it had logging.
+
+    def format(self, record):
+        line = f"[{record.tag}] {record.getMessage()}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line: time, level, category, event, message and
+    # the event's fields.
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+                    + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'category': record.category,
+            'event': record.tag,
+            'message': record.getMessage(),
+            'pid': record.process,
+        }
+        entry.update(record.fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # The stdlib QueueHandler formats each record before queueing it (so it
+    # can be pickled); ours stays in this process, so formatting is left to
+    # the writer thread too. Arguments are strings and numbers, which don't
+    # change after the call.
+
+    def prepare(self, record):
+        return record
+
+# ============================================================================
+# EVENT LOGGERS
+# ============================================================================
+
+class EventLogger:
+    # Logger for one category:
+    #   log = get_logger('session')
+    #   log.info('LOGIN', "User '%s' logged in.", username, user=username)
+    # Keyword arguments become fields of the JSON output.
+
+    def __init__(self, category):
+        self.category = category
+        self.logger = logging.getLogger(f"{ROOT_NAME}.{category}")
+
+    def log(self, level, tag, message, *args, exc_info=None, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING:
+            rate = _sample_rates.get(self.category)
+            if rate is not None and random.random() >= rate:
+                return
+        self.logger.log(level, message, *args, exc_info=exc_info,
+                        extra={'tag': tag, 'category': self.category, 'fields': fields})
+
+    def debug(self, tag, message, *args, **fields):
+        self.log(logging.DEBUG, tag, message, *args, **fields)
+
+    def info(self, tag, message, *args, **fields):
+        self.log(logging.INFO, tag, message, *args, **fields)
+
+    def warning(self, tag, message, *args, **fields):
+        self.log(logging.WARNING, tag, message, *args, **fields)
+
+    def error(self, tag, message, *args, **fields):
+        self.log(logging.ERROR, tag, message, *args, **fields)
+
+_loggers = {}
+
+def get_logger(category):
+    logger = _loggers.get(category)
+    if logger is None:
+        logger = _loggers[category] = EventLogger(category)
+    return logger
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+def parse_sample_rates(text):
+    # "transfer=0.1,files=0.5" -> {'transfer': 0.1, 'files': 0.5}
+    rates = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        category, sep, rate = item.partition('=')
+        if not sep or category not in CATEGORIES:
+            raise ValueError(f"Bad sample rate {item!r} (expected CATEGORY=RATE, "
+                             f"CATEGORY one of {', '.join(CATEGORIES)})")
+        rate = float(rate)
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError(f"Sample rate of {category} must be between 0 and 1")
+        rates[category] = rate
+    return rates
+
+def configure(level='INFO', output='text', sample_rates=None, payloads=False, stream=None,
+              background=True):
+    # Sets up logging for this process: events at 'level' and above go
+    # through a queue to a writer thread that writes them to 'stream'
+    # (stdout) as 'text' or 'json'. 'payloads' turns on the 'wire' echo.
+    # background=False writes from the calling thread instead, for the
+    # prefork supervisor, which must not fork while a writer thread runs.
+    # Calling it again replaces the previous setup.
+    global _listener, _json_output
+    shutdown()
+
+    _json_output = output == 'json'
+    _sample_rates.clear()
+    _sample_rates.update(sample_rates or {})
+
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(JsonFormatter() if _json_output else TextFormatter())
+    if background:
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, writer)
+        _listener.start()
+        atexit.register(shutdown)
+        handler = _QueueHandler(log_queue)
+    else:
+        handler = writer
+
+    root = logging.getLogger(ROOT_NAME)
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level.upper()))
+    root.propagate = False
+
+    # The payload echo logs at INFO, but only when asked for
+    wire = logging.getLogger(f"{ROOT_NAME}.wire")
+    wire.setLevel(logging.NOTSET if payloads else logging.CRITICAL + 1)
+
+def shutdown():
+    # Writes out whatever is still queued and stops the writer thread.
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def json_output():
+    return _json_output
+
+def add_arguments(parser):
+    # The logging options of auth_server.py.
+    parser.add_argument('--log-level', default='INFO',
+                        choices=LEVELS, type=str.upper,
+                        help="least severe events logged (default: INFO)")
+    parser.add_argument('--log-format', default='text', choices=('text', 'json'),
+                        help="text lines or one JSON object per line (default: text)")
+    parser.add_argument('--log-sample', default='', type=parse_sample_rates,
+                        metavar='CATEGORY=RATE,...',
+                        help="keep only this fraction of a category's INFO/DEBUG events, "
+                             f"e.g. transfer=0.1 (categories: {', '.join(CATEGORIES)})")
+    parser.add_argument('--log-payloads', action='store_true',
+                        help="echo every message, encrypted and decrypted (demo; slow)")
+
+def configure_from_args(args, background=True):
+    configure(args.log_level, args.log_format, args.log_sample, args.log_payloads,
+              background=background)
@@ -0,0 +1,69 @@
+# sessions.py
+# Session tokens: a client that logged in once can reconnect with
+# RESUME|token instead of sending its password and re-running LOGIN.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# Sessions expire after this many seconds without being used.
+DEFAULT_SESSION_TTL = 60 * 60
+
+# Oldest (least recently used) sessions are dropped beyond this count.
+DEFAULT_MAX_SESSIONS = 100000
+
+class SessionCache:
+    # Token -> username map with a sliding TTL and an LRU size cap.
+    # Every operation is O(1): an OrderedDict keeps tokens in last-used
+    # order, so expiry and eviction only ever look at the oldest entry.
+
+    def __init__(self, ttl=DEFAULT_SESSION_TTL, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire_oldest(self, now):
+        # Drops expired sessions from the old end, plus any over the cap.
+        while self._sessions:
+            token, (username, expires) = next(iter(self._sessions.items()))
+            if expires > now and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[token]
+
+    def create(self, username):
+        # Starts a session for a user who just logged in. Returns the token.
+        token = secrets.token_hex(16)
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[token] = (username, now + self.ttl)
+            self._expire_oldest(now)
+        return token
+
+    def resume(self, token):
+        # Returns the username for a live token (and extends its life),
+        # or None if the token is unknown or expired.
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+
+            username, expires = entry
+            if expires <= now:
+                del self._sessions[token]
+                return None
+
+            self._sessions[token] = (username, now + self.ttl)
+            self._sessions.move_to_end(token)
+            return username
+
+    def revoke(self, token):
+        # Ends a session (LOGOUT).
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,244 @@
+# storage.py
+# How files are kept on disk under server_files/.
+#
+#   plain     - files are stored decrypted (the original behaviour); every
+#               DOWNLOAD reads them into Python and encrypts them again.
+#   encrypted - files are stored exactly as they travel on the wire, so
+#               DOWNLOAD hands them to the kernel with sendfile() and the
+#               data never enters Python.
+#
+# The Caesar cipher keeps every byte's position and the file size, so both
+# modes hold the same number of bytes; only the letters differ.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import argparse
+import itertools
+import os
+import shutil
+
+from caesar_cipher import caesar_encrypt, caesar_decrypt
+
+STORAGE_ROOT = 'server_files'
+STORAGE_MODES = ('plain', 'encrypted')
+
+# Server bookkeeping files start with this prefix and are never user files.
+INTERNAL_PREFIX = '.fsp-'
+
+# Unfinished uploads are kept next to the user's files under these names
+# (see PendingUpload in auth_server.py). They are in the storage mode too.
+PARTIAL_PREFIX = INTERNAL_PREFIX + 'partial-'
+PART_SUFFIX = '.part'
+
+# Marker in the storage root recording the mode its files are in.
+MODE_FILE = INTERNAL_PREFIX + 'storage'
+
+# Content-addressed blobs shared by identical user files (see blobstore.py).
+BLOB_DIR = INTERNAL_PREFIX + 'blobs'
+
+# Segment files small files are packed into (see segments.py).
+SEGMENT_DIR = INTERNAL_PREFIX + 'segments'
+
+# Present only while a migration is running (or was interrupted). First
+# line is the target mode, then one line per file already converted.
+JOURNAL_FILE = INTERNAL_PREFIX + 'storage-migration'
+
+MIGRATE_CHUNK_SIZE = 1024 * 1024
+
+class StorageError(Exception):
+    # Raised when the storage root can't be used in the requested mode.
+    pass
+
+def valid_name(name):
+    # Whether a user or file name from a client can be used as one path
+    # component under the storage root: not empty, no path separators or
+    # '..', and not one of the server's own names (INTERNAL_PREFIX), which
+    # share the namespace (server_files/.fsp-blobs next to user directories,
+    # .fsp-manifest next to user files).
+    return (bool(name) and '/' not in name and '\\' not in name and '\0' not in name
+            and '..' not in name and name != '.' and not name.startswith(INTERNAL_PREFIX))
+
+# ============================================================================
+# STORAGE MODE
+# ============================================================================
+
+def read_storage_mode(root=STORAGE_ROOT):
+    # Returns the mode recorded in the root, or None if there's no marker.
+    try:
+        with open(os.path.join(root, MODE_FILE), 'r') as f:
+            mode = f.read().strip()
+    except FileNotFoundError:
+        return None
+    if mode not in STORAGE_MODES:
+        raise StorageError(f"Unknown storage mode '{mode}' in {root}/{MODE_FILE}")
+    return mode
+
+def write_storage_mode(mode, root=STORAGE_ROOT):
+    os.makedirs(root, exist_ok=True)
+    temp_path = os.path.join(root, MODE_FILE + '.tmp')
+    with open(temp_path, 'w') as f:
+        f.write(mode + '\n')
+    os.replace(temp_path, os.path.join(root, MODE_FILE))
+
+def is_part_file(name):
+    return name.startswith(PARTIAL_PREFIX) and name.endswith(PART_SUFFIX)
+
+def iter_user_files(root=STORAGE_ROOT, include_parts=False):
+    # Yields (relative_path, path) for every user file in the tree, and
+    # for unfinished uploads too if include_parts is set.
+    if not os.path.isdir(root):
+        return
+    for user in sorted(os.listdir(root)):
+        user_dir = os.path.join(root, user)
+        if user.startswith(INTERNAL_PREFIX) or not os.path.isdir(user_dir):
+            continue
+        for name in sorted(os.listdir(user_dir)):
+            path = os.path.join(user_dir, name)
+            stored = not name.startswith(INTERNAL_PREFIX) or (include_parts and is_part_file(name))
+            if stored and os.path.isfile(path):
+                yield f"{user}/{name}", path
+
+def iter_segment_files(root=STORAGE_ROOT):
+    # Yields (relative_path, path) for every segment file (see segments.py).
+    segment_dir = os.path.join(root, SEGMENT_DIR)
+    if not os.path.isdir(segment_dir):
+        return
+    for name in sorted(os.listdir(segment_dir)):
+        path = os.path.join(segment_dir, name)
+        if name.endswith('.dat') and not name.startswith(INTERNAL_PREFIX) and os.path.isfile(path):
+            yield f"{SEGMENT_DIR}/{name}", path
+
+def resolve_storage_mode(requested=None, root=STORAGE_ROOT):
+    # Decides which mode the server runs in and records it in the root.
+    # A tree without a marker is a pre-existing plain tree (or a new one).
+    # Asking for a different mode than the files are in is an error: they
+    # have to be migrated first.
+    if os.path.exists(os.path.join(root, JOURNAL_FILE)):
+        raise StorageError(f"A storage migration of {root} did not finish; "
+                           f"run 'python storage.py migrate' again to complete it")
+
+    current = read_storage_mode(root)
+    if current is None:
+        has_files = next(iter_user_files(root), None) is not None
+        current = 'plain' if has_files or requested is None else requested
+        write_storage_mode(current, root)
+
+    if requested is not None and requested != current:
+        raise StorageError(f"Files in {root} are stored {current}; run "
+                           f"'python storage.py migrate {requested}' first")
+    return current
+
+# ============================================================================
+# MIGRATION TOOL
+# ============================================================================
+
+def _convert_file(path, temp_path, transform):
+    # Writes transform(content) of 'path' to 'temp_path', keeping the
+    # original mtime so the manifest stays accurate.
+    st = os.stat(path)
+    with open(path, 'rb') as src, open(temp_path, 'wb') as dst:
+        while True:
+            chunk = src.read(MIGRATE_CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(transform(chunk))
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.utime(temp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+def migrate(target, root=STORAGE_ROOT):
+    # Converts every file under 'root' to the 'target' mode.
+    # The server must be stopped while this runs. The migration can be
+    # interrupted at any point and resumed by running it again: each file
+    # is converted into a temp file, logged in the journal and only then
+    # renamed over the original, so no file is ever converted twice.
+    # Converted files no longer share a blob (see blobstore.py), and the
+    # blobs are in the old mode, so the blob store is dropped at the end;
+    # 'python blobstore.py dedup' builds it again. Segment files are
+    # converted whole; the cipher keeps every byte in place, so the offsets
+    # in their index stay valid.
+    # Returns the number of files converted.
+    if target not in STORAGE_MODES:
+        raise StorageError(f"Unknown storage mode: {target}")
+
+    journal_path = os.path.join(root, JOURNAL_FILE)
+    done = set()
+
+    if os.path.exists(journal_path):
+        with open(journal_path, 'r') as f:
+            lines = f.read().splitlines()
+        if lines and lines[0] != target:
+            raise StorageError(f"An unfinished migration to '{lines[0]}' must be completed first")
+        done = set(lines[1:])
+    else:
+        current = read_storage_mode(root) or 'plain'
+        if current == target:
+            write_storage_mode(target, root)
+            return 0
+        os.makedirs(root, exist_ok=True)
+        with open(journal_path, 'w') as f:
+            f.write(target + '\n')
+
+    transform = caesar_encrypt if target == 'encrypted' else caesar_decrypt
+    converted = 0
+
+    with open(journal_path, 'a') as journal:
+        files = itertools.chain(iter_user_files(root, include_parts=True),
+                                iter_segment_files(root))
+        for relative_path, path in files:
+            temp_path = os.path.join(os.path.dirname(path),
+                                     INTERNAL_PREFIX + 'migrate-' + os.path.basename(path))
+            if relative_path in done:
+                # Logged but maybe not renamed yet when we were interrupted
+                if os.path.exists(temp_path):
+                    os.replace(temp_path, path)
+                continue
+
+            _convert_file(path, temp_path, transform)
+            journal.write(relative_path + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+            os.replace(temp_path, path)
+            converted += 1
+
+    shutil.rmtree(os.path.join(root, BLOB_DIR), ignore_errors=True)
+    write_storage_mode(target, root)
+    os.remove(journal_path)
+    return converted
+
+def main():
+    # python storage.py migrate encrypted|plain [--root server_files]
+    parser = argparse.ArgumentParser(description="File storage tools")
+    sub = parser.add_subparsers(dest='command')
+    mig = sub.add_parser('migrate', help="convert stored files to another storage mode "
+                                         "(stop the server first)")
+    mig.add_argument('mode', nargs='?', choices=STORAGE_MODES,
+                     help="target mode (default: finish an interrupted migration)")
+    mig.add_argument('--root', default=STORAGE_ROOT)
+    sub.add_parser('status', help="show the current storage mode").add_argument(
+        '--root', default=STORAGE_ROOT)
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        print(f"[STORAGE] {args.root} is stored {read_storage_mode(args.root) or 'plain'}.")
+        return
+
+    if args.command != 'migrate':
+        parser.print_help()
+        return
+
+    mode = args.mode
+    journal_path = os.path.join(args.root, JOURNAL_FILE)
+    if mode is None:
+        if not os.path.exists(journal_path):
+            parser.error("no unfinished migration; give the target mode")
+        with open(journal_path, 'r') as f:
+            mode = f.readline().strip()
+
+    try:
+        count = migrate(mode, args.root)
+    except StorageError as e:
+        raise SystemExit(f"[ERROR] {e}")
+    print(f"[MIGRATED] {count} files in {args.root} converted; storage mode is now {mode}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# support.py
+# Helpers for the tests: a real auth_server.py in a temporary directory,
+# and logged-in client connections to it.
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import auth_client
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class ServerProcess:
+    # auth_server.py started with 'args' in a fresh directory; stopped and
+    # removed by stop().
+
+    def __init__(self, *args):
+        self.directory = tempfile.mkdtemp(prefix='fsp-test-')
+        self.port = free_port()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO, 'auth_server.py'), '--port', str(self.port)]
+            + list(args),
+            cwd=self.directory, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', self.port)).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("Server did not start")
+
+    def path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def login(self, username, password='secret'):
+        # A connection logged in as 'username', registering it first.
+        conn = auth_client.connect_to_server('127.0.0.1', self.port)
+        auth_client.send_encrypted(conn, f"REGISTER|{username}|{password}")
+        auth_client.receive_encrypted(conn)
+        auth_client.send_encrypted(conn, f"LOGIN|{username}|{password}")
+        parts = auth_client.receive_encrypted(conn).split('|')
+        assert parts[0] == "SUCCESS", parts
+        conn.session_token = parts[2]
+        return conn
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def stats(conn):
+    # The STATS reply as a dict (conn must be an admin's).
+    auth_client.send_encrypted(conn, "STATS")
+    parts = auth_client.receive_encrypted(conn).split('|')
+    assert parts[0] == "STATS", parts
+    return dict(part.split('=', 1) for part in parts[1:] if '=' in part)
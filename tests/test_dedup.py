@@ -0,0 +1,61 @@
+# test_dedup.py
+# UPLOAD_HASH (--dedup) must not hand out content to users who only know
+# its hash.
+
+import hashlib
+import os
+import unittest
+
+from support import ServerProcess
+
+import auth_client
+
+CONTENT = b"Quarterly numbers, do not share.\n" * 1000
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+class UploadHashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ServerProcess('--dedup')
+        self.addCleanup(self.server.stop)
+        self.alice = self.server.login('alice')
+        self.addCleanup(self.alice.close)
+        self.source = self.server.path('secret.txt')
+        with open(self.source, 'wb') as f:
+            f.write(CONTENT)
+        ok, message = auth_client.upload(self.alice, self.source)
+        self.assertTrue(ok, message)
+
+    def upload_hash(self, conn, filename):
+        auth_client.send_encrypted(conn, f"UPLOAD_HASH|{filename}|{len(CONTENT)}|{SHA256}")
+        return auth_client.receive_encrypted(conn).split('|', 1)[0]
+
+    def test_other_user_cannot_claim_blob_by_hash(self):
+        bob = self.server.login('bob')
+        self.addCleanup(bob.close)
+        self.assertEqual(self.upload_hash(bob, 'stolen.txt'), "MISSING")
+        self.assertFalse(os.path.exists(self.server.path('server_files', 'bob', 'stolen.txt')))
+
+        target = self.server.path('out.txt')
+        ok, _ = auth_client.download(bob, 'stolen.txt', target)
+        self.assertFalse(ok)
+
+    def test_owner_can_copy_by_hash(self):
+        self.assertEqual(self.upload_hash(self.alice, 'copy.txt'), "SUCCESS")
+        target = self.server.path('out.txt')
+        ok, message = auth_client.download(self.alice, 'copy.txt', target)
+        self.assertTrue(ok, message)
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+
+    def test_full_upload_still_shares_blob(self):
+        bob = self.server.login('bob')
+        self.addCleanup(bob.close)
+        ok, message = auth_client.upload(bob, self.source)
+        self.assertTrue(ok, message)
+        alice_file = self.server.path('server_files', 'alice', 'secret.txt')
+        bob_file = self.server.path('server_files', 'bob', 'secret.txt')
+        self.assertEqual(os.stat(alice_file).st_ino, os.stat(bob_file).st_ino)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# test_manifest.py
+# Paginated listings (LIST with options): cursors that don't fit the sort
+# are rejected, not compared with keys of another type.
+
+import base64
+import json
+import shutil
+import tempfile
+import unittest
+
+from support import ServerProcess
+
+import auth_client
+from manifest import Manifest, encode_cursor
+
+class CursorTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='fsp-test-')
+        self.addCleanup(shutil.rmtree, directory)
+        self.manifest = Manifest(directory)
+        for i, name in enumerate(['a.txt', 'b.txt', 'c.txt']):
+            self.manifest.record_put(name, 100 * (i + 1), 1700000000.5 + i, '')
+
+    def test_cursor_pages_through(self):
+        entries, cursor, total = self.manifest.page(sort='size', limit=2)
+        self.assertEqual([e['name'] for e in entries], ['a.txt', 'b.txt'])
+        entries, cursor, total = self.manifest.page(sort='size', limit=2, cursor=cursor)
+        self.assertEqual([e['name'] for e in entries], ['c.txt'])
+        self.assertEqual(cursor, '')
+
+    def test_cursor_of_other_sort_is_invalid(self):
+        _, name_cursor, _ = self.manifest.page(sort='name', limit=1)
+        _, size_cursor, _ = self.manifest.page(sort='size', limit=1)
+        for sort, cursor in [('size', name_cursor), ('mtime', name_cursor),
+                             ('name', size_cursor)]:
+            for order in ('asc', 'desc'):
+                with self.assertRaises(ValueError):
+                    self.manifest.page(sort=sort, order=order, cursor=cursor)
+
+    def test_malformed_cursors_are_invalid(self):
+        for position in ([True, 'a.txt'], [1, 2], [1, 'a', 'b'], {'k': 1, 'n': 2},
+                         [None, 'a'], 5, 'not json'):
+            raw = json.dumps(position).encode('utf-8') if position != 'not json' else b'{'
+            cursor = base64.urlsafe_b64encode(raw).decode('ascii')
+            with self.assertRaises(ValueError):
+                self.manifest.page(sort='size', cursor=cursor)
+
+class ListCommandTest(unittest.TestCase):
+
+    def test_mismatched_cursor_gets_error_reply(self):
+        server = ServerProcess()
+        self.addCleanup(server.stop)
+        conn = server.login('alice')
+        self.addCleanup(conn.close)
+        source = server.path('a.txt')
+        with open(source, 'wb') as f:
+            f.write(b"x" * 10)
+        self.assertTrue(auth_client.upload(conn, source)[0])
+
+        auth_client.send_encrypted(conn, f"LIST|sort=size|cursor={encode_cursor('a.txt', 'a.txt')}")
+        self.assertTrue(auth_client.receive_encrypted(conn).startswith("ERROR|"))
+        # The connection is still usable
+        entries, _, total = auth_client.list_page(conn)
+        self.assertEqual(total, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+# test_packing.py
+# Small-file packing (--pack-threshold) is off by default: uploads, empty
+# ones included, get files of their own.
+
+import os
+import unittest
+
+from support import ServerProcess
+
+import auth_client
+import segments
+
+class PackingTest(unittest.TestCase):
+
+    def upload_empty(self, *args):
+        server = ServerProcess(*args)
+        self.addCleanup(server.stop)
+        conn = server.login('alice')
+        self.addCleanup(conn.close)
+        source = server.path('empty.txt')
+        open(source, 'wb').close()
+        ok, message = auth_client.upload(conn, source)
+        self.assertTrue(ok, message)
+
+        target = server.path('out.txt')
+        ok, message = auth_client.download(conn, 'empty.txt', target)
+        self.assertTrue(ok, message)
+        self.assertEqual(os.path.getsize(target), 0)
+        return server
+
+    def test_empty_upload_not_packed_by_default(self):
+        server = self.upload_empty()
+        self.assertFalse(os.path.exists(server.path('server_files', segments.SEGMENT_DIR)))
+        self.assertTrue(os.path.isfile(server.path('server_files', 'alice', 'empty.txt')))
+
+    def test_empty_upload_packed_when_packing_is_on(self):
+        server = self.upload_empty('--pack-threshold', '65536')
+        self.assertFalse(os.path.exists(server.path('server_files', 'alice', 'empty.txt')))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# test_reserved_names.py
+# User directories share server_files/ with the server's own directories
+# (.fsp-segments, .fsp-blobs), so usernames that start with the internal
+# prefix or look like paths can't be registered or log in. The same goes
+# for file names inside a user directory.
+
+import unittest
+
+from support import ServerProcess
+
+import auth_client
+
+ENGINES = ['threads', 'asyncio']
+
+class ReservedUsernameTest(unittest.TestCase):
+
+    def request(self, server, message):
+        conn = auth_client.connect_to_server('127.0.0.1', server.port)
+        self.addCleanup(conn.close)
+        auth_client.send_encrypted(conn, message)
+        return auth_client.receive_encrypted(conn)
+
+    def test_segment_store_name_rejected(self):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                server = ServerProcess('--engine', engine, '--pack-threshold', '65536')
+                self.addCleanup(server.stop)
+                conn = server.login('alice')
+                self.addCleanup(conn.close)
+                source = server.path('small.txt')
+                with open(source, 'wb') as f:
+                    f.write(b'packed')
+                ok, message = auth_client.upload(conn, source)
+                self.assertTrue(ok, message)
+
+                reply = self.request(server, "REGISTER|.fsp-segments|secret")
+                self.assertTrue(reply.startswith("ERROR|"), reply)
+                reply = self.request(server, "LOGIN|.fsp-segments|secret")
+                self.assertFalse(reply.startswith("SUCCESS|"), reply)
+
+    def test_blob_store_name_rejected(self):
+        server = ServerProcess('--dedup')
+        self.addCleanup(server.stop)
+        conn = server.login('alice')
+        self.addCleanup(conn.close)
+        source = server.path('shared.txt')
+        with open(source, 'wb') as f:
+            f.write(b'deduplicated')
+        ok, message = auth_client.upload(conn, source)
+        self.assertTrue(ok, message)
+
+        reply = self.request(server, "REGISTER|.fsp-blobs|secret")
+        self.assertTrue(reply.startswith("ERROR|"), reply)
+        # An account registered before names were checked can't log in.
+        with open(server.path('users.txt'), 'a') as f:
+            f.write(".fsp-blobs|secret\n")
+        reply = self.request(server, "LOGIN|.fsp-blobs|secret")
+        self.assertFalse(reply.startswith("SUCCESS|"), reply)
+
+    def test_path_like_names_rejected(self):
+        server = ServerProcess()
+        self.addCleanup(server.stop)
+        for username in ['..', 'a/b', '../alice', 'a\\b', '.']:
+            with self.subTest(username=username):
+                reply = self.request(server, f"REGISTER|{username}|secret")
+                self.assertTrue(reply.startswith("ERROR|"), reply)
+
+class ReservedFilenameTest(unittest.TestCase):
+    # The server's own files in a user directory (.fsp-manifest, .fsp-lock,
+    # .fsp-partial-*) can't be uploaded, downloaded or deleted.
+
+    def command(self, conn, message):
+        auth_client.send_encrypted(conn, message)
+        return auth_client.receive_encrypted(conn)
+
+    def test_internal_files_unreachable(self):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                server = ServerProcess('--engine', engine)
+                self.addCleanup(server.stop)
+                conn = server.login('alice')
+                self.addCleanup(conn.close)
+                source = server.path('secret.txt')
+                with open(source, 'wb') as f:
+                    f.write(b'keep me')
+                ok, message = auth_client.upload(conn, source)
+                self.assertTrue(ok, message)
+
+                ok, message = auth_client.upload(conn, source, '.fsp-manifest')
+                self.assertFalse(ok, message)
+                ok, message = auth_client.upload(conn, source, '../bob.txt')
+                self.assertFalse(ok, message)
+                reply = self.command(conn, "DELETE|.fsp-lock")
+                self.assertTrue(reply.startswith("ERROR|"), reply)
+                reply = self.command(conn, "DOWNLOAD|.fsp-manifest")
+                self.assertTrue(reply.startswith("ERROR|"), reply)
+
+                entries, _, _ = auth_client.list_page(conn)
+                self.assertEqual([entry['name'] for entry in entries], ['secret.txt'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+# test_retries.py
+# auth_client.with_retries(): a transfer only runs again on a connection
+# that was re-opened, and running out of retries is a ConnectionError.
+
+import unittest
+from unittest import mock
+
+import support  # noqa: F401  (puts the repository on sys.path)
+import auth_client
+
+class FlakyConnection:
+    # Stand-in for ServerConnection whose reconnect() fails 'failures'
+    # times before it works.
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.connected = False
+        self.reconnects = 0
+
+    def reconnect(self):
+        self.reconnects += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionRefusedError("refused")
+        self.connected = True
+
+class WithRetriesTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(auth_client, 'RETRY_DELAY', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def transfer(self, conn, calls):
+        # Fails on the first call; afterwards needs a re-opened connection.
+        def attempt(resume):
+            calls.append(resume)
+            if len(calls) == 1:
+                raise ConnectionResetError("reset")
+            if not conn.connected:
+                raise OSError(9, "Bad file descriptor")
+            return "done"
+        return attempt
+
+    def test_transfer_waits_for_a_working_reconnect(self):
+        conn, calls = FlakyConnection(failures=2), []
+        result = auth_client.with_retries(conn, self.transfer(conn, calls), retries=5)
+        self.assertEqual(result, "done")
+        self.assertEqual(calls, [False, True])
+        self.assertEqual(conn.reconnects, 3)
+
+    def test_failed_reconnects_raise_connection_error(self):
+        conn, calls = FlakyConnection(failures=100), []
+        with self.assertRaises(ConnectionError):
+            auth_client.with_retries(conn, self.transfer(conn, calls), retries=3)
+        self.assertEqual(calls, [False])
+        self.assertEqual(conn.reconnects, 3)
+
+    def test_failing_transfer_raises_its_error(self):
+        conn, calls = FlakyConnection(failures=0), []
+
+        def attempt(resume):
+            calls.append(resume)
+            raise TimeoutError("slow")
+        with self.assertRaises(TimeoutError):
+            auth_client.with_retries(conn, attempt, retries=2)
+        self.assertEqual(calls, [False, True, True])
+
+if __name__ == "__main__":
+    unittest.main()
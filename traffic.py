@@ -0,0 +1,543 @@
+# traffic.py
+# Traffic capture and replay. With --trace FILE the server appends one JSON
+# line per command it handles: when it started, which connection sent it,
+# the command with passwords and tokens removed, the user, the first word
+# of the reply, how long it took and the bytes it moved. The replay tool
+# drives a fresh server with the same connections, command mix and pacing,
+# either at recorded speed or as fast as possible, and reports throughput
+# and latency percentiles next to the recorded ones. Replaying one trace
+# against two builds compares them on a real traffic shape.
+#
+# Usage:
+#   python auth_server.py --trace trace.jsonl
+#   python traffic.py summary trace.jsonl
+#   python traffic.py replay trace.jsonl                  # recorded pacing
+#   python traffic.py replay trace.jsonl --speed 0        # as fast as possible
+#   python traffic.py replay trace.jsonl --json --server-args --storage encrypted
+#
+# Commands on different connections keep their recorded order where it
+# matters: one starts only after everything that had finished before it in
+# the recording has finished in the replay, so a download still follows
+# the upload it depends on however fast the replay runs.
+#
+# File content isn't recorded, only sizes: uploads send random data of the
+# recorded size, and transfers are replayed uncompressed. The recorded
+# MB/s counts the bytes on the wire, so for a trace with compressed
+# transfers it isn't comparable to the replay's; the report says so. Users
+# and files the trace uses without creating them (they existed before the
+# capture) are created before the replay starts. Delta uploads can't be
+# rebuilt without the original files and are skipped (counted in the
+# report).
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import argparse
+import bisect
+import itertools
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from caesar_cipher import caesar_encrypt, caesar_decrypt
+from protocol import FramedSocket, MSG_CONTROL, ProtocolError, parse_options
+
+# Commands whose fields are secrets: field index -> placeholder.
+REDACTED_FIELDS = {'REGISTER': {2: '*'}, 'LOGIN': {2: '*'}, 'RESUME': {1: '*'}}
+
+# Password of every user the replay registers.
+REPLAY_PASSWORD = 'replay'
+
+# Size of files the trace deletes without ever having downloaded them, so
+# their real size is unknown.
+DEFAULT_SEED_SIZE = 4096
+
+# Generated upload data is sent in frames of this size.
+DATA_FRAME_SIZE = 64 * 1024
+
+# ============================================================================
+# CAPTURE
+# ============================================================================
+
+def redact(message):
+    # The command with its password or session token replaced by '*'.
+    fields = REDACTED_FIELDS.get(message.split('|', 1)[0])
+    if not fields:
+        return message
+    parts = message.split('|')
+    for index, placeholder in fields.items():
+        if index < len(parts):
+            parts[index] = placeholder
+    return '|'.join(parts)
+
+class TraceWriter:
+    # Appends trace records to a JSONL file. Each record is one write() to
+    # a file opened for appending, so worker processes (--processes) can
+    # share the file.
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a', buffering=1, encoding='utf-8')
+        self._lock = threading.Lock()
+        self._connections = itertools.count(1)
+
+    def new_connection(self):
+        # A connection id unique across worker processes.
+        return f"{os.getpid()}-{next(self._connections)}"
+
+    def record(self, connection, started, command, message, user, status,
+               seconds, bytes_in, bytes_out):
+        line = json.dumps({
+            'ts': round(started, 6),
+            'conn': connection,
+            'cmd': command,
+            'request': redact(message),
+            'user': user,
+            'status': status,
+            'seconds': round(seconds, 6),
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+        }, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def load_trace(path):
+    # Returns the records of a trace, oldest first.
+    with open(path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+# ============================================================================
+# REPORTS
+# ============================================================================
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list.
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(len(sorted_values) * fraction))
+    return sorted_values[min(len(sorted_values), rank) - 1]
+
+def latency_table(samples):
+    # samples: (command, seconds, error) tuples ->
+    # {command: {count, errors, mean_ms, p50_ms, p95_ms, p99_ms}}
+    by_command = {}
+    for command, seconds, error in samples:
+        entry = by_command.setdefault(command, ([], [0]))
+        entry[0].append(seconds)
+        entry[1][0] += bool(error)
+    table = {}
+    for command, (values, errors) in sorted(by_command.items()):
+        values.sort()
+        table[command] = {
+            'count': len(values),
+            'errors': errors[0],
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        }
+    return table
+
+def summarize(records):
+    # What the trace itself says: duration, throughput, concurrency and
+    # latency per command as the server measured it.
+    if not records:
+        return {'commands': 0}
+    start = records[0]['ts']
+    end = max(record['ts'] + record['seconds'] for record in records)
+    seconds = max(end - start, 1e-9)
+    moved = sum(record['bytes_in'] + record['bytes_out'] for record in records)
+    return {
+        'connections': len({record['conn'] for record in records}),
+        'peak_connections': peak_concurrency(records),
+        'commands': len(records),
+        'seconds': round(seconds, 3),
+        'commands_per_second': round(len(records) / seconds, 1),
+        'mb_per_second': round(moved / seconds / (1024 * 1024), 3),
+        'compressed_transfers': sum(map(compressed, records)),
+        'latency': latency_table((record['cmd'], record['seconds'],
+                                  record['status'] == 'ERROR') for record in records),
+    }
+
+def compressed(record):
+    # Whether a recorded transfer went compressed: its bytes_in/bytes_out
+    # count compressed data.
+    parts = record['request'].split('|')
+    return parts[0] != 'HELLO' and bool(parse_options(parts[1:]).get('compress'))
+
+def peak_concurrency(records):
+    # Most connections with commands in flight or between commands at once.
+    spans = {}
+    for record in records:
+        first, last = spans.get(record['conn'], (record['ts'], record['ts']))
+        spans[record['conn']] = (min(first, record['ts']),
+                                 max(last, record['ts'] + record['seconds']))
+    events = sorted([(first, 1) for first, _ in spans.values()] +
+                    [(last, -1) for _, last in spans.values()])
+    peak = current = 0
+    for _, change in events:
+        current += change
+        peak = max(peak, current)
+    return peak
+
+def print_report(report):
+    replay, recorded = report['replay'], report['recorded']
+    print("=" * 78)
+    print(f"Replayed {replay['commands']} commands on {replay['connections']} connections "
+          f"in {replay['seconds']}s (speed {report['speed'] or 'max'})")
+    print(f"  {replay['commands_per_second']} commands/s, {replay['mb_per_second']} MB/s "
+          f"(recorded: {recorded['commands_per_second']} commands/s, "
+          f"{recorded['mb_per_second']} MB/s)")
+    if recorded['compressed_transfers']:
+        print(f"  {recorded['compressed_transfers']} recorded transfers were compressed: "
+              f"the recorded MB/s counts their\n  compressed bytes, the replay sends them "
+              f"uncompressed")
+    if replay['skipped'] or replay['failed_connections']:
+        print(f"  {replay['skipped']} commands skipped, "
+              f"{replay['failed_connections']} connections failed")
+    print("=" * 78)
+    print(f"{'command':<17} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'rec p95':>9}")
+    for command, stats in replay['latency'].items():
+        before = recorded['latency'].get(command, {})
+        print(f"{command:<17} {stats['count']:>6} {stats['errors']:>6} {stats['p50_ms']:>9} "
+              f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {before.get('p95_ms', '-'):>9}")
+    print("=" * 78)
+    print("Replay latencies are measured by the client; recorded ones by the server.")
+
+# ============================================================================
+# REPLAY
+# ============================================================================
+
+_random_data = None
+
+def _random_block():
+    # DATA_FRAME_SIZE random bytes, the same for the whole replay.
+    global _random_data
+    if _random_data is None:
+        _random_data = os.urandom(DATA_FRAME_SIZE)
+    return _random_data
+
+class ReplayClient:
+    # One replayed connection: sends recorded commands the way a client
+    # would, including their file data, and waits for the full reply.
+
+    def __init__(self, address, tokens):
+        self.conn = FramedSocket(socket.create_connection(address))
+        self.tokens = tokens   # {user: session token}, shared by all connections
+
+    def close(self):
+        self.conn.close()
+
+    def send(self, message):
+        self.conn.send_frame(MSG_CONTROL, caesar_encrypt(message).encode('utf-8'))
+
+    def receive(self):
+        frame_type, payload = self.conn.recv_frame()
+        if frame_type is None:
+            raise ConnectionError("Server closed the connection")
+        if frame_type != MSG_CONTROL:
+            raise ProtocolError(f"Expected a reply, got frame type {frame_type}")
+        return caesar_decrypt(bytes(payload).decode('utf-8'))
+
+    def send_generated(self, label, count):
+        # Sends 'count' bytes of random data as DATA frames and END. Every
+        # frame starts with 'label', so files don't all have the same
+        # content (which --dedup would notice).
+        block = (label + ' ').encode('utf-8') + _random_block()
+        self.conn.send_data(self._frames(caesar_encrypt(block[:DATA_FRAME_SIZE]), count))
+
+    @staticmethod
+    def _frames(block, count):
+        while count > 0:
+            size = min(len(block), count)
+            yield block[:size]
+            count -= size
+
+    def run(self, record):
+        # Replays one record. Returns the first word of the reply, or None
+        # if the command was skipped.
+        command = record['cmd']
+        parts = record['request'].split('|')
+
+        if command in ('REGISTER', 'LOGIN'):
+            parts[2] = REPLAY_PASSWORD
+        elif command == 'RESUME':
+            token = self.tokens.get(record['user'])
+            if token is None:
+                # The session was created before the capture; log in instead
+                parts = ['LOGIN', record['user'], REPLAY_PASSWORD]
+            else:
+                parts[1] = token
+        elif command == 'UPLOAD_DELTA' or command == 'UNKNOWN':
+            return None
+
+        if command in ('UPLOAD', 'UPLOAD_RANGE', 'DOWNLOAD'):
+            # Generated data is random, so transfers go uncompressed; the
+            # recorded hash was of the original file
+            parts = [part for part in parts
+                     if not part.startswith(('compress=', 'sha256='))]
+
+        self.send('|'.join(parts))
+        if command == 'UPLOAD':
+            offset = int(parse_options(parts[3:]).get('offset', 0))
+            self.send_generated(record['request'], int(parts[2]) - offset)
+        elif command == 'UPLOAD_RANGE':
+            self.send_generated(record['request'], int(parts[4]))
+
+        reply = self.receive().split('|')
+        status = reply[0]
+        if status == 'FILESIZE':
+            # DOWNLOAD: data, END, then SUCCESS or ERROR
+            self.conn.skip_data()
+            status = self.receive().split('|', 1)[0]
+        elif status == 'SIGNATURES':
+            self.conn.skip_data()
+        elif status == 'SUCCESS' and parts[0] == 'LOGIN' and len(reply) > 2:
+            self.tokens[parts[1]] = reply[2]
+        return status
+
+def seed_server(address, records, size_hints):
+    # Creates the users and files the trace uses without creating them.
+    # Returns the number of files created.
+    registered, stored = set(), set()
+    needed_users, needed_files = [], {}
+    for record in records:
+        command, parts = record['cmd'], record['request'].split('|')
+        user = record['user']
+        if command == 'REGISTER' and len(parts) > 1:
+            if record['status'] == 'SUCCESS':
+                registered.add(parts[1])
+            continue
+        if command == 'LOGIN' and len(parts) > 1:
+            user = parts[1]
+        if user and user not in registered:
+            registered.add(user)
+            needed_users.append(user)
+        if not user or len(parts) < 2:
+            continue
+        key = (user, parts[1])
+        if command in ('UPLOAD', 'UPLOAD_HASH', 'UPLOAD_COMMIT', 'UPLOAD_DELTA'):
+            stored.add(key)
+        elif command in ('DOWNLOAD', 'DELETE', 'DELTA_SIGNATURES') and key not in stored:
+            stored.add(key)
+            if record['status'] != 'ERROR':
+                needed_files[key] = size_hints.get(key, DEFAULT_SEED_SIZE)
+
+    tokens = {}
+    client = ReplayClient(address, tokens)
+    try:
+        for user in needed_users:
+            client.send(f"REGISTER|{user}|{REPLAY_PASSWORD}")
+            client.receive()
+        for (user, filename), size in needed_files.items():
+            client.send(f"LOGIN|{user}|{REPLAY_PASSWORD}")
+            client.receive()
+            client.send(f"UPLOAD|{filename}|{size}")
+            client.send_generated(f"seed {user} {filename}", size)
+            client.receive()
+        client.send("EXIT")
+        client.receive()
+    finally:
+        client.close()
+    return len(needed_files)
+
+def download_sizes(records):
+    # Best guess at the size of each (user, file) the trace downloads:
+    # the bytes the DOWNLOAD sent, less the frame overhead.
+    sizes = {}
+    for record in records:
+        parts = record['request'].split('|')
+        if record['cmd'] == 'DOWNLOAD' and record['user'] and len(parts) > 1:
+            sizes.setdefault((record['user'], parts[1]), max(0, record['bytes_out'] - 256))
+    return sizes
+
+class ReplayOrder:
+    # Keeps the recorded order between connections: a command starts only
+    # once every command that had finished before it started in the
+    # recording has finished in the replay too (e.g. a download waits for
+    # the upload another connection made). Commands are numbered by their
+    # position in 'records'.
+
+    def __init__(self, records):
+        ends = sorted(range(len(records)),
+                      key=lambda i: records[i]['ts'] + records[i]['seconds'])
+        end_times = [records[i]['ts'] + records[i]['seconds'] for i in ends]
+        self._rank = {index: rank for rank, index in enumerate(ends)}
+        # Commands that must be done first: the first 'needed' in end order
+        self._needed = [bisect.bisect_left(end_times, record['ts']) for record in records]
+        self._done = [False] * len(records)
+        self._finished = 0   # length of the done prefix, in end order
+        self._condition = threading.Condition()
+
+    def wait(self, index):
+        with self._condition:
+            self._condition.wait_for(lambda: self._finished >= self._needed[index])
+
+    def done(self, index):
+        with self._condition:
+            self._done[self._rank[index]] = True
+            while self._finished < len(self._done) and self._done[self._finished]:
+                self._finished += 1
+            self._condition.notify_all()
+
+def replay(address, records, speed=1.0):
+    # Replays 'records' against the server at 'address'. speed=1 keeps the
+    # recorded pacing, 2 halves every gap, 0 sends each command as soon as
+    # the commands it came after (see ReplayOrder) are done.
+    # Returns the 'replay' part of the report.
+    connections = {}
+    for index, record in enumerate(records):
+        connections.setdefault(record['conn'], []).append(index)
+
+    samples, skipped, failed = [], [0], [0]
+    bytes_moved = [0]
+    lock = threading.Lock()
+    tokens = {}
+    order = ReplayOrder(records)
+    origin = records[0]['ts']
+    start = time.perf_counter()
+
+    def wait_for(index):
+        if speed:
+            delay = (records[index]['ts'] - origin) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        order.wait(index)
+
+    def run_connection(indexes):
+        client = None
+        pending = list(indexes)
+        try:
+            while pending:
+                index = pending[0]
+                record = records[index]
+                wait_for(index)
+                if client is None:
+                    client = ReplayClient(address, tokens)
+                began = time.perf_counter()
+                status = client.run(record)
+                seconds = time.perf_counter() - began
+                with lock:
+                    if status is None:
+                        skipped[0] += 1
+                    else:
+                        samples.append((record['cmd'], seconds, status == 'ERROR'))
+                order.done(pending.pop(0))
+        except (OSError, ProtocolError) as e:
+            with lock:
+                failed[0] += 1
+            print(f"[REPLAY] Connection {records[indexes[0]]['conn']} failed: {e}")
+        finally:
+            # Commands this connection can't run any more don't hold up others
+            for index in pending:
+                order.done(index)
+            if client is not None:
+                with lock:
+                    bytes_moved[0] += client.conn.bytes_sent + client.conn.bytes_received
+                client.close()
+
+    threads = [threading.Thread(target=run_connection, args=(indexes,), daemon=True)
+               for indexes in connections.values()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = max(time.perf_counter() - start, 1e-9)
+
+    return {
+        'connections': len(connections),
+        'commands': len(samples),
+        'skipped': skipped[0],
+        'failed_connections': failed[0],
+        'seconds': round(seconds, 3),
+        'commands_per_second': round(len(samples) / seconds, 1),
+        'mb_per_second': round(bytes_moved[0] / seconds / (1024 * 1024), 3),
+        'latency': latency_table(samples),
+    }
+
+def start_server(server, directory, port, server_args):
+    # Starts a fresh server in 'directory' and waits until it accepts.
+    process = subprocess.Popen(
+        [sys.executable, server, '--port', str(port)] + server_args,
+        cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Server did not start")
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Traffic trace tools")
+    sub = parser.add_subparsers(dest='action', required=True)
+
+    summary = sub.add_parser('summary', help="throughput and latency recorded in a trace")
+    summary.add_argument('trace')
+
+    run = sub.add_parser('replay', help="replay a trace against a fresh server")
+    run.add_argument('trace')
+    run.add_argument('--speed', type=float, default=1.0,
+                     help="1 = recorded pacing (default), 2 = twice as fast, 0 = as fast as possible")
+    run.add_argument('--server', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                      'auth_server.py'),
+                     help="auth_server.py to start (default: this checkout's)")
+    run.add_argument('--port', type=int, default=5620)
+    run.add_argument('--connect', metavar='HOST:PORT',
+                     help="replay against a running server instead of starting one")
+    run.add_argument('--json', action='store_true', help="print the report as JSON")
+    run.add_argument('--server-args', nargs=argparse.REMAINDER, default=[],
+                     help="extra arguments for auth_server.py (must come last)")
+    args = parser.parse_args()
+
+    records = load_trace(args.trace)
+    if args.action == 'summary':
+        print(json.dumps(summarize(records), indent=2))
+        return
+    if not records:
+        sys.exit(f"[ERROR] {args.trace} has no commands.")
+
+    directory = process = None
+    if args.connect:
+        host, _, port = args.connect.rpartition(':')
+        address = (host or '127.0.0.1', int(port))
+    else:
+        directory = tempfile.mkdtemp(prefix='fsp-replay-')
+        process = start_server(args.server, directory, args.port, args.server_args)
+        address = ('127.0.0.1', args.port)
+
+    try:
+        seeded = seed_server(address, records, download_sizes(records))
+        report = {'trace': args.trace, 'speed': args.speed, 'seeded_files': seeded,
+                  'replay': replay(address, records, args.speed),
+                  'recorded': summarize(records)}
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
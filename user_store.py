@@ -0,0 +1,219 @@
+# user_store.py
+# User database for the file sharing server.
+# GitHub account project location: https://github.com/CLochstampfor60/file_system_project
+
+import argparse
+import os
+import sqlite3
+import threading
+
+from locking import file_lock
+
+USERS_FILE = 'users.txt'
+USERS_DB = 'users.db'
+
+# Every backend provides the same methods:
+#   register(username, password) -> True, or False if the name is taken
+#   authenticate(username, password) -> True/False
+#   get_password(username) -> stored password or None
+#   len(store) -> number of users
+
+# ============================================================================
+# USERS.TXT FORMAT
+# ============================================================================
+
+def load_users(path=USERS_FILE):
+    # Loads users from users.txt file.
+    users = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line and '|' in line:
+                    username, password = line.split('|', 1)
+                    users[username] = password
+    return users
+
+def save_user(username, password, path=USERS_FILE):
+    # Saves a new user to users.txt file.
+    with open(path, 'a') as f:
+        f.write(f"{username}|{password}\n")
+
+# ============================================================================
+# IN-MEMORY USER INDEX
+# ============================================================================
+
+class UserIndex:
+    # Keeps users.txt parsed in memory so LOGIN and REGISTER don't re-read
+    # the whole file every time.
+    #
+    # The file is reloaded only when its (inode, mtime, size) changes, i.e.
+    # when something else - another worker process, or a manual edit -
+    # touched it. Our own registrations update the dict in place.
+
+    def __init__(self, path=USERS_FILE):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._users = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _reload_if_changed(self, have_file_lock=False):
+        # Must be called with self._lock held.
+        signature = self._file_signature()
+        if signature == self._signature:
+            return
+
+        if have_file_lock:
+            self._users = load_users(self.path)
+        else:
+            # The shared lock keeps us from reading a half-appended line
+            with file_lock(self.lock_path, shared=True):
+                signature = self._file_signature()
+                self._users = load_users(self.path)
+        self._signature = signature
+
+    def get_password(self, username):
+        # Returns the stored password for a user, or None.
+        # Fast path: one stat() to confirm nothing changed, then a dict lookup.
+        if self._file_signature() != self._signature:
+            with self._lock:
+                self._reload_if_changed()
+        return self._users.get(username)
+
+    def authenticate(self, username, password):
+        # Verifies if username and password match stored credentials.
+        stored = self.get_password(username)
+        return stored is not None and stored == password
+
+    def register(self, username, password):
+        # Adds a user if the name is free. Returns False if it's taken.
+        # The thread lock and the file lock together guarantee that two
+        # registrations for the same name - in this process or another -
+        # can't both succeed.
+        with self._lock:
+            with file_lock(self.lock_path):
+                self._reload_if_changed(have_file_lock=True)
+                if username in self._users:
+                    return False
+                save_user(username, password, self.path)
+                self._users[username] = password
+                self._signature = self._file_signature()
+        return True
+
+    def __len__(self):
+        return len(self._users)
+
+# ============================================================================
+# SQLITE BACKEND
+# ============================================================================
+
+class SQLiteUserStore:
+    # Users in a SQLite database with username as the primary key, so a
+    # lookup is an O(log n) B-tree search no matter how many accounts there
+    # are. WAL mode lets readers in every thread and worker process run
+    # while one writer registers a user.
+    #
+    # sqlite3 connections can't be shared between threads, so each thread
+    # (and each forked worker process) opens its own on first use.
+    # Parameterised queries are prepared once and reused by sqlite3's
+    # statement cache.
+
+    def __init__(self, path=USERS_DB):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    password TEXT NOT NULL
+                ) WITHOUT ROWID
+            """)
+
+    def _connect(self):
+        # Returns this thread's connection, opening it if needed.
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def get_password(self, username):
+        row = self._connect().execute(
+            "SELECT password FROM users WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else None
+
+    def authenticate(self, username, password):
+        # Verifies if username and password match stored credentials.
+        stored = self.get_password(username)
+        return stored is not None and stored == password
+
+    def register(self, username, password):
+        # The primary key makes check-and-insert a single atomic statement.
+        with self._connect() as db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)",
+                (username, password))
+        return cursor.rowcount == 1
+
+    def import_users_file(self, txt_path=USERS_FILE):
+        # One-shot import of an existing users.txt. Later lines win, the
+        # same way load_users() treats duplicates. Returns the user count.
+        users = load_users(txt_path)
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO users (username, password) VALUES (?, ?)",
+                users.items())
+        return len(users)
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+# ============================================================================
+# BACKEND SELECTION
+# ============================================================================
+
+BACKENDS = ('text', 'sqlite')
+
+def open_user_store(backend='text', path=None):
+    # Returns a user store for the named backend.
+    if backend == 'text':
+        return UserIndex(path or USERS_FILE)
+    if backend == 'sqlite':
+        return SQLiteUserStore(path or USERS_DB)
+    raise ValueError(f"Unknown user store backend: {backend}")
+
+# ============================================================================
+# MIGRATION TOOL
+# ============================================================================
+
+def main():
+    # python user_store.py import [users.txt] [users.db]
+    parser = argparse.ArgumentParser(description="User store tools")
+    sub = parser.add_subparsers(dest='command')
+    imp = sub.add_parser('import', help="copy users.txt into a SQLite database")
+    imp.add_argument('source', nargs='?', default=USERS_FILE)
+    imp.add_argument('database', nargs='?', default=USERS_DB)
+    args = parser.parse_args()
+
+    if args.command != 'import':
+        parser.print_help()
+        return
+
+    store = SQLiteUserStore(args.database)
+    count = store.import_users_file(args.source)
+    print(f"[IMPORTED] {count} users from {args.source} into {args.database} "
+          f"({len(store)} users total).")
+
+if __name__ == "__main__":
+    main()